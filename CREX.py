@@ -1,24 +1,38 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-from io import BytesIO
-from datetime import datetime
-import openpyxl
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Alignment, Border, Side, Protection
-from openpyxl.worksheet.datavalidation import DataValidation
-from concurrent.futures import ThreadPoolExecutor
-import time
+import os
+import threading
 
-st.set_page_config(
-    page_title="Transavia - Traitement CREX",
-    page_icon="✈️",
-    layout="wide"
+# Cœur du traitement, réexporté pour les scripts qui importent CREX
+from crex_core import (
+    AUCUNE_NOUVELLE_LIGNE,
+    BUDGET_MEMOIRE_OCTETS,
+    AXES_SYNTHESE,
+    CACHE_DISQUE_DIR,
+    JOURNAL_METRIQUES,
+    TAILLE_CACHE_DISQUE_OCTETS,
+    TAILLE_CACHE_MEMOIRE_OCTETS,
+    CacheResultats,
+    cle_resultat,
+    coeurs_disponibles,
+    construire_synthese,
+    creer_excel_avec_formatage_optimise,
+    exporter_donnees,
+    feuilles_creees,
+    format_date_french,
+    formats_export_disponibles,
+    percentiles_journal,
+    traiter_exactement_comme_vba,
+    traiter_feuille_optimise,
+    vue_synthese,
 )
+from crex_historique import HISTORIQUE_DEFAUT, HistoriqueLignes
+from crex_taches import EN_ATTENTE, FileAttentePleine, FileTraitements
+
+LIBELLES_SYNTHESE = {"origine": "Par origine", "catering": "Par catering", "jour": "Par jour", "avion": "Par avion"}
+LIBELLES_EXPORT = {"parquet": "Parquet", "csv": "CSV", "arrow": "Arrow IPC"}
 
 # CSS personnalisé - Thème TransaviaFR
-st.markdown("""
+CSS_TRANSAVIA = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
     
@@ -174,353 +188,274 @@ st.markdown("""
         margin: 1rem 0;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-def format_date_french(date_obj):
-    """Format date en français de manière optimisée"""
-    if pd.isna(date_obj):
-        return ""
-    try:
-        if isinstance(date_obj, pd.Timestamp):
-            days_fr = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
-            months_fr = ["janvier", "février", "mars", "avril", "mai", "juin", 
-                        "juillet", "août", "septembre", "octobre", "novembre", "décembre"]
-            return f"{days_fr[date_obj.weekday()]} {date_obj.day} {months_fr[date_obj.month - 1]}"
-    except:
-        pass
-    return str(date_obj)
+def configurer_page():
+    """Configuration de la page et thème (premières commandes Streamlit de chaque exécution)"""
+    st.set_page_config(
+        page_title="Transavia - Traitement CREX",
+        page_icon="✈️",
+        layout="wide"
+    )
+    st.markdown(CSS_TRANSAVIA, unsafe_allow_html=True)
 
-def traiter_feuille_optimise(sheet_name, df):
-    """Traitement optimisé d'une feuille Excel"""
-    if len(df) < 2:
-        return []
-    
-    # Filtrer les lignes qui ne sont pas des titres
-    mask = pd.Series([True] * len(df), index=df.index)
-    
-    # Analyser la colonne 0 pour les titres
-    if 0 in df.columns:
-        col0 = df.iloc[:, 0].astype(str).str.strip().str.upper()
-        
-        # Titres à exclure
-        titres_exclus = {"AUTRES", "PRODUIT", "SERVICE", "EQUIPEMENT", "AUTRE"}
-        mask_titre = col0.isin(titres_exclus) | (col0.str.len() > 50)
-        
-        # Exclure les titres et la première ligne (en-tête)
-        mask = ~mask_titre
-        mask.iloc[0] = False  # Exclure l'en-tête
-    
-    # Appliquer le masque
-    df_filtered = df[mask].copy()
-    
-    if len(df_filtered) == 0:
-        return []
-    
-    # Convertir les dates de manière vectorisée
-    dates_valides = []
-    for idx, row in df_filtered.iterrows():
-        try:
-            date_val = pd.to_datetime(row.iloc[0] if 0 in row.index else None)
-            if pd.notna(date_val):
-                dates_valides.append(True)
-            else:
-                dates_valides.append(False)
-        except:
-            dates_valides.append(False)
-    
-    df_filtered = df_filtered[dates_valides].copy()
-    
-    if len(df_filtered) == 0:
-        return []
-    
-    # Extraire les données de manière optimisée
-    data_rows = []
-    for idx, row in df_filtered.iterrows():
-        try:
-            date_val = pd.to_datetime(row.iloc[0])
-            data_row = {
-                'Date Vol': date_val,
-                'Aircraft Registration': row.iloc[2] if len(row) > 2 else '',
-                'Flight Number': row.iloc[3] if len(row) > 3 else '',
-                'Origin': row.iloc[4] if len(row) > 4 else '',
-                'Destination': row.iloc[5] if len(row) > 5 else '',
-                'Catering': row.iloc[7] if len(row) > 7 else '',
-                'Non Conformité': row.iloc[8] if len(row) > 8 else '',
-                'Event Title': row.iloc[9] if len(row) > 9 else '',
-                'General Remarks': row.iloc[10] if len(row) > 10 else '',
-            }
-            data_rows.append(data_row)
-        except:
-            continue
-    
-    return data_rows
+@st.cache_resource
+def obtenir_cache_resultats():
+    """Cache partagé par toutes les sessions Streamlit"""
+    return CacheResultats(TAILLE_CACHE_MEMOIRE_OCTETS, CACHE_DISQUE_DIR, TAILLE_CACHE_DISQUE_OCTETS)
 
-def traiter_exactement_comme_vba(uploaded_file, progress_bar=None):
-    """Version optimisée du traitement VBA"""
-    try:
-        start_time = time.time()
-        
-        # Lire toutes les feuilles en une fois
-        xls = pd.ExcelFile(uploaded_file, engine='openpyxl')
-        
-        # Filtrer les feuilles (sauf EXPORT)
-        sheet_names = [name for name in xls.sheet_names if name.upper() != "EXPORT"]
-        
-        all_data = []
-        
-        if progress_bar:
-            progress_bar.progress(10, text="Lecture des feuilles...")
-        
-        # Traiter chaque feuille
-        for i, sheet_name in enumerate(sheet_names):
-            try:
-                # Lire la feuille sans en-tête pour traiter toutes les lignes
-                df = pd.read_excel(xls, sheet_name=sheet_name, header=None, engine='openpyxl')
-                
-                # Traiter la feuille
-                data_rows = traiter_feuille_optimise(sheet_name, df)
-                all_data.extend(data_rows)
-                
-                if progress_bar and sheet_names:
-                    progress_value = 10 + int((i + 1) / len(sheet_names) * 40)
-                    progress_bar.progress(progress_value, text=f"Traitement feuille {i+1}/{len(sheet_names)}...")
-                    
-            except Exception as e:
-                st.warning(f"Erreur sur la feuille {sheet_name}: {str(e)}")
-                continue
-        
-        if not all_data:
-            return None, "Aucune donnée valide trouvée dans le fichier.", None
-        
-        if progress_bar:
-            progress_bar.progress(60, text="Organisation des données...")
-        
-        # Créer DataFrame
-        df_all = pd.DataFrame(all_data)
-        
-        # Nettoyer les données
-        origins_valides = {"ORY", "MRS", "LYS", "NTE", "BRU", "MPL", "RNS", "BOD", "TLS"}
-        
-        # Optimiser la création des feuilles par origine
-        nouvelles_feuilles = {}
-        
-        # Grouper par origine de manière vectorisée
-        if 'Origin' in df_all.columns:
-            df_all['Origin_clean'] = df_all['Origin'].astype(str).str.strip().str.upper()
-            
-            # Séparer les origines valides et "Autre"
-            mask_valide = df_all['Origin_clean'].isin(origins_valides)
-            df_all['Sheet_Name'] = df_all['Origin_clean'].where(mask_valide, "Autre")
-            
-            # Grouper par nom de feuille
-            grouped = df_all.groupby('Sheet_Name')
-            
-            for sheet_name, group in grouped:
-                nouvelles_feuilles[sheet_name] = []
-                
-                # Préparer les données pour cette feuille
-                for _, row in group.iterrows():
-                    ligne_complete = {
-                        'Date Vol': row['Date Vol'],
-                        'Aircraft Registration': row['Aircraft Registration'],
-                        'Flight Number': row['Flight Number'],
-                        'Origin': row['Origin'],
-                        'Destination': row['Destination'],
-                        'Catering': row['Catering'],
-                        'Non Conformité': row['Non Conformité'],
-                        'Event Title': row['Event Title'],
-                        'General Remarks': row['General Remarks'],
-                        'Accepté/Refusé': None,
-                        'Commentaire': None,
-                        'Autre': None,
-                        'KAM / TO': None,
-                        'Commentaire_2': None
-                    }
-                    nouvelles_feuilles[sheet_name].append(ligne_complete)
+@st.cache_resource
+def obtenir_historique():
+    """Historique des lignes traitées, partagé par toutes les sessions"""
+    return HistoriqueLignes(HISTORIQUE_DEFAUT)
+
+@st.cache_resource
+def verrou_sorties_disque():
+    """Verrou des lectures de classeurs sur disque, partagés par les sessions regroupées"""
+    return threading.Lock()
+
+@st.cache_resource
+def obtenir_file_traitements():
+    """Traitements en arrière-plan, partagés par toutes les sessions"""
+    return FileTraitements(cache=obtenir_cache_resultats())
+
+def afficher_mesures(spans):
+    """Détail des spans par étape et par feuille, et percentiles du journal s'il est configuré"""
+    if not spans:
+        return
+    import pandas as pd
+    
+    with st.expander("⏱️ Détail des performances"):
+        st.dataframe(pd.DataFrame(spans), hide_index=True, use_container_width=True)
+        if JOURNAL_METRIQUES and os.path.exists(JOURNAL_METRIQUES):
+            st.markdown("**Historique des exécutions (secondes)**")
+            st.dataframe(percentiles_journal(JOURNAL_METRIQUES), hide_index=True, use_container_width=True)
+
+def afficher_fichiers(spans):
+    """Lecture de chaque fichier d'une fusion (lignes, durée) et lignes communes à plusieurs fichiers"""
+    fichiers = [span for span in spans or () if span["nom"] == "fichier"]
+    if not fichiers:
+        return
+    import pandas as pd
+    
+    st.markdown("**Fichiers fusionnés**")
+    st.dataframe(pd.DataFrame({
+        "Fichier": [span["fichier"] for span in fichiers],
+        "Lignes lues": [span.get("lignes_entree", 0) for span in fichiers],
+        "Lignes retenues": [span.get("lignes_sortie", 0) for span in fichiers],
+        "Secondes": [round(span["secondes"], 2) for span in fichiers],
+    }), hide_index=True, use_container_width=True)
+    fusion = next((span for span in spans if span["nom"] == "fusion"), None)
+    if fusion:
+        st.caption(f"{fusion['doublons']:,} lignes présentes dans plusieurs fichiers écrites une seule fois")
+
+@st.fragment
+def afficher_synthese(synthese):
+    """Non-conformités par origine, catering, jour ou avion, calculées sur les agrégats du résultat
+
+    Fragment : changer de vue ou de filtre ne ré-exécute que ce bloc, sans regrouper df_all.
+    """
+    with st.expander("📊 Synthèse des non-conformités", expanded=True):
+        axe = st.radio("Vue", options=list(AXES_SYNTHESE), format_func=LIBELLES_SYNTHESE.get,
+                       horizontal=True, key="synthese_axe")
+        agregats = synthese["origine"]
+        col_f1, col_f2 = st.columns(2)
+        with col_f1:
+            feuilles = st.multiselect("Feuilles", options=sorted(agregats["Sheet_Name"].dropna().unique(), key=str),
+                                      key="synthese_feuilles")
+        with col_f2:
+            non_conformites = st.multiselect(
+                "Non-conformités", options=sorted(agregats["Non Conformité"].dropna().unique(), key=str),
+                key="synthese_non_conformites"
+            )
+        vue = vue_synthese(synthese, axe, feuilles, non_conformites)
+        colonne = AXES_SYNTHESE[axe]
+        if axe == "jour":
+            st.line_chart(vue, x=colonne, y="Événements")
         else:
-            # Fallback si pas de colonne Origin
-            nouvelles_feuilles["Autre"] = []
-            for _, row in df_all.iterrows():
-                ligne_complete = {
-                    'Date Vol': row['Date Vol'],
-                    'Aircraft Registration': row['Aircraft Registration'],
-                    'Flight Number': row['Flight Number'],
-                    'Origin': row.get('Origin', ''),
-                    'Destination': row.get('Destination', ''),
-                    'Catering': row['Catering'],
-                    'Non Conformité': row['Non Conformité'],
-                    'Event Title': row['Event Title'],
-                    'General Remarks': row['General Remarks'],
-                    'Accepté/Refusé': None,
-                    'Commentaire': None,
-                    'Autre': None,
-                    'KAM / TO': None,
-                    'Commentaire_2': None
-                }
-                nouvelles_feuilles["Autre"].append(ligne_complete)
-        
-        if progress_bar:
-            progress_bar.progress(80, text="Création de la consolidation...")
-        
-        # Créer la feuille Consolidation avec formules
-        consolidation_data = []
-        for sheet_name, data in nouvelles_feuilles.items():
-            for idx in range(len(data)):
-                row_num = idx + 2
-                row_copy = {
-                    'Date Vol': f"='{sheet_name}'!A{row_num}",
-                    'Aircraft Registration': f"='{sheet_name}'!B{row_num}",
-                    'Flight Number': f"='{sheet_name}'!C{row_num}",
-                    'Origin': f"='{sheet_name}'!D{row_num}",
-                    'Destination': f"='{sheet_name}'!E{row_num}",
-                    'Catering': f"='{sheet_name}'!F{row_num}",
-                    'Non Conformité': f"='{sheet_name}'!G{row_num}",
-                    'Event Title': f"='{sheet_name}'!H{row_num}",
-                    'General Remarks': f"='{sheet_name}'!I{row_num}",
-                    'Accepté/Refusé': f"='{sheet_name}'!J{row_num}",
-                    'Commentaire': f"='{sheet_name}'!K{row_num}",
-                    'Autre': f"='{sheet_name}'!L{row_num}",
-                    'KAM / TO': f"='{sheet_name}'!M{row_num}",
-                    'Commentaire_2': f"='{sheet_name}'!N{row_num}",
-                }
-                consolidation_data.append(row_copy)
-        
-        nouvelles_feuilles['Consolidation'] = consolidation_data
-        
-        if progress_bar:
-            progress_bar.progress(90, text="Génération du fichier Excel...")
-        
-        # Créer le fichier Excel
-        excel_output = creer_excel_avec_formatage_optimise(nouvelles_feuilles)
-        
-        end_time = time.time()
-        processing_time = end_time - start_time
-        
-        if progress_bar:
-            progress_bar.progress(100, text=f"Terminé en {processing_time:.1f} secondes")
-        
-        return excel_output, None, df_all
-        
-    except Exception as e:
-        return None, f"Erreur lors du traitement: {str(e)}", None
+            # Les 30 valeurs les plus fréquentes
+            st.bar_chart(vue.head(30).astype({colonne: str}), x=colonne, y="Événements", sort="-Événements")
+        st.dataframe(vue, hide_index=True, use_container_width=True)
 
-def creer_excel_avec_formatage_optimise(nouvelles_feuilles):
-    """Version optimisée de la création Excel + protection (Option A) avec colonnes J et K déverrouillées"""
-    try:
-        output = BytesIO()
-        wb = Workbook()
-        wb.remove(wb.active)
-        
-        # Préparer les styles une seule fois
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        wrap_alignment = Alignment(wrap_text=True, vertical='top')
-        center_alignment = Alignment(horizontal='center', vertical='center')
-        
-        headers = [
-            "Date Vol", "Aircraft Registration", "Flight Number", "Origin", "Destination",
-            "Catering", "Non Conformité", "Event Title", "General Remarks",
-            "Accepté/Refusé", "Commentaire", "Autre", "KAM / TO", "Commentaire_2"
-        ]
-        
-        for sheet_name, data in nouvelles_feuilles.items():
-            ws = wb.create_sheet(title=sheet_name)
-            
-            # Ajouter les en-têtes
-            for col_idx, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col_idx, value=header)
-                cell.font = openpyxl.styles.Font(bold=True, color="003366")
-                cell.border = thin_border
-                cell.alignment = center_alignment
-                cell.fill = openpyxl.styles.PatternFill(start_color="FFE6CC", end_color="FFE6CC", fill_type="solid")
-            
-            # Ajouter les données
-            if isinstance(data, list):
-                for row_idx, row_data in enumerate(data, 2):
-                    for col_idx, col_name in enumerate(headers, 1):
-                        value = row_data.get(col_name)
+def nom_resultat(fichiers):
+    """Nom du classeur produit : celui du fichier téléversé, ou du premier fichier suivi de _fusion"""
+    if len(fichiers) == 1:
+        return fichiers[0].name
+    base = fichiers[0].name[:-len('.xlsx')] if fichiers[0].name.lower().endswith('.xlsx') else fichiers[0].name
+    return f"{base}_fusion.xlsx"
 
-                        # Si c'est une formule Excel (ex: "='Feuille'!A2"), on l'écrit telle quelle
-                        if isinstance(value, str) and value.startswith("="):
-                            cell = ws.cell(row=row_idx, column=col_idx, value=value)
-                        else:
-                            # Formater les dates
-                            if col_name == "Date Vol" and value is not None:
-                                try:
-                                    # Ne formater que si c'est une vraie date, pas une formule
-                                    if isinstance(value, pd.Timestamp):
-                                        value = format_date_french(value)
-                                    else:
-                                        # tenter conversion si type date-like
-                                        value = format_date_french(pd.to_datetime(value))
-                                except:
-                                    pass
-                            cell = ws.cell(row=row_idx, column=col_idx, value=value)
+def afficher_plan(spans):
+    """Plan d'exécution retenu et son estimation (span "plan")"""
+    plan = next((span for span in spans or () if span["nom"] == "plan"), None)
+    if plan is None:
+        return
+    tampons = "sur disque" if plan["tampons"] == "disque" else "en mémoire"
+    st.caption(
+        f"Plan : lecture {plan['moteur_lecture']} · {plan['nb_workers']} processus · "
+        f"écriture {plan['moteur_ecriture']} · tampons {tampons} "
+        f"(XML des feuilles {plan['octets_xml'] / 1024 ** 2:.0f} Mo, "
+        f"pic estimé {plan['pic_estime'] / 1024 ** 2:.0f} Mo)"
+    )
 
-                        cell.border = thin_border
-                        
-                        # Appliquer les alignements
-                        if col_idx in [6, 7, 8, 9, 10, 11, 12, 13, 14]:
-                            cell.alignment = wrap_alignment
-                        elif col_idx == 1:
-                            cell.alignment = Alignment(wrap_text=True, vertical='top')
-                        else:
-                            cell.alignment = Alignment(vertical='top')
-            
-            # Ajuster les largeurs de colonnes
-            column_widths = {
-                'A': 20, 'B': 15, 'C': 15, 'D': 10, 'E': 10,
-                'F': 30, 'G': 30, 'H': 30, 'I': 50,
-                'J': 15, 'K': 30, 'L': 20, 'M': 15, 'N': 30
-            }
-            for col, width in column_widths.items():
-                ws.column_dimensions[col].width = width
-            
-            # Ajouter les validations de données si nécessaire
-            if isinstance(data, list) and len(data) > 0:
-                last_row = len(data) + 1
-                if last_row >= 2:
-                    # Validation pour la colonne J
-                    dv_j = DataValidation(
-                        type="list",
-                        formula1='"Accepté,Refusé,N/A"',
-                        allow_blank=True
-                    )
-                    dv_j.add(f'J2:J{last_row}')
-                    ws.add_data_validation(dv_j)
-                    
-                    # Validation pour la colonne M
-                    dv_m = DataValidation(
-                        type="list",
-                        formula1='"Accepté,Refusé,N/A"',
-                        allow_blank=True
-                    )
-                    dv_m.add(f'M2:M{last_row}')
-                    ws.add_data_validation(dv_m)
+def afficher_profil(profil, nom_fichier):
+    """Fonctions et sites d'allocation les plus coûteux, profil et piles repliées téléchargeables"""
+    base = nom_fichier[:-len('.xlsx')] if nom_fichier.lower().endswith('.xlsx') else nom_fichier
+    with st.expander("🔬 Profil d'exécution"):
+        st.markdown("**Fonctions (temps propre)**")
+        st.dataframe(profil.top_fonctions(30), hide_index=True, use_container_width=True)
+        st.markdown(f"**Mémoire retenue en fin d'exécution** (pic tracé : {profil.pic_memoire_octets / 1024 ** 2:.1f} Mo)")
+        st.dataframe(profil.top_allocations(20), hide_index=True, use_container_width=True)
+        col_p1, col_p2 = st.columns(2)
+        with col_p1:
+            st.download_button(
+                label="📥 Profil (.pstats)",
+                data=profil.fichier_pstats,
+                file_name=f"{base}.pstats",
+                mime="application/octet-stream",
+                use_container_width=True
+            )
+        with col_p2:
+            st.download_button(
+                label="📥 Piles repliées (flamegraph)",
+                data=lambda: profil.piles_repliees().encode("utf-8"),
+                file_name=f"{base}.piles.txt",
+                mime="text/plain",
+                use_container_width=True
+            )
 
-                    # 🔓 Déverrouiller colonnes J et K (10 et 11) pour toutes les lignes de données
-                    for col in [10, 11]:
-                        for r in range(2, last_row + 1):
-                            ws.cell(row=r, column=col).protection = Protection(locked=False)
-            
-            # 🔒 Protection de la feuille (Option A)
-            ws.protection.sheet = True
-            # facultatif selon versions : ws.protection.enable()
-            ws.protection.set_password('newrest2025')
-        
-        wb.save(output)
-        output.seek(0)
-        return output
-        
-    except Exception as e:
-        st.error(f"Erreur lors de la création du fichier: {str(e)}")
-        return None
+def afficher_resultat(nom_fichier, resultat, depuis_cache=False, exports=()):
+    """Affiche les métriques et les boutons de téléchargement d'un résultat
+    
+    exports : formats de données proposés en plus du classeur, générés au clic depuis df_all
+    """
+    df_data = resultat['df_all']
+    st.markdown('<div class="success-card">', unsafe_allow_html=True)
+    
+    col_s1, col_s2, col_s3 = st.columns(3)
+    
+    with col_s1:
+        st.metric("✅ Traitement terminé", "Cache" if depuis_cache else "Succès")
+    
+    with col_s2:
+        total_lignes = len(df_data) if df_data is not None else 0
+        st.metric("📈 Lignes traitées", f"{total_lignes:,}")
+    
+    with col_s3:
+        st.metric("📑 Feuilles créées", feuilles_creees(resultat.get('spans')))
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    durees = resultat['durees']
+    if durees:
+        libelles = {'lecture': "lecture", 'fusion': "fusion", 'organisation': "organisation",
+                    'consolidation': "consolidation", 'ecriture': "écriture", 'total': "total"}
+        st.caption(" · ".join(f"{libelles[etape]} {durees[etape]:.2f} s" for etape in libelles if etape in durees))
+    afficher_plan(resultat.get('spans'))
+    
+    afficher_fichiers(resultat.get('spans'))
+    
+    # Résultat antérieur à la synthèse pré-calculée : construite une fois et conservée avec lui
+    if resultat.get('synthese') is None and df_data is not None:
+        resultat['synthese'] = construire_synthese(df_data)
+    if resultat.get('synthese') is not None:
+        afficher_synthese(resultat['synthese'])
+    afficher_mesures(resultat.get('spans'))
+    
+    # Téléchargement avec le même nom que le fichier d'entrée
+    st.markdown("### 📥 Télécharger le résultat")
+    
+    # Préparation du nom de fichier (même nom que l'entrée)
+    input_filename = nom_fichier
+    # Assurer l'extension .xlsx
+    if not input_filename.lower().endswith('.xlsx'):
+        input_filename = f"{input_filename}.xlsx"
+    
+    # Afficher l'info sur le nom du fichier
+    st.markdown(f"""
+    <div class="filename-info">
+    <strong>📝 Nom du fichier de sortie :</strong><br>
+    <code>{input_filename}</code>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    col_d1, col_d2 = st.columns([3, 1])
+    with col_d1:
+        st.info(f"Le fichier traité '{input_filename}' est prêt à être téléchargé")
+    
+    with col_d2:
+        excel = resultat['excel']
+        if excel is not None and not isinstance(excel, bytes):
+            # Classeur sur disque (mode mémoire bornée) : lu seulement au clic
+            flux = excel
+            def excel():
+                # Téléchargements servis dans des threads séparés : seek et read ne doivent pas s'entrelacer
+                with verrou_sorties_disque():
+                    flux.seek(0)
+                    return flux.read()
+        if excel is not None:
+            st.download_button(
+                label="📥 Télécharger",
+                data=excel,
+                file_name=input_filename,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True,
+                type="secondary"
+            )
+        # Archives zip des partitions par feuille et par mois
+        base = input_filename[:-len('.xlsx')]
+        for format_export in exports:
+            st.download_button(
+                label=f"📦 {LIBELLES_EXPORT[format_export]}",
+                data=lambda format_export=format_export: exporter_donnees(df_data, format_export).getvalue(),
+                file_name=f"{base}_{format_export}.zip",
+                mime="application/zip",
+                use_container_width=True,
+                key=f"export_{format_export}"
+            )
+
+@st.fragment(run_every=1.0)
+def suivre_tache(file_traitements, identifiant):
+    """Progression d'une tâche, rafraîchie chaque seconde jusqu'à sa fin"""
+    tache = file_traitements.obtenir(identifiant)
+    if tache is None or tache.terminee:
+        st.rerun()
+    if tache.statut == EN_ATTENTE:
+        st.progress(0, text=f"En attente : position {file_traitements.position(tache)} dans la file")
+    else:
+        st.progress(tache.progression, text=tache.texte)
+
+def afficher_tache(identifiant, nom_fichier=None, cle_contenu=None, exports=()):
+    """Suit la tâche tant qu'elle n'est pas terminée, puis affiche ses messages et son résultat
+
+    nom_fichier : nom du résultat pour le fichier actuellement téléversé (par défaut celui de la tâche)
+    cle_contenu : empreinte de ce fichier ; une tâche portant sur un autre contenu est ignorée.
+    Une tâche partagée avec une autre session est affichée sous le nom du téléversement courant.
+    """
+    file_traitements = obtenir_file_traitements()
+    tache = file_traitements.obtenir(identifiant)
+    if tache is None:
+        st.warning("Ce traitement n'est plus disponible, relancez-le.")
+        return
+    if cle_contenu is not None and tache.cle_contenu != cle_contenu:
+        return
+    nom_fichier = nom_fichier or tache.nom_fichier
+    if not tache.terminee:
+        suivre_tache(file_traitements, identifiant)
+        return
+    for message in tache.avertissements:
+        st.warning(message)
+    if tache.profil is not None:
+        afficher_profil(tache.profil, nom_fichier)
+    if tache.erreur == AUCUNE_NOUVELLE_LIGNE:
+        st.info(f"ℹ️ {tache.erreur}")
+    elif tache.erreur:
+        st.error(f"⚠️ {tache.erreur}")
+    else:
+        afficher_resultat(nom_fichier, tache.resultat, exports=exports)
 
 def main():
+    configurer_page()
+    
     # Header avec logo Transavia
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
@@ -566,6 +501,133 @@ def main():
         
         st.markdown("---")
         
+        # Options de traitement
+        st.markdown('<p class="sidebar-title">⚙️ Options</p>', unsafe_allow_html=True)
+        planifier = st.checkbox(
+            "Plan automatique",
+            value=True,
+            help="Moteurs de lecture et d'écriture, processus parallèles et tampons choisis selon la taille "
+                 "du fichier, la mémoire disponible et les cœurs"
+        )
+        moteur_lecture = st.selectbox(
+            "Moteur de lecture",
+            options=["pandas", "streaming"],
+            format_func=lambda m: {"pandas": "Standard (pandas)", "streaming": "Flux (lecture seule)"}[m],
+            disabled=planifier,
+            help="Le mode flux lit les feuilles ligne par ligne sans charger de DataFrame complète"
+        )
+        moteur_filtre = st.selectbox(
+            "Moteur de filtrage",
+            options=["vectorise", "legacy"],
+            format_func=lambda m: {"vectorise": "Vectorisé", "legacy": "Ligne à ligne (ancien)"}[m],
+            disabled=moteur_lecture != "pandas",
+            help="Utilisé avec le moteur de lecture standard"
+        )
+        verifier_legacy = st.checkbox(
+            "Vérifier contre l'ancien moteur",
+            value=False,
+            disabled=moteur_lecture != "pandas" or moteur_filtre != "vectorise",
+            help="Exécute aussi le filtrage ligne à ligne et signale toute différence"
+        )
+        moteur_ecriture = st.selectbox(
+            "Moteur d'écriture",
+            options=["standard", "streaming", "natif"],
+            format_func=lambda m: {
+                "standard": "Standard (en mémoire)", "streaming": "Flux (write-only)", "natif": "Natif (SpreadsheetML)"
+            }[m],
+            disabled=planifier,
+            help="Le mode flux écrit les lignes au fil de l'eau avec des styles partagés ; "
+                 "le mode natif écrit directement le fichier xlsx"
+        )
+        compression = st.radio(
+            "Compression",
+            options=["rapide", "compact"],
+            format_func=lambda c: {"rapide": "Rapide", "compact": "Fichier plus petit"}[c],
+            horizontal=True,
+            disabled=moteur_ecriture != "natif" and not planifier
+        )
+        consolidation = st.radio(
+            "Consolidation",
+            options=["partagee", "simple"],
+            format_func=lambda c: {"partagee": "Formules partagées", "simple": "Une formule par cellule"}[c],
+            horizontal=True,
+            disabled=moteur_ecriture != "natif" and not planifier,
+            help="Formules partagées avec valeurs en cache : ouverture sans recalcul complet"
+        )
+        exports = st.multiselect(
+            "Exports de données",
+            options=formats_export_disponibles(),
+            format_func=LIBELLES_EXPORT.get,
+            help="Lignes retenues (avec Origin_clean et Sheet_Name) partitionnées par feuille et par mois, "
+                 "en archive zip ; Parquet et Arrow nécessitent pyarrow"
+        )
+        sans_excel = st.checkbox(
+            "Sans classeur Excel",
+            value=False,
+            disabled=not exports,
+            help="Seuls les exports de données sont produits"
+        ) and bool(exports)
+        nb_workers = st.number_input(
+            "Processus parallèles",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=1,
+            disabled=planifier,
+            help="Lecture des feuilles répartie sur plusieurs processus (fichiers de plus de 1 Mo)"
+        )
+        tracer_memoire = st.checkbox(
+            "Mesurer la mémoire",
+            value=False,
+            help="Pic mémoire par étape (tracemalloc) ; ralentit le traitement"
+        )
+        profiler = st.checkbox(
+            "Profiler ce traitement",
+            value=False,
+            help="Temps par fonction (cProfile) et sites d'allocation (tracemalloc), téléchargeables ; "
+                 "ralentit fortement le traitement, à réserver aux fichiers anormalement lents"
+        )
+        memoire_bornee = st.checkbox(
+            "Mémoire bornée",
+            value=BUDGET_MEMOIRE_OCTETS is not None,
+            help="Fichier lu depuis le disque, résultat écrit dans un fichier temporaire ; "
+                 "moteurs de flux choisis si le budget risque d'être dépassé"
+        )
+        budget_memoire_mo = st.number_input(
+            "Budget mémoire (Mo)",
+            min_value=64,
+            value=(BUDGET_MEMOIRE_OCTETS or 512 * 1024 ** 2) // 1024 ** 2,
+            step=64,
+            disabled=not memoire_bornee
+        )
+        mode_incremental = st.selectbox(
+            "Traitement incrémental",
+            options=[None, "nouvelles", "complet"],
+            format_func=lambda m: {
+                None: "Désactivé", "nouvelles": "Nouvelles lignes uniquement",
+                "complet": "Classeur complet, annotations reprises"
+            }[m],
+            help="Les lignes déjà traitées sont reconnues d'un export cumulatif à l'autre"
+        )
+        if mode_incremental:
+            classeurs_annotes = st.file_uploader(
+                "Importer des classeurs annotés",
+                type=['xlsx'],
+                accept_multiple_files=True,
+                help="Classeurs de sortie dont les colonnes J à N ont été remplies"
+            )
+            if classeurs_annotes and st.button("📥 Importer les annotations"):
+                resumes = obtenir_historique().importer_classeurs(classeurs_annotes, coeurs_disponibles())
+                importes = [r for r in resumes.values() if r["statut"] == "importe"]
+                st.success(
+                    f"{len(importes)} classeur(s) importé(s), {sum(r['annotees'] for r in importes)} lignes annotées"
+                    f" · {sum(r['statut'] == 'deja_importe' for r in resumes.values())} déjà importé(s)"
+                )
+                for nom, resume in resumes.items():
+                    if resume["statut"] == "erreur":
+                        st.error(f"⚠️ {nom} : {resume['erreur']}")
+        
+        st.markdown("---")
+        
         st.markdown("""
         <div style="text-align: center; margin-top: 2rem;">
             <p style="color: #666; font-size: 0.8rem;">Version 1.1 (Optimisée)</p>
@@ -578,105 +640,94 @@ def main():
     
     col1, col2 = st.columns([3, 1])
     with col1:
-        st.markdown("### 📤 Déposer votre fichier CREX")
-        st.markdown("Téléversez le fichier Excel à transformer")
+        st.markdown("### 📤 Déposer vos fichiers CREX")
+        st.markdown("Téléversez le fichier Excel à transformer, ou plusieurs fichiers à fusionner")
     with col2:
         st.markdown('<div class="metric-card">', unsafe_allow_html=True)
         st.markdown('<div class="metric-value">.xlsx</div>', unsafe_allow_html=True)
         st.markdown('<div class="metric-label">Format accepté</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
-    uploaded_file = st.file_uploader(
+    uploaded_files = st.file_uploader(
         "",
         type=['xlsx'],
+        accept_multiple_files=True,
         label_visibility="collapsed",
-        help="Sélectionnez votre fichier Excel à traiter"
+        help="Sélectionnez votre fichier Excel à traiter ; plusieurs fichiers (semaines, escales) "
+             "sont fusionnés en un seul classeur, sans doublon"
     )
     
     st.markdown('</div>', unsafe_allow_html=True)
     
-    if uploaded_file is not None:
+    if uploaded_files:
+        # Plusieurs fichiers : lus en parallèle et fusionnés dans un seul classeur
+        nom_fichier = nom_resultat(uploaded_files)
+        
         # Informations sur le fichier
         col1, col2, col3 = st.columns(3)
         
         with col1:
             st.markdown('<div class="file-info-card">', unsafe_allow_html=True)
-            st.markdown(f"**📄 Fichier source :** {uploaded_file.name}")
+            if len(uploaded_files) == 1:
+                st.markdown(f"**📄 Fichier source :** {nom_fichier}")
+            else:
+                st.markdown(f"**📄 {len(uploaded_files)} fichiers sources :** "
+                            + ", ".join(fichier.name for fichier in uploaded_files))
             st.markdown('</div>', unsafe_allow_html=True)
         
         with col2:
             st.markdown('<div class="file-info-card">', unsafe_allow_html=True)
-            file_size_mb = uploaded_file.size / (1024 * 1024)
+            file_size_mb = sum(fichier.size for fichier in uploaded_files) / (1024 * 1024)
             st.markdown(f"**💾 Taille :** {file_size_mb:.2f} MB")
             st.markdown('</div>', unsafe_allow_html=True)
         
+        # Résultat déjà calculé pour ce fichier (cette session ou une autre)
+        # En mode incrémental le résultat dépend de l'historique : pas de cache
+        # En mémoire bornée le résultat reste sur disque : pas de cache mémoire
+        # Un traitement profilé est toujours exécuté
+        sans_cache = mode_incremental or memoire_bornee or profiler
+        cache = obtenir_cache_resultats()
+        cle_contenu = cle_resultat(uploaded_files)
+        cle = None if sans_cache else cle_contenu
+        resultat = None if sans_cache else cache.get(cle)
+        
         with col3:
             st.markdown('<div class="file-info-card">', unsafe_allow_html=True)
-            st.markdown("**📊 Statut :** Prêt")
+            st.markdown("**📊 Statut :** " + ("Déjà traité" if resultat else "Prêt"))
             st.markdown('</div>', unsafe_allow_html=True)
         
-        # Bouton de traitement avec indicateur de progression
-        if st.button("🚀 Lancer le traitement (Version rapide)", type="primary"):
-            progress_bar = st.progress(0, text="Initialisation...")
-            
-            with st.spinner("Traitement optimisé en cours..."):
-                excel_output, erreur, df_data = traiter_exactement_comme_vba(uploaded_file, progress_bar)
-            
-            progress_bar.empty()
-            
-            if erreur:
-                st.error(f"⚠️ {erreur}")
-            elif excel_output:
-                st.markdown('<div class="success-card">', unsafe_allow_html=True)
-                
-                col_s1, col_s2, col_s3 = st.columns(3)
-                
-                with col_s1:
-                    st.metric("✅ Traitement terminé", "Succès")
-                
-                with col_s2:
-                    total_lignes = len(df_data) if df_data is not None else 0
-                    st.metric("📈 Lignes traitées", f"{total_lignes:,}")
-                
-                with col_s3:
-                    if df_data is not None and 'Origin' in df_data.columns:
-                        feuilles = len(set(df_data['Origin'].dropna().astype(str).str.strip().str.upper())) + 2
-                    else:
-                        feuilles = 1
-                    st.metric("📑 Feuilles créées", feuilles)
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Téléchargement avec le même nom que le fichier d'entrée
-                st.markdown("### 📥 Télécharger le résultat")
-                
-                # Préparation du nom de fichier (même nom que l'entrée)
-                input_filename = uploaded_file.name
-                # Assurer l'extension .xlsx
-                if not input_filename.lower().endswith('.xlsx'):
-                    input_filename = f"{input_filename}.xlsx"
-                
-                # Afficher l'info sur le nom du fichier
-                st.markdown(f"""
-                <div class="filename-info">
-                <strong>📝 Nom du fichier de sortie :</strong><br>
-                <code>{input_filename}</code>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                col_d1, col_d2 = st.columns([3, 1])
-                with col_d1:
-                    st.info(f"Le fichier traité '{input_filename}' est prêt à être téléchargé")
-                
-                with col_d2:
-                    st.download_button(
-                        label="📥 Télécharger",
-                        data=excel_output,
-                        file_name=input_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
-                        type="secondary"
+        if resultat:
+            afficher_resultat(nom_fichier, resultat, depuis_cache=True, exports=exports)
+        
+        # Traitement soumis en arrière-plan ; l'identifiant de la tâche reste dans l'URL
+        else:
+            if st.button("🚀 Lancer le traitement (Version rapide)", type="primary"):
+                options = dict(
+                    moteur_lecture=moteur_lecture, moteur_filtre=moteur_filtre,
+                    verifier_legacy=verifier_legacy, nb_workers=int(nb_workers),
+                    moteur_ecriture=moteur_ecriture, compression=compression,
+                    consolidation=consolidation,
+                    historique=obtenir_historique() if mode_incremental else None,
+                    mode_incremental=mode_incremental,
+                    budget_memoire_octets=int(budget_memoire_mo) * 1024 ** 2 if memoire_bornee else None,
+                    sans_excel=sans_excel, planifier=planifier
+                )
+                if len(uploaded_files) > 1:
+                    options["noms_sources"] = [fichier.name for fichier in uploaded_files]
+                try:
+                    tache = obtenir_file_traitements().soumettre(
+                        uploaded_files if len(uploaded_files) > 1 else uploaded_files[0], nom_fichier, options,
+                        reutiliser_terminee=not mode_incremental, tracer_memoire=tracer_memoire,
+                        profiler=profiler
                     )
+                    st.query_params["tache"] = tache.id
+                except FileAttentePleine as e:
+                    st.error(f"⚠️ {e}")
+            if "tache" in st.query_params:
+                afficher_tache(st.query_params["tache"], nom_fichier, cle_contenu, exports)
+    elif "tache" in st.query_params:
+        # Page rechargée : le résultat du dernier traitement reste disponible
+        afficher_tache(st.query_params["tache"], exports=exports)
     else:
         # Instructions quand aucun fichier n'est uploadé
         st.markdown("""
@@ -0,0 +1,124 @@
+"""Benchmark des moteurs d'écriture : openpyxl (standard, write-only) contre l'émetteur natif
+
+Usage : python benchmarks/bench_ecriture.py --lignes 20000 --repetitions 3
+        python benchmarks/bench_ecriture.py --verifier
+
+--verifier relit les classeurs de chaque moteur et compare valeurs et formats de nombre des
+cellules à ceux du moteur standard, sur des colonnes mêlant dates, heures, nombres et textes.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+from io import BytesIO
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crex_core  # noqa: E402
+
+ORIGINES = ["ORY", "MRS", "LYS", "NTE", "BRU", "MPL", "RNS", "BOD", "TLS", "Autre"]
+
+def construire_feuilles(nb_lignes, seed=0):
+    """Feuilles par origine et Consolidation au format attendu par les moteurs d'écriture"""
+    rng = random.Random(seed)
+    nouvelles_feuilles = {origine: [] for origine in ORIGINES}
+    for _ in range(nb_lignes):
+        origine = rng.choice(ORIGINES)
+        nouvelles_feuilles[origine].append({
+            'Date Vol': crex_core.format_date_french(pd.Timestamp(2024, rng.randint(1, 12), rng.randint(1, 28))),
+            'Aircraft Registration': f"F-H{rng.choice('ABCDEFGHIJ')}{rng.choice('KLMNOPQRST')}{rng.randint(0, 9)}",
+            'Flight Number': rng.randint(1000, 9999),
+            'Origin': origine if origine != "Autre" else rng.choice(["CDG", "NCE", "AGA"]),
+            'Destination': rng.choice(["AGA", "RAK", "TUN", "FAO", "OPO"]),
+            'Catering': rng.choice(["NEWREST", "GATE GOURMET", "SERVAIR"]),
+            'Non Conformité': f"NC{rng.randint(1, 40)}",
+            'Event Title': rng.choice(["Manquant", "Qualité", "Quantité", "Retard"]),
+            'General Remarks': "remarque " * rng.randint(0, 30),
+        })
+    nouvelles_feuilles = {origine: pd.DataFrame(lignes) for origine, lignes in nouvelles_feuilles.items()}
+    nouvelles_feuilles['Consolidation'] = crex_core.construire_consolidation(nouvelles_feuilles)
+    return nouvelles_feuilles
+
+def construire_feuilles_mixtes():
+    """Feuilles dont Flight Number et Catering mêlent dates, heures, nombres et textes"""
+    valeurs = [
+        datetime.datetime(2024, 1, 5, 10, 30), 12, 3.25, datetime.time(9, 15), "NEWREST",
+        datetime.date(2024, 2, 1), 7, None, 0.5, True,
+    ]
+    data = pd.DataFrame({
+        'Date Vol': [f"Vendredi {i + 1} janvier" for i in range(len(valeurs))],
+        'Aircraft Registration': "F-HTVA",
+        'Flight Number': pd.Series(valeurs, dtype=object),
+        'Catering': pd.Series(valeurs[::-1], dtype=object),
+        'Non Conformité': "NC01",
+    })
+    nouvelles_feuilles = {"ORY": data}
+    nouvelles_feuilles['Consolidation'] = crex_core.construire_consolidation(nouvelles_feuilles)
+    return nouvelles_feuilles
+
+def cellules_classeur(output):
+    """{feuille: [(valeur, format de nombre) par cellule]} d'un classeur relu par openpyxl"""
+    from openpyxl import load_workbook
+    wb = load_workbook(BytesIO(output.getvalue()))
+    return {
+        ws.title: [(cell.value, cell.number_format) for row in ws.iter_rows() for cell in row]
+        for ws in wb.worksheets
+    }
+
+def verifier_moteurs(moteurs):
+    """Compare chaque moteur au moteur standard ; retourne le nombre de moteurs en écart"""
+    nouvelles_feuilles = construire_feuilles_mixtes()
+    reference = cellules_classeur(crex_core.creer_excel_avec_formatage_optimise(nouvelles_feuilles))
+    ecarts = 0
+    for moteur in moteurs:
+        cellules = cellules_classeur(crex_core.creer_excel_avec_formatage_optimise(nouvelles_feuilles, moteur))
+        differences = [
+            (feuille, i, attendu, obtenu)
+            for feuille in reference
+            for i, (attendu, obtenu) in enumerate(zip(reference[feuille], cellules.get(feuille, [])))
+            if attendu != obtenu
+        ]
+        if cellules.keys() != reference.keys():
+            differences.append(("feuilles", 0, list(reference), list(cellules)))
+        ecarts += bool(differences)
+        print(f"{moteur:<20}{'identique' if not differences else f'{len(differences)} écart(s)'}")
+        for feuille, i, attendu, obtenu in differences[:10]:
+            print(f"  {feuille} cellule {i} : attendu {attendu!r}, obtenu {obtenu!r}")
+    return ecarts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lignes", type=int, default=20000)
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--verifier", action="store_true",
+                        help="Compare valeurs et formats de chaque moteur au moteur standard")
+    args = parser.parse_args()
+    
+    if args.verifier:
+        sys.exit(1 if verifier_moteurs(["streaming", "natif"]) else 0)
+    
+    nouvelles_feuilles = construire_feuilles(args.lignes)
+    moteurs = [
+        ("standard", "rapide"),
+        ("streaming", "rapide"),
+        ("natif", "rapide"),
+        ("natif", "compact"),
+    ]
+    
+    print(f"{args.lignes} lignes, meilleur temps sur {args.repetitions} exécutions")
+    print(f"{'moteur':<20}{'temps (s)':>12}{'taille (Ko)':>14}")
+    for moteur, compression in moteurs:
+        temps = []
+        for _ in range(args.repetitions):
+            debut = time.perf_counter()
+            output = crex_core.creer_excel_avec_formatage_optimise(nouvelles_feuilles, moteur, compression)
+            temps.append(time.perf_counter() - debut)
+        libelle = moteur if moteur != "natif" else f"natif ({compression})"
+        print(f"{libelle:<20}{min(temps):>12.2f}{len(output.getvalue()) / 1024:>14.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Benchmark par étape du pipeline : pré-analyse, lecture, filtre, organisation, consolidation, écriture
+
+Pour chaque taille, un classeur synthétique est généré (puis réutilisé), chaque étape est
+chronométrée puis rejouée sous tracemalloc pour mesurer son pic mémoire. Les résultats sont
+ajoutés à un fichier JSONL ; l'écart avec la dernière mesure comparable est affiché.
+
+Usage : python benchmarks/bench_etapes.py --tailles 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crex_core  # noqa: E402
+from generer_crex import generer_classeur  # noqa: E402
+
+DOSSIER = os.path.dirname(os.path.abspath(__file__))
+ETAPES = ["prescan", "lecture", "filtre", "organisation", "consolidation", "ecriture"]
+
+def version_code():
+    """Commit courant, pour rattacher les mesures à une version"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=DOSSIER,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def classeur_synthetique(dossier, nb_lignes, nb_feuilles, nb_annexes=0):
+    """Chemin d'un classeur généré pour cette taille (réutilisé s'il existe)"""
+    os.makedirs(dossier, exist_ok=True)
+    suffixe = f"_{nb_annexes}a" if nb_annexes else ""
+    chemin = os.path.join(dossier, f"crex_{nb_lignes}_{nb_feuilles}{suffixe}.xlsx")
+    if not os.path.exists(chemin):
+        generer_classeur(chemin, nb_feuilles, max(1, nb_lignes // nb_feuilles), nb_annexes=nb_annexes)
+    return chemin
+
+def executer_etapes(chemin, options, mesurer):
+    """Exécute les étapes une à une ; mesurer(nom, fonction) retourne le résultat de la fonction"""
+    moteur_lecture = options["moteur_lecture"]
+    classeur, sheet_names = crex_core.ouvrir_classeur_source(chemin, moteur_lecture)
+    try:
+        index = mesurer("prescan", lambda: crex_core.index_feuilles(classeur, chemin, sheet_names, moteur_lecture))
+        sheet_names = [entree["feuille"] for entree in index if entree["a_traiter"]]
+        if moteur_lecture == "streaming":
+            brut = mesurer("lecture", lambda: [
+                list(crex_core.iterer_lignes_feuille(classeur[nom])) for nom in sheet_names
+            ])
+            filtrer = lambda: [crex_core.pd.DataFrame(crex_core.traiter_lignes_streaming(lignes)) for lignes in brut]
+        else:
+            brut = mesurer("lecture", lambda: [
+                crex_core.pd.read_excel(classeur, sheet_name=nom, header=None, engine='openpyxl')
+                for nom in sheet_names
+            ])
+            if options["moteur_filtre"] == "vectorise":
+                filtrer = lambda: [crex_core.traiter_feuille_vectorise(nom, df) for nom, df in zip(sheet_names, brut)]
+            else:
+                filtrer = lambda: [
+                    crex_core.pd.DataFrame(crex_core.traiter_feuille_optimise(nom, df))
+                    for nom, df in zip(sheet_names, brut)
+                ]
+    finally:
+        classeur.close()
+
+    df_all = mesurer("filtre", lambda: crex_core.pd.concat([df for df in filtrer() if len(df)], ignore_index=True))
+    nouvelles_feuilles = mesurer("organisation", lambda: crex_core.organiser_par_origine(df_all))
+    nouvelles_feuilles["Consolidation"] = mesurer(
+        "consolidation", lambda: crex_core.construire_consolidation(nouvelles_feuilles)
+    )
+    output = mesurer("ecriture", lambda: crex_core.creer_excel_avec_formatage_optimise(
+        nouvelles_feuilles, options["moteur_ecriture"], options["compression"]
+    ))
+    return {"lignes_sortie": len(df_all), "octets_sortie": len(output.getvalue())}
+
+def mesurer_temps(chemin, options):
+    durees = {}
+    def mesurer(nom, fonction):
+        debut = time.perf_counter()
+        resultat = fonction()
+        durees[nom] = time.perf_counter() - debut
+        return resultat
+    infos = executer_etapes(chemin, options, mesurer)
+    return durees, infos
+
+def mesurer_memoire(chemin, options):
+    pics = {}
+    def mesurer(nom, fonction):
+        tracemalloc.reset_peak()
+        avant = tracemalloc.get_traced_memory()[0]
+        resultat = fonction()
+        pics[nom] = tracemalloc.get_traced_memory()[1] - avant
+        return resultat
+    tracemalloc.start()
+    try:
+        executer_etapes(chemin, options, mesurer)
+    finally:
+        tracemalloc.stop()
+    return pics
+
+def derniere_mesure(chemin_resultats, reference):
+    """Dernière mesure enregistrée avec la même taille et les mêmes moteurs"""
+    precedente = None
+    if os.path.exists(chemin_resultats):
+        with open(chemin_resultats, encoding="utf-8") as f:
+            for ligne in f:
+                mesure = json.loads(ligne)
+                if all(mesure.get(cle, 0) == reference[cle] for cle in ("lignes", "feuilles", "annexes", "options")):
+                    precedente = mesure
+    return precedente
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tailles", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--feuilles", type=int, default=10)
+    parser.add_argument("--annexes", type=int, default=0, help="Onglets sans événement ajoutés au classeur")
+    parser.add_argument("--moteur-lecture", choices=["pandas", "streaming"], default="pandas")
+    parser.add_argument("--moteur-filtre", choices=["vectorise", "legacy"], default="vectorise")
+    parser.add_argument("--moteur-ecriture", choices=["standard", "streaming", "natif"], default="standard")
+    parser.add_argument("--compression", choices=["rapide", "compact"], default="rapide")
+    parser.add_argument("--sans-memoire", action="store_true", help="Ne pas rejouer les étapes sous tracemalloc")
+    parser.add_argument("--donnees", default=os.path.join(DOSSIER, "donnees"), help="Dossier des classeurs générés")
+    parser.add_argument("--resultats", default=os.path.join(DOSSIER, "resultats_etapes.jsonl"))
+    args = parser.parse_args()
+
+    options = {
+        "moteur_lecture": args.moteur_lecture,
+        "moteur_filtre": args.moteur_filtre,
+        "moteur_ecriture": args.moteur_ecriture,
+        "compression": args.compression,
+    }
+    for nb_lignes in args.tailles:
+        chemin = classeur_synthetique(args.donnees, nb_lignes, args.feuilles, args.annexes)
+        durees, infos = mesurer_temps(chemin, options)
+        pics = {} if args.sans_memoire else mesurer_memoire(chemin, options)
+
+        mesure = {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "version": crex_core.VERSION_PIPELINE,
+            "commit": version_code(),
+            "lignes": nb_lignes,
+            "feuilles": args.feuilles,
+            "annexes": args.annexes,
+            "options": options,
+            **infos,
+            "etapes": {
+                etape: {"secondes": round(durees[etape], 4), "pic_octets": pics.get(etape)}
+                for etape in ETAPES
+            },
+        }
+        precedente = derniere_mesure(args.resultats, mesure)
+
+        print(f"\n{nb_lignes} lignes source, {infos['lignes_sortie']} lignes retenues")
+        print(f"{'étape':<15}{'temps (s)':>11}{'pic (Mo)':>11}{'écart temps':>14}")
+        for etape in ETAPES:
+            secondes = mesure["etapes"][etape]["secondes"]
+            pic = mesure["etapes"][etape]["pic_octets"]
+            ecart = ""
+            if precedente:
+                # Étape absente des mesures plus anciennes
+                avant = precedente["etapes"].get(etape, {}).get("secondes")
+                if avant:
+                    ecart = f"{(secondes - avant) / avant:+.0%}"
+            pic_mo = f"{pic / 1024 / 1024:.1f}" if pic is not None else "-"
+            print(f"{etape:<15}{secondes:>11.3f}{pic_mo:>11}{ecart:>14}")
+
+        with open(args.resultats, "a", encoding="utf-8") as f:
+            f.write(json.dumps(mesure, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    main()
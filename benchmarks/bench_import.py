@@ -0,0 +1,54 @@
+"""Benchmark du temps de démarrage à froid (import) de l'interface et des processus de traitement
+
+Chaque scénario est exécuté dans un interpréteur neuf. Les résultats peuvent être ajoutés
+à un fichier JSONL pour suivre l'évolution entre versions.
+
+Usage : python benchmarks/bench_import.py --repetitions 5 --sortie bench_import.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    # Processus de traitement : import du cœur seul (dépendances différées)
+    "worker_import": "import crex_core",
+    # Processus de traitement prêt à lire une feuille (pandas et openpyxl chargés)
+    "worker_pret": "import crex_core; crex_core.pd.DataFrame; crex_core.openpyxl.load_workbook",
+    # Interface : module Streamlit complet, sans exécuter main()
+    "ui_import": "import CREX",
+}
+
+def mesurer(code):
+    """Durée (s) d'un interpréteur neuf exécutant le code, démarrage de Python inclus"""
+    debut = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=RACINE, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - debut
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--sortie", help="Fichier JSONL auquel ajouter les résultats")
+    args = parser.parse_args()
+
+    reference = [mesurer("pass") for _ in range(args.repetitions)]
+    resultats = {"interpreteur": statistics.median(reference)}
+    for nom, code in SCENARIOS.items():
+        resultats[nom] = statistics.median(mesurer(code) for _ in range(args.repetitions))
+
+    print(f"{'scénario':<16}{'médiane (s)':>14}{'hors Python (s)':>18}")
+    for nom, duree in resultats.items():
+        print(f"{nom:<16}{duree:>14.3f}{duree - resultats['interpreteur']:>18.3f}")
+
+    if args.sortie:
+        with open(args.sortie, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"date": time.strftime("%Y-%m-%dT%H:%M:%S"), **resultats}) + "\n")
+
+if __name__ == "__main__":
+    main()
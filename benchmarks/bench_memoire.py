@@ -0,0 +1,68 @@
+"""Benchmark mémoire de df_all : colonnes texte en objets Python contre catégories
+
+Pour chaque taille, df_all est lu depuis un classeur synthétique (réutilisé s'il existe), puis
+mesuré (memory_usage profond) avec les colonnes COLONNES_CATEGORIELLES en objets et en
+catégories ; l'organisation par origine est chronométrée sur les deux représentations.
+
+Usage : python benchmarks/bench_memoire.py --tailles 10000 100000 --moteur-lecture streaming
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crex_core  # noqa: E402
+from bench_etapes import DOSSIER, classeur_synthetique  # noqa: E402
+
+def lire_df_all(chemin, moteur_lecture):
+    """df_all tel que produit par la lecture du pipeline, avant catégorisation"""
+    frames, _, _ = crex_core.lire_source(
+        chemin, moteur_lecture, "vectorise", False, 1, crex_core.PRESCAN_LIGNES, crex_core.Mesures()
+    )
+    return crex_core.pd.concat(frames, ignore_index=True)
+
+def memoire_colonnes(df):
+    """Octets par colonne catégorisable et total de la DataFrame (chaînes comprises)"""
+    usage = df.memory_usage(deep=True, index=False)
+    return {col: int(usage[col]) for col in crex_core.COLONNES_CATEGORIELLES if col in usage}, int(usage.sum())
+
+def chronometrer_organisation(df, repetitions):
+    """Meilleur temps d'organiser_par_origine (sur une copie, la fonction ajoute des colonnes)"""
+    temps = []
+    for _ in range(repetitions):
+        copie = df.copy()
+        debut = time.perf_counter()
+        crex_core.organiser_par_origine(copie)
+        temps.append(time.perf_counter() - debut)
+    return min(temps)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tailles", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--feuilles", type=int, default=10)
+    parser.add_argument("--moteur-lecture", choices=["pandas", "streaming"], default="streaming")
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--donnees", default=os.path.join(DOSSIER, "donnees"), help="Dossier des classeurs générés")
+    args = parser.parse_args()
+
+    for nb_lignes in args.tailles:
+        chemin = classeur_synthetique(args.donnees, nb_lignes, args.feuilles)
+        objets = lire_df_all(chemin, args.moteur_lecture)
+        categories = crex_core.categoriser_colonnes(objets.copy())
+        colonnes_objets, total_objets = memoire_colonnes(objets)
+        colonnes_categories, total_categories = memoire_colonnes(categories)
+
+        print(f"\n{len(objets)} lignes retenues ({os.path.basename(chemin)}, lecture {args.moteur_lecture})")
+        print(f"{'colonne':<24}{'objets (Ko)':>14}{'catégories (Ko)':>18}{'valeurs':>10}")
+        for col, octets in colonnes_objets.items():
+            print(f"{col:<24}{octets / 1024:>14.0f}{colonnes_categories[col] / 1024:>18.0f}"
+                  f"{len(categories[col].cat.categories):>10}")
+        print(f"{'df_all':<24}{total_objets / 1024:>14.0f}{total_categories / 1024:>18.0f}"
+              f"{'':>10}  (-{1 - total_categories / total_objets:.0%})")
+        print(f"{'organisation (s)':<24}{chronometrer_organisation(objets, args.repetitions):>14.3f}"
+              f"{chronometrer_organisation(categories, args.repetitions):>18.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Générateur de classeurs CREX synthétiques pour les benchmarks
+
+Usage : python benchmarks/generer_crex.py crex_test.xlsx --feuilles 10 --lignes 5000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+ENTETES_SOURCE = [
+    "Date", "Event Type", "Aircraft Registration", "Flight Number", "Origin", "Destination",
+    "Aircraft Type", "Catering", "Non Conformité", "Event Title", "General Remarks"
+]
+ORIGINES_VALIDES = ["ORY", "MRS", "LYS", "NTE", "BRU", "MPL", "RNS", "BOD", "TLS"]
+# Variantes d'écriture rencontrées dans les exports (casse, espaces)
+ORIGINES_AUTRES = ["CDG", "NCE", "AGA", "RAK", "ory ", " Mrs", "BES", None]
+TITRES = ["AUTRES", "PRODUIT", "SERVICE", "EQUIPEMENT", "AUTRE"]
+DATES_INVALIDES = ["N/A", "à confirmer", "32/13/2024", "Date", "—"]
+CATERINGS = ["NEWREST", "GATE GOURMET", "SERVAIR", "DO & CO"]
+EVENEMENTS = ["Manquant", "Qualité", "Quantité", "Retard livraison", "Équipement défectueux", "Hygiène"]
+MOTS = ("repas plateau chariot boisson manquant livré retard équipage passager froid chaud "
+        "quantité insuffisante spécial végétarien enfant sans gluten trolley four").split()
+
+def remarque(rng, longueur_max):
+    """Texte libre de longueur variable (jusqu'à longueur_max caractères)"""
+    cible = rng.randint(0, longueur_max)
+    mots = []
+    taille = 0
+    while taille < cible:
+        mot = rng.choice(MOTS)
+        mots.append(mot)
+        taille += len(mot) + 1
+    return " ".join(mots)[:longueur_max] or None
+
+def ajouter_feuille_annexe(wb, num, rng):
+    """Onglet sans événement : tableau croisé par origine ou notes (texte en colonne A)"""
+    if num % 2 == 0:
+        ws = wb.create_sheet(f"Synthèse {num // 2 + 1}")
+        ws.append(["Étiquettes de lignes", "Nombre de Event Title"])
+        total = 0
+        for origine in ORIGINES_VALIDES:
+            nombre = rng.randint(10, 500)
+            total += nombre
+            ws.append([origine, nombre])
+        ws.append(["Total général", total])
+    else:
+        ws = wb.create_sheet(f"Notes {num // 2 + 1}")
+        ws.append(["Notes"])
+        for _ in range(rng.randint(5, 30)):
+            ws.append([" ".join(rng.choice(MOTS) for _ in range(rng.randint(3, 8)))])
+
+def generer_classeur(chemin, nb_feuilles=10, lignes_par_feuille=1000, taux_titres=0.03,
+                     taux_dates_invalides=0.02, taux_autre=0.15, longueur_remarques=400, seed=0,
+                     nb_annexes=0):
+    """Écrit un classeur CREX réaliste (feuille EXPORT, en-têtes, titres, dates invalides, onglets annexes)"""
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("EXPORT")
+    ws.append(["Export CREX", datetime(2024, 1, 1)])
+
+    debut = datetime(2024, 1, 1)
+    immatriculations = [f"F-H{a}{b}{c}" for a in "TUVX" for b in "ABCDEFGH" for c in "ABCD"]
+    for num in range(nb_feuilles):
+        ws = wb.create_sheet(f"Semaine {num + 1}")
+        ws.append(ENTETES_SOURCE)
+        for _ in range(lignes_par_feuille):
+            tirage = rng.random()
+            if tirage < taux_titres:
+                # Ligne de titre, parfois un long texte de section
+                if rng.random() < 0.8:
+                    ws.append([rng.choice(TITRES)])
+                else:
+                    ws.append([" ".join(rng.choice(MOTS) for _ in range(12))])
+                continue
+            if tirage < taux_titres + taux_dates_invalides:
+                date = rng.choice(DATES_INVALIDES)
+            else:
+                # Plusieurs centaines de lignes par jour de vol
+                date = debut + timedelta(days=rng.randint(0, 365))
+            if rng.random() < taux_autre:
+                origine = rng.choice(ORIGINES_AUTRES)
+            else:
+                origine = rng.choice(ORIGINES_VALIDES)
+            ws.append([
+                date,
+                rng.choice(["Catering", "Service", "Produit"]),
+                rng.choice(immatriculations),
+                rng.choice([rng.randint(3000, 7999), f"TO{rng.randint(3000, 7999)}"]),
+                origine,
+                rng.choice(["AGA", "RAK", "TUN", "FAO", "OPO", "HER", "DJE"]),
+                rng.choice(["B737-800", "A320neo"]),
+                rng.choice(CATERINGS),
+                f"NC{rng.randint(1, 60):02d}",
+                rng.choice(EVENEMENTS),
+                remarque(rng, longueur_remarques),
+            ])
+    for num in range(nb_annexes):
+        ajouter_feuille_annexe(wb, num, rng)
+    wb.save(chemin)
+    return chemin
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("chemin")
+    parser.add_argument("--feuilles", type=int, default=10)
+    parser.add_argument("--lignes", type=int, default=1000, help="Lignes par feuille")
+    parser.add_argument("--taux-titres", type=float, default=0.03)
+    parser.add_argument("--taux-dates-invalides", type=float, default=0.02)
+    parser.add_argument("--taux-autre", type=float, default=0.15)
+    parser.add_argument("--longueur-remarques", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--annexes", type=int, default=0, help="Onglets sans événement (synthèses, notes)")
+    args = parser.parse_args()
+    generer_classeur(
+        args.chemin, args.feuilles, args.lignes, args.taux_titres,
+        args.taux_dates_invalides, args.taux_autre, args.longueur_remarques, args.seed, args.annexes
+    )
+
+if __name__ == "__main__":
+    main()
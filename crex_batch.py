@@ -0,0 +1,316 @@
+"""Traitement CREX en ligne de commande (sans Streamlit)
+
+Usage :
+    python crex_batch.py exports/*.xlsx --sortie resultats --workers 4
+    python crex_batch.py dossier_crex/
+    python crex_batch.py export_s42.xlsx --incremental nouvelles --importer-annotations resultat_s41.xlsx
+    python crex_batch.py --importer-annotations retours_t3/ --workers 4
+    python crex_batch.py exports/*.xlsx --exports parquet csv --sans-excel
+    python crex_batch.py exports/s4*.xlsx --fusionner resultats/crex_mois.xlsx --workers 4
+
+Affiche un résumé JSON par fichier (statut, lignes, durées par étape).
+Les fichiers inchangés depuis la dernière exécution (date de modification + empreinte) sont ignorés.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import crex_core
+from crex_historique import HISTORIQUE_DEFAUT, MODES_INCREMENTAUX, HistoriqueLignes
+
+NOM_FICHIER_ETAT = ".crex_batch_etat.json"
+
+class JournalListe(logging.Handler):
+    """Conserve les messages du journal crex pour le résumé JSON"""
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def lister_fichiers(motifs):
+    """Développe fichiers, dossiers et motifs glob en une liste de .xlsx sans doublons"""
+    fichiers = []
+    for motif in motifs:
+        if os.path.isdir(motif):
+            candidats = sorted(glob.glob(os.path.join(motif, "*.xlsx")))
+        elif glob.has_magic(motif):
+            candidats = sorted(glob.glob(motif, recursive=True))
+        else:
+            candidats = [motif]
+        for chemin in candidats:
+            # Fichiers de verrouillage Excel
+            if os.path.basename(chemin).startswith("~$"):
+                continue
+            chemin = os.path.abspath(chemin)
+            if chemin not in fichiers:
+                fichiers.append(chemin)
+    return fichiers
+
+def chemin_sortie(chemin, dossier_sortie=None):
+    """Même nom que l'entrée dans le dossier de sortie, suffixe _traite à côté de l'entrée"""
+    nom = os.path.basename(chemin)
+    if dossier_sortie:
+        sortie = os.path.abspath(os.path.join(dossier_sortie, nom))
+        if sortie != chemin:
+            return sortie
+    base, ext = os.path.splitext(chemin)
+    return f"{base}_traite{ext}"
+
+def chemin_export(sortie, format_export):
+    """Dossier des partitions d'un export de données, à côté du classeur de sortie"""
+    return f"{os.path.splitext(sortie)[0]}_{format_export}"
+
+def sorties_attendues(sortie, exports, sans_excel):
+    """Classeur et dossiers d'export produits pour un fichier"""
+    return ([] if sans_excel else [sortie]) + [chemin_export(sortie, format_export) for format_export in exports]
+
+def empreinte_fichier(chemin):
+    """SHA-256 du contenu du fichier"""
+    h = hashlib.sha256()
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+def charger_etat(chemin_etat):
+    try:
+        with open(chemin_etat, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def sauver_etat(chemin_etat, etat):
+    os.makedirs(os.path.dirname(os.path.abspath(chemin_etat)), exist_ok=True)
+    tmp = f"{chemin_etat}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(etat, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, chemin_etat)
+
+def est_inchange(chemin, sorties, precedent):
+    """Vrai si le fichier a déjà été traité avec la même version du pipeline et que ses sorties existent
+
+    Retourne aussi l'empreinte calculée (None si la date de modification suffit à conclure).
+    """
+    if (not precedent or precedent.get("version") != crex_core.VERSION_PIPELINE
+            or not all(os.path.exists(sortie) for sortie in sorties)):
+        return False, None
+    stat = os.stat(chemin)
+    if precedent.get("mtime") == stat.st_mtime and precedent.get("taille") == stat.st_size:
+        return True, None
+    empreinte = empreinte_fichier(chemin)
+    return empreinte == precedent.get("sha256"), empreinte
+
+def chemins_profil(sortie):
+    """Fichier pstats et piles repliées d'un traitement profilé, à côté du classeur de sortie"""
+    base = os.path.splitext(sortie)[0]
+    return f"{base}.pstats", f"{base}.piles.txt"
+
+def traiter_fichier(chemin, sortie, options, journal_metriques=None, exports=(), profiler=False):
+    """Tâche d'un processus : exécute le pipeline complet sur un fichier et écrit le résultat
+
+    chemin : fichier, ou liste de fichiers fusionnés dans un seul classeur
+    exports : formats de données écrits en plus du classeur (ou à sa place avec sans_excel)
+    profiler : écrit le profil cProfile (.pstats) et les piles repliées (.piles.txt) de l'exécution
+    """
+    debut = time.time()
+    durees = {}
+    mesures = crex_core.Mesures()
+    resume = {"fichier": chemin, "sortie": sortie}
+    journal = JournalListe()
+    crex_core.logger.addHandler(journal)
+    profil = crex_core.ProfilExecution() if profiler else None
+    try:
+        source = nullcontext(list(chemin)) if isinstance(chemin, (list, tuple)) else open(chemin, 'rb')
+        with source as f, profil.capturer() if profil else nullcontext():
+            excel_output, erreur, df_all = crex_core.traiter_exactement_comme_vba(
+                f, durees=durees, mesures=mesures, **options
+            )
+    finally:
+        crex_core.logger.removeHandler(journal)
+    if profil:
+        chemin_pstats, chemin_piles = chemins_profil(sortie)
+        os.makedirs(os.path.dirname(os.path.abspath(sortie)), exist_ok=True)
+        with open(chemin_pstats, 'wb') as f:
+            f.write(profil.fichier_pstats())
+        with open(chemin_piles, 'w', encoding="utf-8") as f:
+            f.write(profil.piles_repliees())
+        resume["profil"] = {"pstats": chemin_pstats, "piles": chemin_piles}
+    if journal.messages:
+        resume["avertissements"] = journal.messages
+
+    if erreur == crex_core.AUCUNE_NOUVELLE_LIGNE:
+        resume.update(statut="sans_nouveaute")
+    elif erreur or (excel_output is None and not options.get("sans_excel")):
+        resume.update(statut="erreur", erreur=erreur or "Erreur lors de la création du fichier")
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(sortie)), exist_ok=True)
+        if excel_output is not None:
+            with open(sortie, 'wb') as f:
+                shutil.copyfileobj(excel_output, f)
+        else:
+            resume["sortie"] = None
+        if exports:
+            resume["exports"] = {
+                format_export: crex_core.exporter_donnees(df_all, format_export, chemin_export(sortie, format_export))
+                for format_export in exports
+            }
+        resume.update(
+            statut="traite",
+            lignes=len(df_all),
+            feuilles=crex_core.feuilles_creees(mesures.spans),
+            durees={etape: round(valeur, 3) for etape, valeur in durees.items()},
+        )
+    resume["secondes"] = round(time.time() - debut, 3)
+    if journal_metriques:
+        contexte = {cle: valeur for cle, valeur in options.items() if not isinstance(valeur, HistoriqueLignes)}
+        mesures.ajouter_au_journal(journal_metriques, fichier=chemin, statut=resume["statut"], **contexte)
+    return resume
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Traitement CREX en lot, sans interface")
+    parser.add_argument("fichiers", nargs="*", help="Fichiers .xlsx, dossiers ou motifs glob")
+    parser.add_argument("--sortie", help="Dossier de sortie (par défaut : à côté des fichiers source)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Nombre de processus")
+    parser.add_argument("--moteur-lecture", choices=["pandas", "streaming"], default="streaming")
+    parser.add_argument("--moteur-ecriture", choices=["standard", "streaming", "natif"], default="natif")
+    parser.add_argument("--compression", choices=["rapide", "compact"], default="rapide")
+    parser.add_argument("--consolidation", choices=["partagee", "simple"], default="partagee",
+                        help="Formules de la feuille Consolidation (moteur natif)")
+    parser.add_argument("--etat", help=f"Fichier d'état des exécutions (par défaut : {NOM_FICHIER_ETAT})")
+    parser.add_argument("--force", action="store_true", help="Retraiter même les fichiers inchangés")
+    parser.add_argument("--incremental", choices=MODES_INCREMENTAUX,
+                        help="nouvelles : lignes jamais traitées ; complet : annotations reprises de l'historique "
+                             "(fichiers traités un par un, dans l'ordre donné)")
+    parser.add_argument("--historique", default=HISTORIQUE_DEFAUT, help="Base SQLite des lignes traitées")
+    parser.add_argument("--importer-annotations", nargs="+", default=[], metavar="CLASSEUR",
+                        help="Classeurs annotés (fichiers, dossiers ou motifs) à importer avant le traitement")
+    parser.add_argument("--budget-memoire", type=int, default=crex_core.BUDGET_MEMOIRE_OCTETS, metavar="OCTETS",
+                        help="Mode mémoire bornée : pic mémoire visé par fichier traité")
+    parser.add_argument("--prescan-lignes", type=int, default=crex_core.PRESCAN_LIGNES, metavar="N",
+                        help="Lignes échantillonnées pour écarter les feuilles sans événement (0 : toutes lues)")
+    parser.add_argument("--exports", nargs="+", default=[], choices=list(crex_core.FORMATS_EXPORT),
+                        help="Données retenues partitionnées par feuille et mois (dossiers <sortie>_<format>)")
+    parser.add_argument("--sans-excel", action="store_true", help="Exports de données uniquement, sans classeur")
+    parser.add_argument("--profiler", action="store_true",
+                        help="Profil cProfile (.pstats) et piles repliées (.piles.txt) à côté de chaque sortie")
+    parser.add_argument("--planifier", action="store_true",
+                        help="Moteurs, processus de lecture et tampons choisis par fichier (taille, mémoire, cœurs)")
+    parser.add_argument("--fusionner", metavar="SORTIE",
+                        help="Fusionne tous les fichiers (lignes en double écrites une seule fois) dans un classeur")
+    parser.add_argument("--journal-metriques", default=crex_core.JOURNAL_METRIQUES,
+                        help="Journal JSONL des mesures par étape et par feuille")
+    args = parser.parse_args(argv)
+    if not args.fichiers and not args.importer_annotations:
+        parser.error("indiquer des fichiers à traiter ou des classeurs à importer")
+    if args.sans_excel and not args.exports:
+        parser.error("--sans-excel nécessite au moins un format dans --exports")
+    indisponibles = set(args.exports) - set(crex_core.formats_export_disponibles())
+    if indisponibles:
+        parser.error(f"format(s) {', '.join(sorted(indisponibles))} indisponible(s) : installer pyarrow")
+
+    debut = time.time()
+    fichiers = lister_fichiers(args.fichiers)
+    chemin_etat = args.etat or os.path.join(args.sortie or os.getcwd(), NOM_FICHIER_ETAT)
+    etat = charger_etat(chemin_etat)
+    options = {
+        "moteur_lecture": args.moteur_lecture,
+        "moteur_ecriture": args.moteur_ecriture,
+        "compression": args.compression,
+        "consolidation": args.consolidation,
+        "budget_memoire_octets": args.budget_memoire,
+        "lignes_prescan": args.prescan_lignes,
+        "sans_excel": args.sans_excel,
+        "planifier": args.planifier,
+    }
+    annotations_importees = {}
+    if args.incremental or args.importer_annotations:
+        historique = HistoriqueLignes(args.historique)
+        annotations_importees = historique.importer_classeurs(
+            lister_fichiers(args.importer_annotations), max(1, args.workers)
+        )
+        if args.incremental:
+            options.update(historique=historique, mode_incremental=args.incremental)
+
+    if args.fusionner and fichiers:
+        # Fichiers lus en parallèle par le pipeline ; toujours retraités (pas d'état d'exécution)
+        introuvables = [chemin for chemin in fichiers if not os.path.isfile(chemin)]
+        if introuvables:
+            resume = {"fichier": fichiers, "statut": "erreur", "erreur": f"Fichier introuvable : {introuvables[0]}"}
+        else:
+            resume = traiter_fichier(
+                fichiers, os.path.abspath(args.fusionner), {**options, "nb_workers": max(1, args.workers)},
+                args.journal_metriques, args.exports, args.profiler
+            )
+        print(json.dumps({
+            **({"annotations_importees": annotations_importees} if annotations_importees else {}),
+            "fusion": resume,
+            "total_secondes": round(time.time() - debut, 3),
+        }, ensure_ascii=False, indent=2))
+        erreurs = [resume] + list(annotations_importees.values())
+        return 1 if any(r["statut"] == "erreur" for r in erreurs) else 0
+
+    resumes = {}
+    a_traiter = []
+    for chemin in fichiers:
+        sortie = chemin_sortie(chemin, args.sortie)
+        if not os.path.isfile(chemin):
+            resumes[chemin] = {"fichier": chemin, "statut": "erreur", "erreur": "Fichier introuvable"}
+            continue
+        sorties = sorties_attendues(sortie, args.exports, args.sans_excel)
+        inchange, empreinte = (False, None) if args.force else est_inchange(chemin, sorties, etat.get(chemin))
+        if inchange:
+            resumes[chemin] = {"fichier": chemin, "sortie": sortie, "statut": "ignore"}
+            # La date a pu changer sans modification du contenu
+            etat[chemin].update(mtime=os.stat(chemin).st_mtime)
+        else:
+            a_traiter.append((chemin, sortie, empreinte))
+
+    # Historique partagé : en incrémental, les fichiers sont traités un par un dans l'ordre donné
+    # pour que chaque ligne soit attribuée au premier fichier qui la contient
+    nb_processus = 1 if args.incremental else max(1, min(args.workers, len(a_traiter) or 1))
+    with ProcessPoolExecutor(max_workers=nb_processus) as executor:
+        futures = {
+            executor.submit(
+                traiter_fichier, chemin, sortie, options, args.journal_metriques, args.exports, args.profiler
+            ): (chemin, empreinte)
+            for chemin, sortie, empreinte in a_traiter
+        }
+        for future in as_completed(futures):
+            chemin, empreinte = futures[future]
+            try:
+                resume = future.result()
+            except Exception as e:
+                resume = {"fichier": chemin, "statut": "erreur", "erreur": str(e)}
+            resumes[chemin] = resume
+            if resume["statut"] == "traite":
+                stat = os.stat(chemin)
+                etat[chemin] = {
+                    "mtime": stat.st_mtime,
+                    "taille": stat.st_size,
+                    "sha256": empreinte or empreinte_fichier(chemin),
+                    "version": crex_core.VERSION_PIPELINE,
+                }
+
+    sauver_etat(chemin_etat, etat)
+
+    print(json.dumps({
+        **({"annotations_importees": annotations_importees} if annotations_importees else {}),
+        "fichiers": [resumes[chemin] for chemin in fichiers],
+        "total_secondes": round(time.time() - debut, 3),
+    }, ensure_ascii=False, indent=2))
+    erreurs = list(resumes.values()) + list(annotations_importees.values())
+    return 1 if any(r["statut"] == "erreur" for r in erreurs) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
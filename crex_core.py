@@ -0,0 +1,2298 @@
+"""Cœur du traitement CREX, sans interface
+
+Utilisable par l'application Streamlit (CREX.py), la ligne de commande (crex_batch.py)
+et les processus de lecture parallèle. pandas, numpy et openpyxl ne sont chargés qu'à
+leur première utilisation, ce qui garde l'import de ce module quasi instantané.
+"""
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, time as heure, timedelta
+from functools import lru_cache
+from itertools import repeat
+from urllib.parse import quote
+from io import BytesIO
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+import cProfile
+import hashlib
+import importlib.util
+import json
+import logging
+import marshal
+import math
+import multiprocessing
+import os
+import pickle
+import posixpath
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import zipfile
+
+logger = logging.getLogger("crex")
+
+class ModuleDiffere(types.ModuleType):
+    """Module importé au premier accès à l'un de ses attributs
+
+    L'import passe par les verrous d'import standard : sûr quand plusieurs traitements
+    démarrent dans des threads (importlib.util.LazyLoader ne l'est pas avant Python 3.12).
+    """
+    
+    def __getattr__(self, attribut):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribut)
+
+def import_differe(nom):
+    """Module chargé au premier accès à l'un de ses attributs"""
+    if nom in sys.modules:
+        return sys.modules[nom]
+    return ModuleDiffere(nom)
+
+pd = import_differe("pandas")
+np = import_differe("numpy")
+openpyxl = import_differe("openpyxl")
+
+# Lecture en flux (openpyxl read-only) : colonnes A à K uniquement
+NB_COLONNES_SOURCE = 11
+TITRES_EXCLUS = {"AUTRES", "PRODUIT", "SERVICE", "EQUIPEMENT", "AUTRE"}
+# Classeur de sortie
+ENTETES_SORTIE = [
+    "Date Vol", "Aircraft Registration", "Flight Number", "Origin", "Destination",
+    "Catering", "Non Conformité", "Event Title", "General Remarks",
+    "Accepté/Refusé", "Commentaire", "Autre", "KAM / TO", "Commentaire_2"
+]
+# Colonnes reprises de la source ; les colonnes d'annotation (J à N) restent vides, sans être stockées
+COLONNES_DONNEES = ENTETES_SORTIE[:9]
+# Colonnes de df_all à faible cardinalité, stockées en catégories (un code entier par ligne)
+COLONNES_CATEGORIELLES = [
+    "Aircraft Registration", "Flight Number", "Origin", "Destination", "Catering", "Non Conformité"
+]
+ORIGINES_VALIDES = {"ORY", "MRS", "LYS", "NTE", "BRU", "MPL", "RNS", "BOD", "TLS"}
+LARGEURS_COLONNES = {
+    'A': 20, 'B': 15, 'C': 15, 'D': 10, 'E': 10,
+    'F': 30, 'G': 30, 'H': 30, 'I': 50,
+    'J': 15, 'K': 30, 'L': 20, 'M': 15, 'N': 30
+}
+MOT_DE_PASSE_FEUILLES = 'newrest2025'
+# Lignes de données par feuille : limite d'Excel (1 048 576 lignes) moins l'en-tête ;
+# au-delà, la feuille est découpée en parties numérotées (ORY, ORY (2), ...)
+LIGNES_MAX_FEUILLE = int(os.environ.get("CREX_LIGNES_MAX_FEUILLE", 1048576 - 1))
+# Cache des résultats : version du pipeline incluse dans la clé, tailles en octets
+VERSION_PIPELINE = "1.3"
+TAILLE_CACHE_MEMOIRE_OCTETS = int(os.environ.get("CREX_CACHE_MEMOIRE_OCTETS", 512 * 1024 * 1024))
+CACHE_DISQUE_DIR = os.environ.get("CREX_CACHE_DIR")
+TAILLE_CACHE_DISQUE_OCTETS = int(os.environ.get("CREX_CACHE_DISQUE_OCTETS", 2 * 1024 * 1024 * 1024))
+# Journal JSONL des mesures par exécution (désactivé si non défini)
+JOURNAL_METRIQUES = os.environ.get("CREX_JOURNAL_METRIQUES")
+JOURS_FR = ("Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche")
+MOIS_FR = ("janvier", "février", "mars", "avril", "mai", "juin",
+           "juillet", "août", "septembre", "octobre", "novembre", "décembre")
+
+AUCUNE_NOUVELLE_LIGNE = "Aucune nouvelle ligne depuis le dernier traitement."
+# Mode mémoire bornée : budget de pic mémoire (CREX_BUDGET_MEMOIRE_OCTETS, désactivé si absent)
+BUDGET_MEMOIRE_OCTETS = int(os.environ.get("CREX_BUDGET_MEMOIRE_OCTETS", 0)) or None
+# Au-delà, le classeur produit passe du tampon mémoire à un fichier temporaire
+SEUIL_SORTIE_MEMOIRE_OCTETS = 16 * 1024 * 1024
+# Pic mémoire mesuré (tracemalloc) par octet de XML décompressé, selon le moteur d'écriture
+FACTEURS_PIC_MEMOIRE = {"standard": 15, "streaming": 3, "natif": 4}
+# Lecture parallèle : en dessous de cette taille, le traitement reste en série
+SEUIL_PARALLELE_OCTETS = 1024 * 1024
+# Démarrage des processus de lecture : le pipeline tourne dans des threads (serveur Streamlit,
+# crex_taches) où fork copierait des verrous tenus par d'autres threads
+METHODE_DEMARRAGE_PROCESSUS = os.environ.get("CREX_METHODE_DEMARRAGE", "forkserver")
+# Plan d'exécution (planifier_execution), seuils en octets de XML décompressé des feuilles :
+# lecture en parallèle au-delà du premier, écriture native au-delà du second, tampons sur
+# disque au-delà du troisième ; pic mémoire visé = fraction de la mémoire disponible.
+# Le seuil natif bas suppose que l'émetteur natif écrit les mêmes cellules qu'openpyxl (valeurs,
+# types, formats de date) : à revérifier par benchmarks/bench_ecriture.py --verifier avant de
+# l'abaisser ou après toute modification de rendu_cellule_natif
+SEUIL_PLAN_PARALLELE_XML = int(os.environ.get("CREX_PLAN_PARALLELE_XML", 32 * 1024 ** 2))
+SEUIL_PLAN_NATIF_XML = int(os.environ.get("CREX_PLAN_NATIF_XML", 256 * 1024))
+SEUIL_PLAN_DISQUE_XML = int(os.environ.get("CREX_PLAN_DISQUE_XML", 512 * 1024 ** 2))
+FRACTION_MEMOIRE_PLAN = float(os.environ.get("CREX_PLAN_FRACTION_MEMOIRE", 0.5))
+# Pré-analyse des feuilles : lignes échantillonnées en colonne A (0 = désactivée),
+# octets de XML lus pour extrapoler le nombre de lignes
+PRESCAN_LIGNES = int(os.environ.get("CREX_PRESCAN_LIGNES", 200))
+PRESCAN_OCTETS_XML = 256 * 1024
+# Exports de données (hors Excel) et extension des fichiers de partition ; parquet et arrow nécessitent pyarrow
+FORMATS_EXPORT = {"parquet": ".parquet", "csv": ".csv", "arrow": ".arrow"}
+# Vues de la synthèse des non-conformités : colonne regroupée
+AXES_SYNTHESE = {"origine": "Sheet_Name", "catering": "Catering", "jour": "Jour", "avion": "Aircraft Registration"}
+# Colonnes source (positions) -> schéma cible
+COLONNES_CIBLES = {
+    2: 'Aircraft Registration', 3: 'Flight Number', 4: 'Origin', 5: 'Destination',
+    7: 'Catering', 8: 'Non Conformité', 9: 'Event Title', 10: 'General Remarks',
+}
+# Marqueurs considérés comme vides par pd.read_excel
+VALEURS_VIDES = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+    "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+}
+
+def format_date_french(date_obj):
+    """Format date en français de manière optimisée"""
+    if pd.isna(date_obj):
+        return ""
+    try:
+        if isinstance(date_obj, pd.Timestamp):
+            return f"{JOURS_FR[date_obj.weekday()]} {date_obj.day} {MOIS_FR[date_obj.month - 1]}"
+    except:
+        pass
+    return str(date_obj)
+
+def formater_date_vol(value):
+    """Valeur écrite pour une cellule Date Vol : formules telles quelles, dates en français"""
+    # Si c'est une formule Excel (ex: "='Feuille'!A2"), on l'écrit telle quelle
+    if value is None or (isinstance(value, str) and value.startswith("=")):
+        return value
+    try:
+        # Ne formater que si c'est une vraie date, pas une formule
+        if isinstance(value, pd.Timestamp):
+            return format_date_french(value)
+        # tenter conversion si type date-like
+        return format_date_french(pd.to_datetime(value))
+    except:
+        return value
+
+@lru_cache(maxsize=None)
+def tables_dates_french():
+    """Tables de correspondance jour de semaine / mois (tableaux numpy objet)"""
+    return np.array(JOURS_FR, dtype=object), np.array(MOIS_FR, dtype=object)
+
+def formater_dates_french(serie):
+    """Formate toute la colonne Date Vol ; chaque valeur distincte n'est formatée qu'une fois
+    
+    Retourne une Series objet de même index, identique à formater_date_vol appliqué ligne à ligne.
+    """
+    valeurs = pd.Series(serie, dtype=object)
+    resultat = valeurs.copy()
+    if pd.api.types.is_datetime64_dtype(serie):
+        est_date = serie.notna().to_numpy()
+    else:
+        est_date = valeurs.map(lambda v: isinstance(v, pd.Timestamp)).to_numpy(dtype=bool)
+    
+    # Dates : libellés calculés sur les dates distinctes avec les tables jour / mois
+    if est_date.any():
+        jours, mois = tables_dates_french()
+        codes, uniques = pd.factorize(valeurs[est_date])
+        uniques = pd.DatetimeIndex(uniques)
+        libelles = jours[uniques.weekday] + " " + uniques.day.astype(str).to_numpy(object) + " " + mois[uniques.month - 1]
+        resultat[est_date] = libelles[codes]
+    
+    # Autres valeurs (textes, nombres, vides) : mémoïsées par type et valeur
+    memo = {}
+    autres = valeurs[~est_date]
+    for idx, value in autres.items():
+        try:
+            cle = (type(value), value)
+            if cle not in memo:
+                memo[cle] = formater_date_vol(value)
+            resultat.at[idx] = memo[cle]
+        except TypeError:
+            resultat.at[idx] = formater_date_vol(value)
+    return resultat
+
+def traiter_feuille_optimise(sheet_name, df):
+    """Traitement optimisé d'une feuille Excel"""
+    if len(df) < 2:
+        return []
+    
+    # Filtrer les lignes qui ne sont pas des titres
+    mask = pd.Series([True] * len(df), index=df.index)
+    
+    # Analyser la colonne 0 pour les titres
+    if 0 in df.columns:
+        col0 = df.iloc[:, 0].astype(str).str.strip().str.upper()
+        
+        # Titres à exclure
+        mask_titre = col0.isin(TITRES_EXCLUS) | (col0.str.len() > 50)
+        
+        # Exclure les titres et la première ligne (en-tête)
+        mask = ~mask_titre
+        mask.iloc[0] = False  # Exclure l'en-tête
+    
+    # Appliquer le masque
+    df_filtered = df[mask].copy()
+    
+    if len(df_filtered) == 0:
+        return []
+    
+    # Convertir les dates de manière vectorisée
+    dates_valides = []
+    for idx, row in df_filtered.iterrows():
+        try:
+            date_val = pd.to_datetime(row.iloc[0] if 0 in row.index else None)
+            if pd.notna(date_val):
+                dates_valides.append(True)
+            else:
+                dates_valides.append(False)
+        except:
+            dates_valides.append(False)
+    
+    df_filtered = df_filtered[dates_valides].copy()
+    
+    if len(df_filtered) == 0:
+        return []
+    
+    # Extraire les données de manière optimisée
+    data_rows = []
+    for idx, row in df_filtered.iterrows():
+        try:
+            date_val = pd.to_datetime(row.iloc[0])
+            data_row = {
+                'Date Vol': date_val,
+                'Aircraft Registration': row.iloc[2] if len(row) > 2 else '',
+                'Flight Number': row.iloc[3] if len(row) > 3 else '',
+                'Origin': row.iloc[4] if len(row) > 4 else '',
+                'Destination': row.iloc[5] if len(row) > 5 else '',
+                'Catering': row.iloc[7] if len(row) > 7 else '',
+                'Non Conformité': row.iloc[8] if len(row) > 8 else '',
+                'Event Title': row.iloc[9] if len(row) > 9 else '',
+                'General Remarks': row.iloc[10] if len(row) > 10 else '',
+            }
+            data_rows.append(data_row)
+        except:
+            continue
+    
+    return data_rows
+
+def traiter_feuille_vectorise(sheet_name, df):
+    """Traitement vectorisé d'une feuille : colonnes entières, retourne une DataFrame au schéma cible"""
+    colonnes = ['Date Vol'] + list(COLONNES_CIBLES.values())
+    if len(df) < 2 or 0 not in df.columns:
+        return pd.DataFrame(columns=colonnes)
+    
+    # Exclure les titres et l'en-tête
+    col0 = df[0].astype(str).str.strip().str.upper()
+    mask = ~(col0.isin(TITRES_EXCLUS) | (col0.str.len() > 50))
+    mask.iloc[0] = False
+    df_filtered = df[mask]
+    
+    # Une seule conversion de dates pour toute la colonne
+    dates = pd.to_datetime(df_filtered[0], errors='coerce', format='mixed')
+    valides = dates.notna()
+    
+    # Sélection positionnelle des colonnes 2 à 10 en une fois
+    resultat = df_filtered.loc[valides].reindex(columns=list(COLONNES_CIBLES), fill_value='')
+    resultat.columns = list(COLONNES_CIBLES.values())
+    resultat.insert(0, 'Date Vol', dates[valides])
+    return resultat.reset_index(drop=True)
+
+def comparer_avec_legacy(sheet_name, df, df_vectorise):
+    """Exécute traiter_feuille_optimise et vérifie que le résultat est identique ligne à ligne"""
+    df_legacy = pd.DataFrame(traiter_feuille_optimise(sheet_name, df), columns=df_vectorise.columns)
+    try:
+        pd.testing.assert_frame_equal(
+            df_legacy.reset_index(drop=True), df_vectorise.reset_index(drop=True),
+            check_dtype=False, check_datetimelike_compat=True
+        )
+    except AssertionError as e:
+        return f"Écart avec l'ancien moteur sur la feuille {sheet_name}: {str(e)}"
+    return None
+
+def convertir_valeur_source(valeur):
+    """Normalise une valeur brute openpyxl comme le ferait pd.read_excel"""
+    if valeur is None:
+        return np.nan
+    if isinstance(valeur, str):
+        return np.nan if valeur in VALEURS_VIDES else valeur
+    if isinstance(valeur, float) and valeur.is_integer():
+        return int(valeur)
+    return valeur
+
+def iterer_lignes_feuille(ws):
+    """Parcourt une feuille en lecture seule et produit les lignes typées (sans en-tête ni titres)"""
+    ws.reset_dimensions()
+    lignes = ws.iter_rows(max_col=NB_COLONNES_SOURCE, values_only=True)
+    
+    # La première ligne est l'en-tête
+    if next(lignes, None) is None:
+        return
+    
+    for valeurs in lignes:
+        ligne = [convertir_valeur_source(v) for v in valeurs]
+        if len(ligne) < NB_COLONNES_SOURCE:
+            ligne.extend([np.nan] * (NB_COLONNES_SOURCE - len(ligne)))
+        
+        # Exclure les titres
+        titre = str(ligne[0]).strip().upper()
+        if titre in TITRES_EXCLUS or len(titre) > 50:
+            continue
+        
+        yield ligne
+
+def convertir_date_vol(valeur):
+    """Convertit la colonne A en Timestamp, None si ce n'est pas une date"""
+    if isinstance(valeur, datetime):
+        return pd.Timestamp(valeur)
+    try:
+        date_val = pd.to_datetime(valeur)
+    except:
+        return None
+    return date_val if pd.notna(date_val) else None
+
+def traiter_lignes_streaming(lignes):
+    """Filtrage des lignes produites par iterer_lignes_feuille (même résultat que traiter_feuille_optimise)"""
+    data_rows = []
+    for ligne in lignes:
+        date_val = convertir_date_vol(ligne[0])
+        if date_val is None:
+            continue
+        data_rows.append({
+            'Date Vol': date_val,
+            'Aircraft Registration': ligne[2],
+            'Flight Number': ligne[3],
+            'Origin': ligne[4],
+            'Destination': ligne[5],
+            'Catering': ligne[7],
+            'Non Conformité': ligne[8],
+            'Event Title': ligne[9],
+            'General Remarks': ligne[10],
+        })
+    return data_rows
+
+_verrou_trace = threading.Lock()
+_utilisateurs_trace = 0
+_trace_demarree = False
+
+@contextmanager
+def trace_memoire():
+    """Active tracemalloc le temps du bloc
+    
+    tracemalloc est global au processus : les traitements simultanés le partagent et seul le
+    dernier à sortir l'arrête (jamais s'il était déjà actif avant le premier).
+    """
+    global _utilisateurs_trace, _trace_demarree
+    with _verrou_trace:
+        if _utilisateurs_trace == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_demarree = True
+        _utilisateurs_trace += 1
+    try:
+        yield
+    finally:
+        with _verrou_trace:
+            _utilisateurs_trace -= 1
+            if _utilisateurs_trace == 0 and _trace_demarree:
+                tracemalloc.stop()
+                _trace_demarree = False
+
+class Mesures:
+    """Spans de mesure d'une exécution : temps réel, temps CPU, pic mémoire tracé, lignes"""
+    
+    def __init__(self, tracer_memoire=False):
+        self.tracer_memoire = tracer_memoire
+        self.spans = []
+        self._pile = []
+    
+    @contextmanager
+    def span(self, nom, **attributs):
+        """Mesure le bloc ; le span produit peut recevoir lignes_entree / lignes_sortie"""
+        parent = self._pile[-1] if self._pile else None
+        span = {"nom": nom, "parent": parent["nom"] if parent else None, **attributs}
+        trace = self.tracer_memoire and tracemalloc.is_tracing()
+        if trace:
+            # Le pic du parent est conservé avant la remise à zéro pour ce span
+            courant, pic = tracemalloc.get_traced_memory()
+            if parent:
+                parent["_pic"] = max(parent.get("_pic", 0), pic)
+            tracemalloc.reset_peak()
+            span["_base"] = courant
+        self._pile.append(span)
+        debut, debut_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        finally:
+            span["secondes"] = time.perf_counter() - debut
+            span["cpu_secondes"] = time.thread_time() - debut_cpu
+            self._pile.pop()
+            if trace:
+                pic = max(span.pop("_pic", 0), tracemalloc.get_traced_memory()[1])
+                span["pic_memoire_octets"] = pic - span.pop("_base")
+                if parent:
+                    parent["_pic"] = max(parent.get("_pic", 0), pic)
+            self.spans.append(span)
+    
+    def durees(self):
+        """Durées des étapes principales (spans de premier niveau sous "total")"""
+        return {
+            span["nom"]: span["secondes"] for span in self.spans
+            if span["parent"] == "total" or span["nom"] == "total"
+        }
+    
+    def ajouter_au_journal(self, chemin, **contexte):
+        """Ajoute l'exécution (contexte + spans) à un journal JSONL"""
+        enregistrement = {"date": datetime.now().isoformat(timespec="seconds"), **contexte, "spans": self.spans}
+        with open(chemin, "a", encoding="utf-8") as f:
+            f.write(json.dumps(enregistrement, ensure_ascii=False, default=str) + "\n")
+
+def feuilles_creees(spans):
+    """Feuilles du classeur écrit (span "ecriture"), ou feuilles par origine sans classeur (span "organisation")"""
+    par_nom = {span["nom"]: span for span in spans or ()}
+    for nom in ("ecriture", "organisation"):
+        if "feuilles" in par_nom.get(nom, {}):
+            return par_nom[nom]["feuilles"]
+    return 0
+
+def percentiles_journal(chemin):
+    """p50 / p95 des durées par étape sur toutes les exécutions d'un journal JSONL"""
+    durees = {}
+    with open(chemin, encoding="utf-8") as f:
+        for ligne in f:
+            try:
+                enregistrement = json.loads(ligne)
+            except ValueError:
+                continue
+            for span in enregistrement.get("spans", []):
+                durees.setdefault(span["nom"], []).append(span["secondes"])
+    if not durees:
+        return pd.DataFrame(columns=["etape", "executions", "p50", "p95"])
+    return pd.DataFrame([
+        {"etape": nom, "executions": len(valeurs), "p50": np.percentile(valeurs, 50), "p95": np.percentile(valeurs, 95)}
+        for nom, valeurs in durees.items()
+    ])
+
+def chemin_court(fichier):
+    """Chemin d'un module relatif à site-packages, sinon nom du fichier"""
+    if "site-packages" in fichier:
+        return fichier.split("site-packages")[-1].lstrip("/\\")
+    return os.path.basename(fichier)
+
+def libelle_fonction(fonction):
+    """Libellé lisible d'une entrée cProfile (fichier, ligne, nom)"""
+    fichier, ligne, nom = fonction
+    if fichier == "~":
+        # Fonctions natives : "<built-in method ...>"
+        return nom
+    return f"{chemin_court(fichier)}:{ligne}({nom})"
+
+class ProfilExecution:
+    """Profil d'une exécution : temps par fonction (cProfile) et sites d'allocation (tracemalloc)
+    
+    Seul le thread appelant est profilé ; la lecture parallèle n'y apparaît que comme attente
+    des processus. Sans profil demandé, rien n'est instancié : aucun surcoût.
+    """
+    
+    def __init__(self, nb_sites=50):
+        self.nb_sites = nb_sites
+        self.stats = {}
+        self.allocations = []
+        self.pic_memoire_octets = None
+    
+    @contextmanager
+    def capturer(self):
+        """Profile le bloc ; les résultats sont disponibles à la sortie, même en cas d'erreur"""
+        with trace_memoire():
+            profil = cProfile.Profile()
+            profil.enable()
+            try:
+                yield self
+            finally:
+                profil.disable()
+                # Allocations encore vivantes en fin d'exécution, hors tracemalloc et imports
+                if tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot().filter_traces((
+                        tracemalloc.Filter(False, tracemalloc.__file__),
+                        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                    ))
+                    self.pic_memoire_octets = tracemalloc.get_traced_memory()[1]
+                    self.allocations = [
+                        (f"{chemin_court(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                         stat.size, stat.count)
+                        for stat in snapshot.statistics("lineno")[:self.nb_sites]
+                    ]
+                profil.create_stats()
+                self.stats = profil.stats
+    
+    def fichier_pstats(self):
+        """Contenu d'un fichier .pstats (lisible par pstats.Stats, snakeviz, gprof2dot)"""
+        return marshal.dumps(self.stats)
+    
+    def top_fonctions(self, n=30, tri="secondes_propres"):
+        """Les n fonctions les plus coûteuses, triées par temps propre ou cumulé"""
+        lignes = [
+            {"fonction": libelle_fonction(fonction), "appels": nb_appels,
+             "secondes_propres": temps_propre, "secondes_cumulees": temps_cumule}
+            for fonction, (_, nb_appels, temps_propre, temps_cumule, _) in self.stats.items()
+        ]
+        colonnes = ["fonction", "appels", "secondes_propres", "secondes_cumulees"]
+        return pd.DataFrame(lignes, columns=colonnes).nlargest(n, tri).reset_index(drop=True)
+    
+    def top_allocations(self, n=30):
+        """Les n sites (fichier:ligne) retenant le plus de mémoire en fin d'exécution"""
+        return pd.DataFrame(self.allocations[:n], columns=["site", "octets", "blocs"])
+    
+    def piles_repliees(self, seuil=0.0005):
+        """Piles au format replié (« a;b;c microsecondes ») accepté par flamegraph.pl et speedscope
+        
+        cProfile ne conserve que les arcs appelant -> appelé : le temps de chaque fonction est réparti
+        entre ses appelants au prorata de leurs arcs. Les branches sous seuil (fraction du total) sont omises.
+        """
+        appelees = defaultdict(dict)
+        for fonction, (_, _, _, _, appelants) in self.stats.items():
+            for appelant, arc in appelants.items():
+                appelees[appelant][fonction] = arc[3]
+        racines = [fonction for fonction, entree in self.stats.items() if not entree[4]]
+        total = sum(self.stats[racine][3] for racine in racines)
+        minimum = total * seuil
+        piles = defaultdict(float)
+        
+        def parcourir(pile, part):
+            fonction = pile[-1]
+            temps_propre, temps_cumule = self.stats[fonction][2:4]
+            ratio = part / temps_cumule if temps_cumule > 0 else 0.0
+            piles[pile] += temps_propre * ratio
+            for appelee, temps_arc in appelees[fonction].items():
+                # Récursion : la fonction est déjà dans la pile
+                if temps_arc * ratio >= minimum and appelee not in pile:
+                    parcourir(pile + (appelee,), temps_arc * ratio)
+        
+        for racine in racines:
+            if self.stats[racine][3] >= minimum:
+                parcourir((racine,), self.stats[racine][3])
+        return "".join(
+            ";".join(libelle_fonction(fonction).replace(";", ",") for fonction in pile) + f" {round(secondes * 1e6)}\n"
+            for pile, secondes in piles.items() if round(secondes * 1e6) > 0
+        )
+
+def ouvrir_classeur_source(source, moteur_lecture):
+    """Ouvre le classeur source et retourne (classeur, feuilles à traiter)"""
+    if moteur_lecture == "streaming":
+        # Lecture en flux, aucune DataFrame complète par feuille
+        classeur = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        noms_feuilles = classeur.sheetnames
+    else:
+        classeur = pd.ExcelFile(source, engine='openpyxl')
+        noms_feuilles = classeur.sheet_names
+    
+    # Filtrer les feuilles (sauf EXPORT)
+    return classeur, [name for name in noms_feuilles if name.upper() != "EXPORT"]
+
+def lire_feuille(classeur, sheet_name, moteur_lecture, moteur_filtre, verifier_legacy=False):
+    """Lit et filtre une feuille
+    
+    Retourne (DataFrame, écart éventuel avec l'ancien moteur, nombre de lignes lues).
+    """
+    if moteur_lecture == "streaming":
+        nb_lignes = 0
+        def compter(lignes):
+            nonlocal nb_lignes
+            for ligne in lignes:
+                nb_lignes += 1
+                yield ligne
+        data_rows = traiter_lignes_streaming(compter(iterer_lignes_feuille(classeur[sheet_name])))
+        return pd.DataFrame(data_rows), None, nb_lignes
+    
+    # Lire la feuille sans en-tête pour traiter toutes les lignes
+    df = pd.read_excel(classeur, sheet_name=sheet_name, header=None, engine='openpyxl')
+    if moteur_filtre != "vectorise":
+        return pd.DataFrame(traiter_feuille_optimise(sheet_name, df)), None, len(df)
+    
+    df_feuille = traiter_feuille_vectorise(sheet_name, df)
+    ecart = comparer_avec_legacy(sheet_name, df, df_feuille) if verifier_legacy else None
+    return df_feuille, ecart, len(df)
+
+def lire_feuille_mesuree(classeur, sheet_name, moteur_lecture, moteur_filtre, verifier_legacy, mesures):
+    """lire_feuille dans un span ; retourne (feuille, DataFrame, message, span)"""
+    with mesures.span("feuille", feuille=sheet_name) as span:
+        try:
+            df_feuille, ecart, nb_lignes = lire_feuille(
+                classeur, sheet_name, moteur_lecture, moteur_filtre, verifier_legacy
+            )
+        except Exception as e:
+            return sheet_name, None, f"Erreur sur la feuille {sheet_name}: {str(e)}", span
+        span["lignes_entree"] = nb_lignes
+        span["lignes_sortie"] = len(df_feuille)
+    return sheet_name, df_feuille, ecart, span
+
+def traiter_lot_feuilles(chemin, sheet_names, moteur_lecture, moteur_filtre, verifier_legacy=False):
+    """Tâche d'un processus : traite un lot de feuilles et retourne des colonnes compactes"""
+    classeur, _ = ouvrir_classeur_source(chemin, moteur_lecture)
+    mesures = Mesures()
+    resultats = []
+    try:
+        for sheet_name in sheet_names:
+            _, df_feuille, message, span = lire_feuille_mesuree(
+                classeur, sheet_name, moteur_lecture, moteur_filtre, verifier_legacy, mesures
+            )
+            colonnes = None
+            if df_feuille is not None:
+                colonnes = {col: df_feuille[col].to_numpy() for col in df_feuille.columns}
+            resultats.append((sheet_name, colonnes, message, span))
+    finally:
+        classeur.close()
+    return resultats
+
+def contexte_processus():
+    """Contexte multiprocessing des pools de lecture (spawn si forkserver est indisponible)"""
+    methode = METHODE_DEMARRAGE_PROCESSUS
+    if methode not in multiprocessing.get_all_start_methods():
+        methode = "spawn"
+    return multiprocessing.get_context(methode)
+
+def copier_source_temporaire(source):
+    """Écrit le fichier téléversé sur disque pour qu'il soit lisible par les processus"""
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+        try:
+            shutil.copyfileobj(source, tmp)
+        except BaseException:
+            # Copie partielle (disque plein, flux illisible) : pas de fichier orphelin
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    source.seek(0)
+    return tmp.name
+
+def taille_source(source):
+    """Taille en octets d'un chemin ou d'un fichier ouvert"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    taille = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return taille
+
+def taille_xml_source(source):
+    """Taille décompressée des membres du classeur (lue dans l'index zip, sans décompresser)"""
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    try:
+        with zipfile.ZipFile(source) as zf:
+            return sum(info.file_size for info in zf.infolist())
+    finally:
+        if not isinstance(source, (str, os.PathLike)):
+            source.seek(0)
+
+def membres_feuilles(zf):
+    """Membre zip de chaque feuille, d'après xl/workbook.xml et ses relations"""
+    relations = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    cibles = {relation.get("Id"): relation.get("Target", "") for relation in relations}
+    membres = {}
+    for feuille in ElementTree.fromstring(zf.read("xl/workbook.xml")).iterfind(f"{{{NS_MAIN}}}sheets/{{{NS_MAIN}}}sheet"):
+        cible = cibles.get(feuille.get(f"{{{NS_REL}}}id"), "")
+        membres[feuille.get("name")] = cible[1:] if cible.startswith("/") else posixpath.normpath(f"xl/{cible}")
+    return membres
+
+def estimer_lignes_xml(zf, membre):
+    """Taille XML d'une feuille et nombre de lignes extrapolé depuis le début du XML (exact si tout est lu)"""
+    info = zf.getinfo(membre)
+    with zf.open(info) as f:
+        debut = f.read(PRESCAN_OCTETS_XML)
+    nb_lignes = debut.count(b"<row ") + debut.count(b"<row>")
+    if len(debut) < info.file_size:
+        nb_lignes = int(nb_lignes * info.file_size / len(debut))
+    return info.file_size, nb_lignes
+
+def echantillon_contient_dates(ws, nb_lignes):
+    """Vrai si une date apparaît en colonne A dans les nb_lignes premières lignes (hors en-tête et titres)"""
+    lignes = ws.iter_rows(max_row=nb_lignes + 1, max_col=1, values_only=True)
+    # La première ligne est l'en-tête
+    next(lignes, None)
+    for ligne in lignes:
+        valeur = convertir_valeur_source(ligne[0] if ligne else None)
+        titre = str(valeur).strip().upper()
+        if titre in TITRES_EXCLUS or len(titre) > 50:
+            continue
+        if convertir_date_vol(valeur) is not None:
+            return True
+    return False
+
+def index_feuilles(classeur, source, sheet_names, moteur_lecture, nb_lignes=PRESCAN_LIGNES):
+    """Pré-analyse des feuilles, sans lecture complète
+    
+    Retourne une entrée par feuille, dans l'ordre du classeur : taille XML (index zip), lignes
+    estimées, et a_traiter, faux si aucune date n'apparaît en colonne A dans les nb_lignes
+    premières lignes (onglets de synthèse, notes, tableaux croisés).
+    """
+    est_chemin = isinstance(source, (str, os.PathLike))
+    if not est_chemin:
+        source.seek(0)
+    try:
+        with zipfile.ZipFile(source) as zf:
+            try:
+                membres = membres_feuilles(zf)
+            except (KeyError, ElementTree.ParseError):
+                membres = {}
+            tailles = {
+                sheet_name: estimer_lignes_xml(zf, membres[sheet_name]) if sheet_name in membres else (0, 0)
+                for sheet_name in sheet_names
+            }
+    finally:
+        if not est_chemin:
+            source.seek(0)
+    
+    # Le classeur pandas expose le classeur openpyxl (lecture seule) qu'il a ouvert
+    livre = classeur if moteur_lecture == "streaming" else classeur.book
+    return [
+        {
+            "feuille": sheet_name,
+            "octets_xml": tailles[sheet_name][0],
+            "lignes_estimees": tailles[sheet_name][1],
+            "a_traiter": echantillon_contient_dates(livre[sheet_name], nb_lignes),
+        }
+        for sheet_name in sheet_names
+    ]
+
+def repartir_feuilles(sheet_names, nb_lots, lignes_estimees):
+    """Lots de charge équilibrée sur les lignes estimées, plus grosses feuilles d'abord"""
+    lots = [[] for _ in range(nb_lots)]
+    charges = [0] * nb_lots
+    for sheet_name in sorted(sheet_names, key=lambda nom: lignes_estimees.get(nom, 0), reverse=True):
+        i = charges.index(min(charges))
+        lots[i].append(sheet_name)
+        charges[i] += max(1, lignes_estimees.get(sheet_name, 0))
+    # Lot le plus lourd soumis en premier
+    ordre = sorted(range(nb_lots), key=lambda i: charges[i], reverse=True)
+    return [lots[i] for i in ordre if lots[i]]
+
+def choisir_moteurs_memoire(source, budget_octets, moteur_lecture, moteur_ecriture, nb_workers):
+    """Moteurs compatibles avec le budget mémoire
+    
+    source : classeur ou liste de classeurs fusionnés.
+    Retourne (moteur_lecture, moteur_ecriture, nb_workers, pic estimé avec les moteurs demandés).
+    Si le pic estimé dépasse le budget : lecture en flux, écriture native, un seul processus.
+    """
+    sources = source if isinstance(source, (list, tuple)) else [source]
+    taille_xml = sum(taille_xml_source(chaque_source) for chaque_source in sources)
+    pic_estime = FACTEURS_PIC_MEMOIRE[moteur_ecriture] * taille_xml * max(1, nb_workers)
+    if pic_estime <= budget_octets:
+        return moteur_lecture, moteur_ecriture, nb_workers, pic_estime
+    return "streaming", "natif", 1, pic_estime
+
+# Limite et consommation mémoire du conteneur : cgroup v2, puis v1
+FICHIERS_CGROUP_MEMOIRE = (
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+)
+
+def memoire_cgroup():
+    """Mémoire restante sous la limite du cgroup (conteneur) en octets, None sans limite connue"""
+    for fichier_limite, fichier_usage in FICHIERS_CGROUP_MEMOIRE:
+        try:
+            with open(fichier_limite, encoding="ascii") as f:
+                limite = f.read().strip()
+            if limite == "max":
+                return None
+            with open(fichier_usage, encoding="ascii") as f:
+                return max(0, int(limite) - int(f.read().strip()))
+        except (OSError, ValueError):
+            continue
+    return None
+
+def memoire_hote():
+    """Mémoire disponible de l'hôte (MemAvailable de /proc/meminfo, sinon pages libres), None si inconnue"""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for ligne in f:
+                if ligne.startswith("MemAvailable:"):
+                    return int(ligne.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def memoire_disponible():
+    """Mémoire disponible en octets : la plus petite de l'hôte et du cgroup, None si inconnue"""
+    valeurs = [valeur for valeur in (memoire_hote(), memoire_cgroup()) if valeur is not None]
+    return min(valeurs) if valeurs else None
+
+def coeurs_disponibles():
+    """Cœurs utilisables par le processus (affinité CPU si connue)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def taille_feuilles_xml(source):
+    """(taille XML décompressée des feuilles hors EXPORT, nombre de feuilles), lue dans l'index zip"""
+    est_chemin = isinstance(source, (str, os.PathLike))
+    if not est_chemin:
+        source.seek(0)
+    try:
+        with zipfile.ZipFile(source) as zf:
+            try:
+                membres = [membre for nom, membre in membres_feuilles(zf).items() if nom.upper() != "EXPORT"]
+            except (KeyError, ElementTree.ParseError):
+                # Index du classeur illisible : tous les membres comptés, nombre de feuilles inconnu
+                return sum(info.file_size for info in zf.infolist()), 0
+            tailles = {info.filename: info.file_size for info in zf.infolist()}
+            return sum(tailles.get(membre, 0) for membre in membres), len(membres)
+    finally:
+        if not est_chemin:
+            source.seek(0)
+
+def planifier_execution(source, budget_memoire_octets=None):
+    """Plan d'exécution choisi d'après l'index zip du classeur, la mémoire disponible et les cœurs
+    
+    source : classeur ou liste de classeurs fusionnés.
+    Lecture en parallèle (un processus par feuille ou par fichier, dans la limite des cœurs) au-delà
+    de SEUIL_PLAN_PARALLELE_XML, écriture native au-delà de SEUIL_PLAN_NATIF_XML. Si le pic estimé
+    (FACTEURS_PIC_MEMOIRE) dépasse la limite (budget, sinon FRACTION_MEMOIRE_PLAN de la mémoire
+    disponible) : écriture native en série, puis lecture en flux, et tampons sur disque (toujours
+    sur disque avec un budget). La mémoire disponible tient compte de la limite du conteneur.
+    Retourne le plan et son estimation, enregistrés dans le span "plan".
+    """
+    sources = source if isinstance(source, (list, tuple)) else [source]
+    tailles = [taille_feuilles_xml(chaque_source) for chaque_source in sources]
+    octets_xml = sum(taille for taille, _ in tailles)
+    nb_feuilles = sum(nb for _, nb in tailles)
+    memoire = memoire_disponible()
+    coeurs = coeurs_disponibles()
+    limites = [budget for budget in (budget_memoire_octets, memoire and int(memoire * FRACTION_MEMOIRE_PLAN)) if budget]
+    limite = min(limites) if limites else None
+    
+    unites = len(sources) if len(sources) > 1 else nb_feuilles
+    nb_workers = min(coeurs, unites) if octets_xml >= SEUIL_PLAN_PARALLELE_XML and unites > 1 else 1
+    moteur_lecture = "pandas"
+    moteur_ecriture = "natif" if octets_xml >= SEUIL_PLAN_NATIF_XML else "standard"
+    pic_estime = FACTEURS_PIC_MEMOIRE[moteur_ecriture] * octets_xml * nb_workers
+    contraint = limite is not None and pic_estime > limite
+    if contraint:
+        moteur_ecriture, nb_workers = "natif", 1
+        pic_estime = FACTEURS_PIC_MEMOIRE[moteur_ecriture] * octets_xml
+        if pic_estime > limite:
+            moteur_lecture = "streaming"
+    return {
+        "octets_xml": octets_xml,
+        "feuilles": nb_feuilles,
+        "fichiers": len(sources),
+        "memoire_disponible": memoire,
+        "coeurs": coeurs,
+        "limite_memoire": limite,
+        "pic_estime": pic_estime,
+        "moteur_lecture": moteur_lecture,
+        "moteur_ecriture": moteur_ecriture,
+        "nb_workers": nb_workers,
+        "tampons": (
+            "disque" if budget_memoire_octets or contraint or octets_xml >= SEUIL_PLAN_DISQUE_XML else "memoire"
+        ),
+    }
+
+def taille_flux(flux):
+    """Taille d'un flux binaire (remis au début)"""
+    taille = flux.seek(0, os.SEEK_END)
+    flux.seek(0)
+    return taille
+
+def traiter_feuilles_en_parallele(source, sheet_names, nb_workers, moteur_lecture, moteur_filtre,
+                                  verifier_legacy=False, callback_progression=None, lignes_estimees=None):
+    """Répartit les feuilles entre processus
+    
+    callback_progression : appelé avec la liste des feuilles de chaque lot terminé.
+    lignes_estimees : {feuille: lignes} issu de la pré-analyse, pour équilibrer les lots.
+    Retourne [(feuille, DataFrame, message, span)] dans l'ordre d'origine.
+    """
+    est_chemin = isinstance(source, (str, os.PathLike))
+    chemin = source if est_chemin else copier_source_temporaire(source)
+    try:
+        # Environ deux lots par processus pour équilibrer la charge
+        if lignes_estimees:
+            lots = repartir_feuilles(sheet_names, min(len(sheet_names), nb_workers * 2), lignes_estimees)
+        else:
+            taille_lot = max(1, math.ceil(len(sheet_names) / (nb_workers * 2)))
+            lots = [sheet_names[i:i + taille_lot] for i in range(0, len(sheet_names), taille_lot)]
+        
+        par_feuille = {}
+        with ProcessPoolExecutor(max_workers=nb_workers, mp_context=contexte_processus()) as executor:
+            futures = {
+                executor.submit(traiter_lot_feuilles, chemin, lot, moteur_lecture, moteur_filtre, verifier_legacy): lot
+                for lot in lots
+            }
+            for future in as_completed(futures):
+                for sheet_name, colonnes, message, span in future.result():
+                    df_feuille = pd.DataFrame(colonnes) if colonnes is not None else None
+                    par_feuille[sheet_name] = (df_feuille, message, span)
+                if callback_progression:
+                    callback_progression(futures[future])
+    finally:
+        if not est_chemin:
+            os.remove(chemin)
+    
+    # Fusion dans l'ordre des feuilles
+    return [(sheet_name, *par_feuille[sheet_name]) for sheet_name in sheet_names]
+
+def lire_source(source, moteur_lecture, moteur_filtre, verifier_legacy, nb_workers, lignes_prescan, mesures,
+                callback_progression=None):
+    """Lit et filtre les feuilles d'un classeur source : pré-analyse, puis lecture en série ou en parallèle
+    
+    callback_progression : appelé avec (feuilles lues, feuilles à lire, fraction lue pondérée par les
+    lignes estimées), une première fois après la pré-analyse puis après chaque feuille ou lot.
+    Retourne (DataFrames non vides par feuille, messages, lignes lues).
+    """
+    classeur, sheet_names = ouvrir_classeur_source(source, moteur_lecture)
+    try:
+        lignes_estimees = {}
+        if lignes_prescan:
+            with mesures.span("prescan") as span:
+                index = index_feuilles(classeur, source, sheet_names, moteur_lecture, lignes_prescan)
+                ignorees = [entree["feuille"] for entree in index if not entree["a_traiter"]]
+                if ignorees:
+                    logger.info(f"Feuilles sans événement CREX ignorées : {', '.join(ignorees)}")
+                sheet_names = [entree["feuille"] for entree in index if entree["a_traiter"]]
+                lignes_estimees = {entree["feuille"]: entree["lignes_estimees"] for entree in index}
+                span["lignes_entree"] = sum(lignes_estimees.values())
+                span["lignes_sortie"] = sum(lignes_estimees[nom] for nom in sheet_names)
+                span["feuilles_ignorees"] = len(ignorees)
+        
+        # Progression pondérée par les lignes estimées de chaque feuille
+        poids = {nom: max(1, lignes_estimees.get(nom, 1)) for nom in sheet_names}
+        poids_total = sum(poids.values())
+        feuilles_terminees = poids_termine = 0
+        
+        def maj_progression(feuilles):
+            nonlocal feuilles_terminees, poids_termine
+            feuilles_terminees += len(feuilles)
+            poids_termine += sum(poids[nom] for nom in feuilles)
+            if callback_progression and poids_total:
+                callback_progression(feuilles_terminees, len(sheet_names), poids_termine / poids_total)
+        
+        if callback_progression:
+            callback_progression(0, len(sheet_names), 0.0)
+        
+        # Les petits fichiers restent en série : le démarrage des processus coûterait plus cher
+        en_parallele = (
+            nb_workers > 1 and len(sheet_names) > 1
+            and taille_source(source) >= SEUIL_PARALLELE_OCTETS
+        )
+        
+        if en_parallele:
+            classeur.close()
+            classeur = None
+            resultats = traiter_feuilles_en_parallele(
+                source, sheet_names, min(nb_workers, len(sheet_names)),
+                moteur_lecture, moteur_filtre, verifier_legacy, callback_progression=maj_progression,
+                lignes_estimees=lignes_estimees
+            )
+            # Spans mesurés dans les processus de lecture
+            for resultat in resultats:
+                resultat[3]["parent"] = "lecture"
+                mesures.spans.append(resultat[3])
+        else:
+            # Traiter chaque feuille
+            resultats = []
+            for sheet_name in sheet_names:
+                resultats.append(lire_feuille_mesuree(
+                    classeur, sheet_name, moteur_lecture, moteur_filtre, verifier_legacy, mesures
+                ))
+                maj_progression([sheet_name])
+    finally:
+        if classeur is not None:
+            classeur.close()
+    
+    frames = [df_feuille for _, df_feuille, _, _ in resultats if df_feuille is not None and len(df_feuille) > 0]
+    messages = [message for _, _, message, _ in resultats if message]
+    return frames, messages, sum(r[3].get("lignes_entree", 0) for r in resultats)
+
+def nom_source(source, rang=0):
+    """Nom affiché d'un classeur source (chemin, fichier téléversé, ou "fichier n" pour un flux sans nom)"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.basename(os.fspath(source))
+    nom = getattr(source, "name", None)
+    return nom if isinstance(nom, str) and nom else f"fichier {rang + 1}"
+
+def lire_fichier(source, nom, moteur_lecture, moteur_filtre, verifier_legacy, lignes_prescan, mesures,
+                 callback_progression=None):
+    """Lit un classeur d'une fusion dans un span "fichier" ; retourne (DataFrame du fichier ou None, messages)"""
+    with mesures.span("fichier", fichier=nom) as span:
+        frames, messages, lignes_lues = lire_source(
+            source, moteur_lecture, moteur_filtre, verifier_legacy, 1, lignes_prescan, mesures, callback_progression
+        )
+        df_fichier = pd.concat(frames, ignore_index=True) if frames else None
+        span["lignes_entree"] = lignes_lues
+        span["lignes_sortie"] = len(df_fichier) if df_fichier is not None else 0
+    return df_fichier, [f"{nom} : {message}" for message in messages]
+
+def lire_fichier_compact(chemin, nom, moteur_lecture, moteur_filtre, verifier_legacy, lignes_prescan):
+    """Tâche d'un processus : lit un classeur d'une fusion et retourne des colonnes compactes et ses spans"""
+    mesures = Mesures()
+    df_fichier, messages = lire_fichier(chemin, nom, moteur_lecture, moteur_filtre, verifier_legacy,
+                                        lignes_prescan, mesures)
+    colonnes = None
+    if df_fichier is not None:
+        colonnes = {col: df_fichier[col].to_numpy() for col in df_fichier.columns}
+    return colonnes, messages, mesures.spans
+
+def lire_sources(sources, noms, moteur_lecture, moteur_filtre, verifier_legacy, nb_workers, lignes_prescan,
+                 mesures, progress_bar=None):
+    """Lit plusieurs classeurs à fusionner, un processus par fichier si nb_workers > 1 et si leur
+    taille totale atteint SEUIL_PARALLELE_OCTETS
+    
+    Retourne (DataFrame par fichier, dans l'ordre des sources et None si vide, messages).
+    Chaque fichier a son span "fichier" (lignes lues, lignes retenues, durée).
+    """
+    # Avancement de chaque fichier, pondéré par sa taille
+    tailles = [max(1, taille_source(source)) for source in sources]
+    avancement = [0.0] * len(sources)
+    fichiers_lus = 0
+    
+    def maj_progression(i, texte):
+        if progress_bar:
+            progress_value = 10 + int(sum(t * a for t, a in zip(tailles, avancement)) / sum(tailles) * 40)
+            progress_bar.progress(progress_value, text=texte)
+    
+    def fichier_lu(i, spans):
+        nonlocal fichiers_lus
+        fichiers_lus += 1
+        avancement[i] = 1.0
+        secondes = next(span["secondes"] for span in spans if span["nom"] == "fichier")
+        maj_progression(i, f"Fichier {fichiers_lus}/{len(sources)} lu : {noms[i]} ({secondes:.1f} s)")
+    
+    df_fichiers = [None] * len(sources)
+    messages = []
+    # Comme pour les feuilles : en dessous du seuil, le démarrage des processus et la copie des
+    # fichiers téléversés coûteraient plus cher que la lecture en série
+    if nb_workers > 1 and len(sources) > 1 and sum(tailles) >= SEUIL_PARALLELE_OCTETS:
+        temporaires = [
+            None if isinstance(source, (str, os.PathLike)) else copier_source_temporaire(source)
+            for source in sources
+        ]
+        spans_fichiers = [[] for _ in sources]
+        try:
+            with ProcessPoolExecutor(max_workers=min(nb_workers, len(sources)),
+                                     mp_context=contexte_processus()) as executor:
+                futures = {
+                    executor.submit(lire_fichier_compact, temporaire or source, nom, moteur_lecture,
+                                    moteur_filtre, verifier_legacy, lignes_prescan): i
+                    for i, (source, temporaire, nom) in enumerate(zip(sources, temporaires, noms))
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    colonnes, messages_fichier, spans = future.result()
+                    df_fichiers[i] = pd.DataFrame(colonnes) if colonnes is not None else None
+                    messages.extend(messages_fichier)
+                    spans_fichiers[i] = spans
+                    fichier_lu(i, spans)
+        finally:
+            for temporaire in temporaires:
+                if temporaire is not None:
+                    os.remove(temporaire)
+        # Spans mesurés dans les processus de lecture, dans l'ordre des fichiers
+        for spans in spans_fichiers:
+            for span in spans:
+                if span["parent"] is None:
+                    span["parent"] = "lecture"
+                mesures.spans.append(span)
+    else:
+        for i, (source, nom) in enumerate(zip(sources, noms)):
+            def progression_feuilles(lues, a_lire, fraction, i=i, nom=nom):
+                avancement[i] = fraction
+                maj_progression(i, f"Fichier {i + 1}/{len(sources)} ({nom}) : feuille {lues}/{a_lire}...")
+            nb_spans = len(mesures.spans)
+            df_fichiers[i], messages_fichier = lire_fichier(
+                source, nom, moteur_lecture, moteur_filtre, verifier_legacy, lignes_prescan, mesures,
+                progression_feuilles
+            )
+            messages.extend(messages_fichier)
+            fichier_lu(i, mesures.spans[nb_spans:])
+    return df_fichiers, messages
+
+def fusionner_fichiers(df_fichiers):
+    """Concatène les lignes de plusieurs fichiers sans les lignes déjà présentes dans un autre fichier
+    
+    Une ligne est reconnue par la clé stable de l'historique (crex_historique.cles_lignes), ajoutée
+    dans Cle_Ligne. Les doublons au sein d'un même fichier sont conservés comme pour un fichier seul :
+    une clé garde le plus grand nombre d'occurrences trouvé dans un fichier.
+    Retourne (df_all, lignes écartées).
+    """
+    from crex_historique import cles_lignes
+    morceaux = []
+    for df_fichier in df_fichiers:
+        cles = cles_lignes(df_fichier.assign(**{'Date Vol': formater_dates_french(df_fichier['Date Vol'])}))
+        morceaux.append(df_fichier.assign(Cle_Ligne=cles, _occurrence=cles.groupby(cles).cumcount()))
+    df_all = pd.concat(morceaux, ignore_index=True)
+    doublons = df_all.duplicated(['Cle_Ligne', '_occurrence'])
+    return df_all.loc[~doublons].drop(columns='_occurrence').reset_index(drop=True), int(doublons.sum())
+
+def categoriser_colonnes(df_all):
+    """Convertit les colonnes répétitives (COLONNES_CATEGORIELLES) en catégories, en place"""
+    for col in COLONNES_CATEGORIELLES:
+        if col in df_all.columns:
+            df_all[col] = df_all[col].astype("category")
+    return df_all
+
+def normaliser_par_valeur(serie, normaliser):
+    """Applique normaliser (fonction d'Index) une seule fois par valeur distincte de la série
+    
+    Retourne une série catégorielle alignée sur serie, catégories triées.
+    """
+    codes, valeurs = pd.factorize(serie, use_na_sentinel=False)
+    normalisees = normaliser(pd.Index(valeurs, dtype=object))
+    codes_normalises, categories = pd.factorize(normalisees, sort=True)
+    return pd.Series(pd.Categorical.from_codes(codes_normalises[codes], categories), index=serie.index)
+
+def organiser_par_origine(df_all):
+    """Répartit les lignes par feuille d'origine (ORY, MRS, ..., Autre)
+    
+    Retourne {feuille: DataFrame} ; seules les colonnes de données sont stockées (voir colonnes_sortie).
+    """
+    # Colonnes de sortie, dates formatées une seule fois pour toute la colonne
+    df_sortie = pd.DataFrame(
+        {col: df_all[col] if col in df_all.columns else "" for col in COLONNES_DONNEES[1:]},
+        index=df_all.index
+    )
+    df_sortie.insert(0, 'Date Vol', formater_dates_french(df_all['Date Vol']))
+    # Annotations reprises d'un traitement précédent (mode incrémental "complet")
+    for col in ENTETES_SORTIE[len(COLONNES_DONNEES):]:
+        if col in df_all.columns:
+            df_sortie[col] = df_all[col]
+    
+    # Grouper par origine de manière vectorisée
+    if 'Origin' not in df_all.columns:
+        # Fallback si pas de colonne Origin
+        return {"Autre": df_sortie.reset_index(drop=True)}
+    
+    # Nettoyage et choix de la feuille par origine distincte, pas par ligne
+    df_all['Origin_clean'] = normaliser_par_valeur(df_all['Origin'], lambda v: v.astype(str).str.strip().str.upper())
+    df_all['Sheet_Name'] = normaliser_par_valeur(
+        df_all['Origin_clean'], lambda v: v.where(v.isin(ORIGINES_VALIDES), "Autre")
+    )
+    
+    # Grouper par nom de feuille
+    return {
+        sheet_name: group.reset_index(drop=True)
+        for sheet_name, group in df_sortie.groupby(df_all['Sheet_Name'], observed=True)
+    }
+
+def repr_feuille(sheet_name):
+    """Nom de feuille tel qu'écrit dans une référence de formule"""
+    return f"'{sheet_name}'"
+
+def construire_consolidation(nouvelles_feuilles, formules=True):
+    """Feuille Consolidation : formules renvoyant vers les feuilles par origine, ligne à ligne
+    
+    attrs['blocs'] conserve [(feuille source, première ligne source, nombre de lignes)] pour l'écriture
+    en formules partagées. formules=False ne construit pas les textes de formules (seul attrs['blocs']
+    sert au moteur natif en formules partagées) : une DataFrame sans colonne, de la bonne longueur.
+    """
+    blocs = [(sheet_name, 0, len(data)) for sheet_name, data in nouvelles_feuilles.items() if len(data) > 0]
+    if not formules:
+        consolidation = pd.DataFrame(index=pd.RangeIndex(sum(nb for _, _, nb in blocs)))
+        consolidation.attrs['blocs'] = blocs
+        return consolidation
+    
+    lettres = lettres_sortie()
+    formules_blocs = []
+    for sheet_name, _, nb in blocs:
+        rows = pd.Series(range(2, nb + 2)).astype(str)
+        formules_blocs.append(pd.DataFrame({
+            col_name: f"={repr_feuille(sheet_name)}!{lettre}" + rows
+            for col_name, lettre in zip(ENTETES_SORTIE, lettres)
+        }))
+    consolidation = (
+        pd.concat(formules_blocs, ignore_index=True) if formules_blocs else pd.DataFrame(columns=ENTETES_SORTIE)
+    )
+    consolidation.attrs['blocs'] = blocs
+    return consolidation
+
+def nom_partie(sheet_name, num):
+    """Nom de la partie num d'une feuille découpée : ORY, ORY (2), ORY (3)..."""
+    return sheet_name if num == 1 else f"{sheet_name} ({num})"
+
+def feuille_source(nom):
+    """Feuille dont nom est une partie : "Consolidation (2)" -> "Consolidation" """
+    base, separateur, fin = nom.rpartition(" (")
+    return base if separateur and fin.endswith(")") and fin[:-1].isdigit() else nom
+
+def plan_parties(nb_lignes, lignes_max=LIGNES_MAX_FEUILLE):
+    """[(première ligne, nombre de lignes)] des parties d'une feuille de nb_lignes lignes de données"""
+    return [(debut, min(lignes_max, nb_lignes - debut)) for debut in range(0, nb_lignes, lignes_max)] or [(0, 0)]
+
+def blocs_partie(blocs, debut, nb):
+    """Blocs de Consolidation couvrant ses lignes [debut, debut + nb), un bloc pouvant être coupé"""
+    resultat = []
+    position = 0
+    for sheet_name, debut_source, nb_bloc in blocs:
+        premiere, derniere = max(debut, position), min(debut + nb, position + nb_bloc)
+        if premiere < derniere:
+            resultat.append((sheet_name, debut_source + premiere - position, derniere - premiere))
+        position += nb_bloc
+    return resultat
+
+def decouper_feuilles(nouvelles_feuilles, lignes_max=LIGNES_MAX_FEUILLE):
+    """Découpe les feuilles de plus de lignes_max lignes en parties numérotées, à la suite de l'originale
+    
+    Les parties sont des tranches des DataFrames, dimensionnées avant l'écriture (plan_parties) ;
+    attrs['blocs'] de la Consolidation est recalculé pour chaque partie.
+    """
+    parties = {}
+    for sheet_name, data in nouvelles_feuilles.items():
+        if len(data) <= lignes_max:
+            parties[sheet_name] = data
+            continue
+        plan = plan_parties(len(data), lignes_max)
+        logger.info(f"Feuille {sheet_name} : {len(data)} lignes réparties sur {len(plan)} feuilles")
+        for num, (debut, nb) in enumerate(plan, 1):
+            partie = data.iloc[debut:debut + nb]
+            partie.attrs = {}
+            if 'blocs' in data.attrs:
+                partie.attrs['blocs'] = blocs_partie(data.attrs['blocs'], debut, nb)
+            parties[nom_partie(sheet_name, num)] = partie
+    return parties
+
+def colonnes_sortie(data):
+    """Valeurs des 14 colonnes de sortie d'une feuille : tableau objet, ou None si la colonne est vide"""
+    return [data[col].to_numpy(dtype=object) if col in data.columns else None for col in ENTETES_SORTIE]
+
+def iterer_lignes_sortie(data):
+    """Lignes d'une feuille sous forme de tuples de 14 valeurs (None pour les colonnes vides)"""
+    return zip(*(
+        valeurs if valeurs is not None else repeat(None, len(data))
+        for valeurs in colonnes_sortie(data)
+    ))
+
+def formats_export_disponibles():
+    """Formats d'export utilisables avec les bibliothèques installées"""
+    pyarrow = importlib.util.find_spec("pyarrow") is not None
+    disponibles = {
+        "parquet": pyarrow or importlib.util.find_spec("fastparquet") is not None,
+        "csv": True,
+        "arrow": pyarrow,
+    }
+    return [format_export for format_export in FORMATS_EXPORT if disponibles[format_export]]
+
+def donnees_export(df_all):
+    """Lignes retenues typées pour l'export : Date Vol en datetime64, textes en chaînes (vide = NA)"""
+    donnees = pd.DataFrame({'Date Vol': pd.to_datetime(df_all['Date Vol'])})
+    colonnes = [col for col in ENTETES_SORTIE[1:] if col in df_all.columns] + ['Origin_clean', 'Sheet_Name']
+    for col in colonnes:
+        serie = df_all[col] if col in df_all.columns else pd.Series("Autre", index=df_all.index)
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # Catégories entières avec des vides : le type des catégories n'accepte pas NaN
+            type_categories = serie.cat.categories.dtype
+            serie = serie.astype(object)
+            if pd.api.types.is_float_dtype(type_categories):
+                serie = serie.astype(type_categories)
+        # Numéros lus en flottants (colonne numérique avec des vides) : 1234 et non 1234.0
+        if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+            serie = serie.astype("Int64")
+        donnees[col] = serie.astype("string")
+    return donnees
+
+def partitions_export(donnees):
+    """(chemin de partition, DataFrame) par feuille et par mois de vol : feuille=ORY/mois_vol=2024-01
+    
+    Un découpage par jour produirait des fichiers de quelques lignes (environ 5 ms d'écriture chacun).
+    """
+    mois = donnees['Date Vol'].dt.strftime("%Y-%m")
+    for (sheet_name, mois_vol), partie in donnees.groupby([donnees['Sheet_Name'], mois], sort=True):
+        yield f"feuille={quote(sheet_name, safe='')}/mois_vol={mois_vol}", partie.reset_index(drop=True)
+
+def ecrire_partition(partie, format_export):
+    """Octets d'une partition, écrits par pandas / pyarrow sans passer par openpyxl"""
+    tampon = BytesIO()
+    if format_export == "csv":
+        partie.to_csv(tampon, index=False, date_format="%Y-%m-%d", encoding="utf-8")
+    elif format_export == "parquet":
+        partie.to_parquet(tampon, index=False)
+    else:
+        # Feather v2 : format de fichier Arrow IPC
+        partie.to_feather(tampon)
+    return tampon.getvalue()
+
+def exporter_donnees(df_all, format_export, destination=None):
+    """Exporte les lignes retenues, partitionnées par feuille et par mois de vol
+    
+    format_export : "parquet", "csv" ou "arrow" (voir formats_export_disponibles).
+    destination : dossier, remplacé s'il existe ; sans destination, retourne une archive zip (BytesIO).
+    """
+    extension = FORMATS_EXPORT[format_export]
+    partitions = partitions_export(donnees_export(df_all))
+    if destination is not None:
+        if os.path.isdir(destination):
+            shutil.rmtree(destination)
+        for partition, partie in partitions:
+            dossier = os.path.join(destination, *partition.split("/"))
+            os.makedirs(dossier, exist_ok=True)
+            with open(os.path.join(dossier, f"part-0{extension}"), 'wb') as f:
+                f.write(ecrire_partition(partie, format_export))
+        return destination
+    
+    archive = BytesIO()
+    # Parquet et Arrow sont déjà compressés
+    compression = zipfile.ZIP_DEFLATED if format_export == "csv" else zipfile.ZIP_STORED
+    with zipfile.ZipFile(archive, 'w', compression) as zf:
+        for partition, partie in partitions:
+            zf.writestr(f"{partition}/part-0{extension}", ecrire_partition(partie, format_export))
+    archive.seek(0)
+    return archive
+
+def construire_synthese(df_all):
+    """Agrégats pré-calculés de la synthèse : événements par axe, feuille et non-conformité
+    
+    Retourne {axe: DataFrame [colonne de l'axe, Sheet_Name, Non Conformité, Événements]} (voir
+    AXES_SYNTHESE). Les vues filtrées (vue_synthese) se calculent sur ces agrégats, bien plus
+    petits que df_all, sans regrouper à nouveau les lignes.
+    """
+    base = pd.DataFrame({
+        "Jour": pd.to_datetime(df_all['Date Vol']).dt.normalize(),
+        "Sheet_Name": df_all['Sheet_Name'] if 'Sheet_Name' in df_all.columns else "Autre",
+        "Catering": df_all['Catering'] if 'Catering' in df_all.columns else None,
+        "Aircraft Registration": df_all['Aircraft Registration'] if 'Aircraft Registration' in df_all.columns else None,
+        "Non Conformité": df_all['Non Conformité'] if 'Non Conformité' in df_all.columns else None,
+    })
+    synthese = {}
+    for axe, colonne in AXES_SYNTHESE.items():
+        cles = list(dict.fromkeys([colonne, "Sheet_Name", "Non Conformité"]))
+        synthese[axe] = (
+            base.groupby(cles, observed=True, dropna=False, sort=False).size()
+            .rename("Événements").reset_index()
+        )
+    return synthese
+
+def vue_synthese(synthese, axe, feuilles=None, non_conformites=None):
+    """Vue d'un axe de la synthèse, filtrée sur des feuilles et des codes de non-conformité
+    
+    Retourne une ligne par valeur de l'axe : événements, part du total et non-conformités distinctes,
+    par date pour l'axe "jour", par nombre d'événements décroissant sinon.
+    """
+    colonne = AXES_SYNTHESE[axe]
+    agregats = synthese[axe]
+    masque = pd.Series(True, index=agregats.index)
+    if feuilles:
+        masque &= agregats["Sheet_Name"].isin(feuilles)
+    if non_conformites:
+        masque &= agregats["Non Conformité"].isin(non_conformites)
+    groupes = agregats.loc[masque].groupby(colonne, observed=True, dropna=False, sort=False)
+    vue = pd.DataFrame({
+        "Événements": groupes["Événements"].sum(),
+        "Non-conformités distinctes": groupes["Non Conformité"].nunique(),
+    })
+    vue.insert(1, "Part (%)", (vue["Événements"] / max(1, vue["Événements"].sum()) * 100).round(1))
+    vue = vue.sort_index() if axe == "jour" else vue.sort_values("Événements", ascending=False, kind="stable")
+    return vue.rename_axis(colonne).reset_index()
+
+def traiter_exactement_comme_vba(uploaded_file, progress_bar=None, moteur_lecture="pandas",
+                                 moteur_filtre="vectorise", verifier_legacy=False, nb_workers=1,
+                                 moteur_ecriture="standard", compression="rapide", durees=None,
+                                 mesures=None, consolidation="simple", historique=None,
+                                 mode_incremental="nouvelles", budget_memoire_octets=None,
+                                 lignes_prescan=PRESCAN_LIGNES, sans_excel=False, noms_sources=None,
+                                 planifier=False):
+    """Version optimisée du traitement VBA
+    
+    uploaded_file : classeur source, ou liste de classeurs fusionnés en un seul résultat (lus en
+    parallèle si nb_workers > 1 et au-delà de SEUIL_PARALLELE_OCTETS au total, lignes présentes dans
+    plusieurs fichiers écrites une seule fois)
+    moteur_lecture : "pandas" ou "streaming"
+    moteur_filtre : "vectorise" ou "legacy" (lecture pandas uniquement)
+    verifier_legacy : exécute aussi l'ancien moteur et signale les écarts
+    nb_workers : nombre de processus pour la lecture des feuilles (1 = en série)
+    moteur_ecriture : "standard", "streaming" (write-only) ou "natif" (zipfile)
+    compression : "rapide" ou "compact" (moteur natif)
+    consolidation : "simple" ou "partagee" (formules partagées avec valeurs en cache, moteur natif)
+    durees : dictionnaire optionnel complété avec les durées par étape (secondes)
+    mesures : Mesures optionnel recevant les spans par étape et par feuille
+    historique : HistoriqueLignes optionnel (crex_historique) pour le traitement incrémental
+    mode_incremental : "nouvelles" (lignes jamais traitées) ou "complet" (annotations reprises)
+    budget_memoire_octets : active le mode mémoire bornée. Le fichier téléversé est copié sur disque
+    et lu depuis le zip, les moteurs de flux sont choisis si le pic estimé dépasse le budget, et le
+    classeur produit est un SpooledTemporaryFile au lieu d'un BytesIO.
+    lignes_prescan : lignes échantillonnées par feuille pour écarter les feuilles sans événement,
+    ordonner la lecture parallèle et pondérer la progression (0 = toutes les feuilles sont lues)
+    sans_excel : s'arrête après l'organisation (Origin_clean, Sheet_Name) ; le classeur retourné est
+    None et df_all sert aux exports de données (exporter_donnees)
+    noms_sources : noms affichés des classeurs fusionnés (progression, spans "fichier")
+    planifier : moteurs, processus et tampons choisis par planifier_execution (moteur_lecture,
+    moteur_ecriture et nb_workers ignorés ; budget_memoire_octets sert de limite et garde les
+    tampons sur disque) ; le plan et son estimation sont enregistrés dans le span "plan", à côté
+    des durées mesurées
+    """
+    if durees is None:
+        durees = {}
+    if mesures is None:
+        mesures = Mesures()
+    sources = list(uploaded_file) if isinstance(uploaded_file, (list, tuple)) else [uploaded_file]
+    sources_temporaires = []
+    trace = ExitStack()
+    if mesures.tracer_memoire:
+        trace.enter_context(trace_memoire())
+    try:
+        start_time = time.time()
+        sortie = None
+        noms_sources = (
+            list(noms_sources) if noms_sources else [nom_source(source, i) for i, source in enumerate(sources)]
+        )
+        
+        sur_disque = bool(budget_memoire_octets)
+        if planifier:
+            with mesures.span("plan") as span:
+                span.update(planifier_execution(sources, budget_memoire_octets))
+            moteur_lecture, moteur_ecriture, nb_workers = (
+                span["moteur_lecture"], span["moteur_ecriture"], span["nb_workers"]
+            )
+            sur_disque = sur_disque or span["tampons"] == "disque"
+        
+        if sur_disque:
+            # Le téléversement n'est plus dupliqué en mémoire : lecture depuis le fichier sur disque
+            for i, source in enumerate(sources):
+                if not isinstance(source, (str, os.PathLike)):
+                    sources[i] = copier_source_temporaire(source)
+                    sources_temporaires.append(sources[i])
+            if not planifier:
+                moteurs = choisir_moteurs_memoire(sources, budget_memoire_octets, moteur_lecture,
+                                                  moteur_ecriture, nb_workers)
+                if moteurs[:3] != (moteur_lecture, moteur_ecriture, nb_workers):
+                    logger.warning(
+                        f"Pic mémoire estimé {moteurs[3] / 1024 ** 2:.0f} Mo au-delà du budget de "
+                        f"{budget_memoire_octets / 1024 ** 2:.0f} Mo : lecture en flux et écriture native"
+                    )
+                    moteur_lecture, moteur_ecriture, nb_workers = moteurs[:3]
+            sortie = tempfile.SpooledTemporaryFile(max_size=SEUIL_SORTIE_MEMOIRE_OCTETS)
+        
+        with mesures.span("total"):
+            with mesures.span("lecture") as span_lecture:
+                if len(sources) == 1:
+                    def progression_feuilles(lues, a_lire, fraction):
+                        if progress_bar:
+                            if lues == 0:
+                                progress_bar.progress(10, text="Lecture des feuilles...")
+                            else:
+                                progress_bar.progress(
+                                    10 + int(fraction * 40), text=f"Traitement feuille {lues}/{a_lire}..."
+                                )
+                    
+                    frames, messages, lignes_lues = lire_source(
+                        sources[0], moteur_lecture, moteur_filtre, verifier_legacy, nb_workers, lignes_prescan,
+                        mesures, progression_feuilles
+                    )
+                else:
+                    if progress_bar:
+                        progress_bar.progress(10, text=f"Lecture de {len(sources)} fichiers...")
+                    df_fichiers, messages = lire_sources(
+                        sources, noms_sources, moteur_lecture, moteur_filtre, verifier_legacy, nb_workers,
+                        lignes_prescan, mesures, progress_bar
+                    )
+                    frames = [df_fichier for df_fichier in df_fichiers if df_fichier is not None]
+                    lignes_lues = sum(
+                        span.get("lignes_entree", 0) for span in mesures.spans if span["nom"] == "fichier"
+                    )
+                
+                for message in messages:
+                    logger.warning(message)
+                span_lecture["lignes_entree"] = lignes_lues
+                span_lecture["lignes_sortie"] = sum(len(df) for df in frames)
+            
+            if not frames:
+                return None, "Aucune donnée valide trouvée dans le fichier.", None
+            
+            if progress_bar:
+                progress_bar.progress(60, text="Organisation des données...")
+            
+            # Créer DataFrame ; les DataFrames par feuille ne sont plus nécessaires
+            if len(sources) == 1:
+                df_all = pd.concat(frames, ignore_index=True)
+            else:
+                with mesures.span("fusion") as span:
+                    span["lignes_entree"] = sum(len(df) for df in frames)
+                    df_all, span["doublons"] = fusionner_fichiers(frames)
+                    span["lignes_sortie"] = len(df_all)
+            frames = None
+            categoriser_colonnes(df_all)
+            
+            if historique is not None:
+                with mesures.span("historique") as span:
+                    span["lignes_entree"] = len(df_all)
+                    df_all = historique.appliquer(df_all, mode_incremental)
+                    span["lignes_sortie"] = len(df_all)
+                if len(df_all) == 0:
+                    return None, AUCUNE_NOUVELLE_LIGNE, None
+            
+            with mesures.span("organisation") as span:
+                # Feuilles au-delà de la limite d'Excel découpées avant la Consolidation,
+                # dont les formules renvoient ainsi vers la bonne partie
+                nouvelles_feuilles = decouper_feuilles(organiser_par_origine(df_all))
+                span["lignes_entree"] = len(df_all)
+                span["lignes_sortie"] = sum(len(data) for data in nouvelles_feuilles.values())
+                span["feuilles"] = len(nouvelles_feuilles)
+            
+            excel_output = None
+            if not sans_excel:
+                if progress_bar:
+                    progress_bar.progress(80, text="Création de la consolidation...")
+                
+                with mesures.span("consolidation") as span:
+                    # Créer la feuille Consolidation avec formules (textes inutiles en formules partagées)
+                    consolidation_data = construire_consolidation(
+                        nouvelles_feuilles, formules=not (moteur_ecriture == "natif" and consolidation == "partagee")
+                    )
+                    span["lignes_entree"] = span["lignes_sortie"] = len(consolidation_data)
+                    
+                    nouvelles_feuilles.update(decouper_feuilles({'Consolidation': consolidation_data}))
+                
+                if progress_bar:
+                    progress_bar.progress(90, text="Génération du fichier Excel...")
+                
+                with mesures.span("ecriture") as span:
+                    # Créer le fichier Excel
+                    excel_output = creer_excel_avec_formatage_optimise(
+                        nouvelles_feuilles, moteur_ecriture, compression, consolidation, sortie
+                    )
+                    span["lignes_entree"] = sum(len(data) for data in nouvelles_feuilles.values())
+                    span["octets_sortie"] = taille_flux(excel_output) if excel_output else 0
+                    span["feuilles"] = len(nouvelles_feuilles)
+            nouvelles_feuilles = None
+            
+            # Lignes marquées comme traitées une fois le classeur produit
+            if historique is not None and (excel_output is not None or sans_excel):
+                with mesures.span("enregistrement"):
+                    historique.enregistrer(df_all)
+        
+        end_time = time.time()
+        processing_time = end_time - start_time
+        durees.update(mesures.durees())
+        
+        if progress_bar:
+            progress_bar.progress(100, text=f"Terminé en {processing_time:.1f} secondes")
+        
+        return excel_output, None, df_all
+        
+    except Exception as e:
+        return None, f"Erreur lors du traitement: {str(e)}", None
+    finally:
+        for source_temporaire in sources_temporaires:
+            os.remove(source_temporaire)
+        trace.close()
+
+def creer_styles_nommes(wb):
+    """Enregistre les styles nommés partagés (en-tête, retour à la ligne, haut, déverrouillé)"""
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Protection, Side
+    from openpyxl.styles.fonts import DEFAULT_FONT
+    thin_border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    styles = [
+        NamedStyle(
+            name="crex_entete",
+            font=Font(bold=True, color="003366"),
+            fill=PatternFill(start_color="FFE6CC", end_color="FFE6CC", fill_type="solid"),
+            border=thin_border,
+            alignment=Alignment(horizontal='center', vertical='center')
+        ),
+        NamedStyle(
+            name="crex_retour",
+            font=DEFAULT_FONT,
+            border=thin_border,
+            alignment=Alignment(wrap_text=True, vertical='top')
+        ),
+        NamedStyle(name="crex_haut", font=DEFAULT_FONT, border=thin_border, alignment=Alignment(vertical='top')),
+        NamedStyle(
+            name="crex_deverrouille",
+            font=DEFAULT_FONT,
+            border=thin_border,
+            alignment=Alignment(wrap_text=True, vertical='top'),
+            protection=Protection(locked=False)
+        ),
+    ]
+    for style in styles:
+        wb.add_named_style(style)
+
+def style_colonne(col_idx):
+    """Style nommé d'une cellule de données selon sa colonne"""
+    if col_idx in (10, 11):
+        return "crex_deverrouille"
+    if col_idx in (2, 3, 4, 5):
+        return "crex_haut"
+    return "crex_retour"
+
+def creer_excel_flux(nouvelles_feuilles, sortie=None):
+    """Création Excel en mode write-only : lignes écrites au fil de l'eau avec des styles nommés partagés"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import TIME_TYPES
+    from openpyxl.worksheet.datavalidation import DataValidation
+    try:
+        output = sortie if sortie is not None else BytesIO()
+        wb = Workbook(write_only=True)
+        creer_styles_nommes(wb)
+        
+        for sheet_name, data in nouvelles_feuilles.items():
+            ws = wb.create_sheet(title=sheet_name)
+            
+            # Largeurs, validations et protection sont définies avant l'écriture des lignes
+            for col, width in LARGEURS_COLONNES.items():
+                ws.column_dimensions[col].width = width
+            
+            if len(data) > 0:
+                last_row = len(data) + 1
+                for col in ('J', 'M'):
+                    dv = DataValidation(
+                        type="list",
+                        formula1='"Accepté,Refusé,N/A"',
+                        allow_blank=True
+                    )
+                    dv.add(f'{col}2:{col}{last_row}')
+                    ws.data_validations.append(dv)
+            
+            ws.protection.sheet = True
+            ws.protection.set_password(MOT_DE_PASSE_FEUILLES)
+            
+            entetes = []
+            for header in ENTETES_SORTIE:
+                cell = WriteOnlyCell(ws, value=header)
+                cell.style = "crex_entete"
+                entetes.append(cell)
+            ws.append(entetes)
+            
+            # Une cellule modèle par colonne, réutilisée pour chaque ligne écrite
+            modeles = []
+            for col_idx in range(1, len(ENTETES_SORTIE) + 1):
+                cell = WriteOnlyCell(ws)
+                cell.style = style_colonne(col_idx)
+                modeles.append(cell)
+            
+            # Seules les colonnes stockées sont parcourues : les autres cellules restent vides
+            colonnes = [(i, valeurs) for i, valeurs in enumerate(colonnes_sortie(data)) if valeurs is not None]
+            cellules = [(i, modeles[i]) for i, _ in colonnes]
+            for valeurs_ligne in zip(*(valeurs for _, valeurs in colonnes)):
+                ligne = modeles
+                for (i, cell), value in zip(cellules, valeurs_ligne):
+                    if isinstance(value, TIME_TYPES):
+                        # openpyxl pose le format date sur le style de la cellule, partagé avec les
+                        # cellules déjà écrites : une date reçoit sa propre cellule
+                        if ligne is modeles:
+                            ligne = list(modeles)
+                        ligne[i] = WriteOnlyCell(ws)
+                        ligne[i].style = style_colonne(i + 1)
+                        ligne[i].value = value
+                    else:
+                        cell.value = value
+                ws.append(ligne)
+        
+        wb.save(output)
+        output.seek(0)
+        return output
+        
+    except Exception as e:
+        logger.error(f"Erreur lors de la création du fichier: {str(e)}")
+        return None
+
+# Émetteur natif : parties fixes du paquet xlsx pré-rendues
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+NIVEAUX_COMPRESSION = {"rapide": 1, "compact": 9}
+# Styles de cellule (cellXfs) de l'émetteur natif, dans l'ordre des index : (nom, attributs, contenu)
+XFS_NATIFS = (
+    (None, 'fontId="0" fillId="0" borderId="0"', ''),
+    ("crex_entete", 'fontId="1" fillId="2" borderId="1" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1"',
+     '<alignment horizontal="center" vertical="center"/>'),
+    ("crex_retour", 'fontId="0" fillId="0" borderId="1" applyBorder="1" applyAlignment="1"',
+     '<alignment vertical="top" wrapText="1"/>'),
+    ("crex_haut", 'fontId="0" fillId="0" borderId="1" applyBorder="1" applyAlignment="1"',
+     '<alignment vertical="top"/>'),
+    ("crex_deverrouille", 'fontId="0" fillId="0" borderId="1" applyBorder="1" applyAlignment="1" applyProtection="1"',
+     '<alignment vertical="top" wrapText="1"/><protection locked="0"/>'),
+)
+STYLES_NATIFS = {nom: index for index, (nom, _, _) in enumerate(XFS_NATIFS) if nom}
+# Dates et heures : formats posés par openpyxl (TIME_FORMATS), datetime avant date (sous-classe)
+FORMATS_TEMPORELS_NATIFS = (
+    (datetime, 164, "yyyy-mm-dd h:mm:ss"),
+    (date, 165, "yyyy-mm-dd"),
+    (heure, 21, "h:mm:ss"),
+    (timedelta, 166, "[hh]:mm:ss"),
+)
+TYPES_TEMPORELS = tuple(classe for classe, _, _ in FORMATS_TEMPORELS_NATIFS)
+# Une variante par style de données et par format : index cellXfs placés après XFS_NATIFS
+XFS_TEMPORELS_NATIFS = [
+    (nom, classe, num_fmt)
+    for nom, _, _ in XFS_NATIFS[2:]
+    for classe, num_fmt, _ in FORMATS_TEMPORELS_NATIFS
+]
+STYLES_TEMPORELS_NATIFS = {
+    (nom, classe): len(XFS_NATIFS) + index for index, (nom, classe, _) in enumerate(XFS_TEMPORELS_NATIFS)
+}
+
+def xf_natif(num_fmt, attributs, contenu):
+    """Balise <xf> d'un style de cellule"""
+    if num_fmt:
+        attributs += ' applyNumberFormat="1"'
+    if not contenu:
+        return f'<xf numFmtId="{num_fmt}" {attributs} xfId="0"/>'
+    return f'<xf numFmtId="{num_fmt}" {attributs} xfId="0">{contenu}</xf>'
+
+STYLES_XML_NATIF = (
+    XML_DECL + f'<styleSheet xmlns="{NS_MAIN}">'
+    + '<numFmts count="3">' + ''.join(
+        f'<numFmt numFmtId="{num_fmt}" formatCode="{code}"/>'
+        for _, num_fmt, code in FORMATS_TEMPORELS_NATIFS if num_fmt >= 164
+    ) + '</numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><color theme="1"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font>'
+    '<font><b val="1"/><color rgb="00003366"/></font>'
+    '</fonts>'
+    '<fills count="3">'
+    '<fill><patternFill/></fill><fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="00FFE6CC"/><bgColor rgb="00FFE6CC"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    + f'<cellXfs count="{len(XFS_NATIFS) + len(XFS_TEMPORELS_NATIFS)}">'
+    + ''.join(xf_natif(0, attributs, contenu) for _, attributs, contenu in XFS_NATIFS)
+    + ''.join(
+        xf_natif(num_fmt, XFS_NATIFS[STYLES_NATIFS[nom]][1], XFS_NATIFS[STYLES_NATIFS[nom]][2])
+        for nom, _, num_fmt in XFS_TEMPORELS_NATIFS
+    )
+    + '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+COLS_XML_NATIF = '<cols>' + ''.join(
+    f'<col min="{num}" max="{num}" width="{width}" customWidth="1"/>'
+    for num, width in enumerate(LARGEURS_COLONNES.values(), 1)
+) + '</cols>'
+
+@lru_cache(maxsize=None)
+def protection_xml_natif():
+    """Balise de protection de feuille (mot de passe haché comme le fait openpyxl)"""
+    from openpyxl.utils.protection import hash_password
+    return (
+        '<sheetProtection sheet="1" objects="0" scenarios="0" selectLockedCells="0" selectUnlockedCells="0" '
+        'formatCells="1" formatColumns="1" formatRows="1" insertColumns="1" insertRows="1" insertHyperlinks="1" '
+        'deleteColumns="1" deleteRows="1" sort="1" autoFilter="1" pivotTables="1" '
+        f'password="{hash_password(MOT_DE_PASSE_FEUILLES)}"/>'
+    )
+
+def xml_texte(value):
+    """Échappe un texte pour le XML (caractères interdits supprimés)"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    return escape(ILLEGAL_CHARACTERS_RE.sub("", value))
+
+def rendu_cellule_natif(value, index_chaines):
+    """Fin d'une balise <c> selon le type de la valeur (chaînes partagées dédupliquées)"""
+    # openpyxl laisse vide une cellule recevant une chaîne vide
+    if value is None or (isinstance(value, str) and not value):
+        return '/>'
+    if isinstance(value, str):
+        # Formule Excel (ex: "='Feuille'!A2")
+        if value.startswith("="):
+            return f'><f>{xml_texte(value[1:])}</f><v></v></c>'
+        idx = index_chaines.get(value)
+        if idx is None:
+            idx = index_chaines[value] = len(index_chaines)
+        return f' t="s"><v>{idx}</v></c>'
+    if isinstance(value, (bool, np.bool_)):
+        return f' t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value) or math.isinf(value):
+            return '/>'
+        return f'><v>{float(value)!r}</v></c>'
+    return rendu_cellule_natif(str(value), index_chaines)
+
+def serie_excel_natif(value):
+    """Numéro de série Excel d'une date, heure ou durée (valeur écrite par openpyxl)"""
+    from openpyxl.utils.datetime import to_excel
+    serie = to_excel(value)
+    return repr(serie) if isinstance(serie, float) else str(serie)
+
+def contient_dates(valeurs):
+    """Vrai si la colonne contient au moins une date, heure ou durée"""
+    return valeurs is not None and any(isinstance(value, TYPES_TEMPORELS) for value in valeurs)
+
+def rendu_cellule_datee_natif(value, nom_style, index_chaines):
+    """Style et fin d'une balise <c> dans une colonne contenant des dates : format date ou heure
+    pour ces valeurs (comme openpyxl), style de la colonne pour les autres"""
+    if isinstance(value, TYPES_TEMPORELS):
+        # NaT : cellule vide
+        if value != value:
+            return f' s="{STYLES_NATIFS[nom_style]}"/>'
+        classe = next(classe for classe in TYPES_TEMPORELS if isinstance(value, classe))
+        return f' s="{STYLES_TEMPORELS_NATIFS[(nom_style, classe)]}"><v>{serie_excel_natif(value)}</v></c>'
+    return f' s="{STYLES_NATIFS[nom_style]}"{rendu_cellule_natif(value, index_chaines)}'
+
+def debut_feuille_natif(nb_lignes, index_chaines):
+    """Début du XML d'une feuille : dimensions, largeurs de colonnes et ligne d'en-tête"""
+    lettres = lettres_sortie()
+    style_entete = f'" s="{STYLES_NATIFS["crex_entete"]}"'
+    return (
+        XML_DECL + f'<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+        f'<dimension ref="A1:{lettres[-1]}{nb_lignes + 1}"/>'
+        '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+        '<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>'
+        + COLS_XML_NATIF + '<sheetData><row r="1">'
+        + ''.join(
+            f'<c r="{lettre}1{style_entete}{rendu_cellule_natif(header, index_chaines)}'
+            for lettre, header in zip(lettres, ENTETES_SORTIE)
+        )
+        + '</row>'
+    )
+
+def fin_feuille_natif(nb_lignes):
+    """Fin du XML d'une feuille : protection et listes de validation des colonnes J et M"""
+    validations = ''
+    if nb_lignes > 0:
+        validations = '<dataValidations count="2">' + ''.join(
+            f'<dataValidation type="list" allowBlank="1" sqref="{col}2:{col}{nb_lignes + 1}">'
+            '<formula1>"Accepté,Refusé,N/A"</formula1></dataValidation>'
+            for col in ('J', 'M')
+        ) + '</dataValidations>'
+    return (
+        '</sheetData>' + protection_xml_natif() + validations
+        + '<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/></worksheet>'
+    )
+
+def ecrire_par_blocs(flux, morceaux):
+    """Écrit des morceaux de XML dans le flux par paquets de 1000"""
+    tampon = []
+    for morceau in morceaux:
+        tampon.append(morceau)
+        if len(tampon) >= 1000:
+            flux.write(''.join(tampon).encode('utf-8'))
+            tampon = []
+    flux.write(''.join(tampon).encode('utf-8'))
+
+@lru_cache(maxsize=None)
+def lettres_sortie():
+    """Lettres des 14 colonnes de sortie (A à N)"""
+    from openpyxl.utils import get_column_letter
+    return tuple(get_column_letter(col_idx) for col_idx in range(1, len(ENTETES_SORTIE) + 1))
+
+def styles_donnees_natif():
+    """Attribut de style des cellules de données, par colonne"""
+    return [f'" s="{STYLES_NATIFS[style_colonne(col_idx)]}"' for col_idx in range(1, len(ENTETES_SORTIE) + 1)]
+
+def ecrire_feuille_natif(flux, data, index_chaines):
+    """Écrit le XML d'une feuille dans le membre zip ouvert, ligne par ligne"""
+    nb_lignes = len(data)
+    
+    # Modèle de ligne : début de chaque cellule pré-calculé par colonne
+    debuts = [f'<c r="{lettre}' for lettre in lettres_sortie()]
+    styles_donnees = styles_donnees_natif()
+    
+    flux.write(debut_feuille_natif(nb_lignes, index_chaines).encode('utf-8'))
+    
+    # Fin de balise par colonne, rendue au fil des lignes ; constante pour les colonnes vides.
+    # Colonnes contenant des dates : le style est rendu avec chaque cellule
+    queues = []
+    for col_idx, valeurs in enumerate(colonnes_sortie(data), 1):
+        if valeurs is None:
+            queues.append(repeat('/>'))
+        elif contient_dates(valeurs):
+            styles_donnees[col_idx - 1] = '"'
+            queues.append(
+                rendu_cellule_datee_natif(value, style_colonne(col_idx), index_chaines) for value in valeurs
+            )
+        else:
+            queues.append(rendu_cellule_natif(value, index_chaines) for value in valeurs)
+    
+    def lignes():
+        for row_idx, queues_ligne in zip(range(2, nb_lignes + 2), zip(*queues)):
+            r = str(row_idx)
+            cellules = ''.join(
+                f'{debut}{r}{style}{queue}'
+                for debut, style, queue in zip(debuts, styles_donnees, queues_ligne)
+            )
+            yield f'<row r="{r}">{cellules}</row>'
+        yield fin_feuille_natif(nb_lignes)
+    
+    ecrire_par_blocs(flux, lignes())
+
+def valeur_cache_natif(value):
+    """Type et valeur en cache d'une formule renvoyant vers une cellule contenant value"""
+    # Une référence vers une cellule vide vaut 0 dans Excel
+    if value is None or (isinstance(value, str) and not value):
+        return '', '<v>0</v>'
+    if isinstance(value, str):
+        return ' t="str"', f'<v>{xml_texte(value)}</v>'
+    if isinstance(value, (bool, np.bool_)):
+        return ' t="b"', f'<v>{int(value)}</v>'
+    if isinstance(value, (int, np.integer)):
+        return '', f'<v>{int(value)}</v>'
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value) or math.isinf(value):
+            return '', '<v>0</v>'
+        return '', f'<v>{float(value)!r}</v>'
+    # Date ou heure : numéro de série, comme la cellule référencée (NaT : cellule vide)
+    if isinstance(value, TYPES_TEMPORELS):
+        return '', f'<v>{serie_excel_natif(value) if value == value else 0}</v>'
+    return valeur_cache_natif(str(value))
+
+def ecrire_consolidation_partagee(flux, blocs, nouvelles_feuilles, index_chaines):
+    """Écrit la feuille Consolidation en formules partagées avec valeurs en cache
+    
+    blocs : [(feuille source, première ligne source, nombre de lignes)] dans l'ordre des lignes
+    de la Consolidation. Une formule maîtresse par colonne et par bloc ; les lignes suivantes
+    y renvoient par si.
+    """
+    nb_lignes = sum(nb for _, _, nb in blocs)
+    lettres = lettres_sortie()
+    styles_donnees = styles_donnees_natif()
+    flux.write(debut_feuille_natif(nb_lignes, index_chaines).encode('utf-8'))
+    
+    def lignes():
+        row_idx = 2
+        for num_bloc, (sheet_name, debut_source, nb) in enumerate(blocs):
+            if nb == 0:
+                continue
+            derniere = row_idx + nb - 1
+            source = nouvelles_feuilles[sheet_name].iloc[debut_source:debut_source + nb]
+            caches = [
+                map(valeur_cache_natif, valeurs) if valeurs is not None else repeat(('', '<v>0</v>'))
+                for valeurs in colonnes_sortie(source)
+            ]
+            # Identifiant de formule partagée : un par colonne et par bloc
+            si = [num_bloc * len(lettres) + col for col in range(len(lettres))]
+            premiere = [
+                f'<f t="shared" ref="{lettre}{row_idx}:{lettre}{derniere}" si="{si[col]}">'
+                f"{xml_texte(repr_feuille(sheet_name))}!{lettre}{debut_source + 2}</f>"
+                for col, lettre in enumerate(lettres)
+            ]
+            suivantes = [f'<f t="shared" si="{si[col]}"/>' for col in range(len(lettres))]
+            for decalage, caches_ligne in enumerate(zip(*caches)):
+                r = str(row_idx + decalage)
+                formules = premiere if decalage == 0 else suivantes
+                cellules = ''.join(
+                    f'<c r="{lettre}{r}{style}{type_cache}>{formule}{valeur}</c>'
+                    for lettre, style, formule, (type_cache, valeur)
+                    in zip(lettres, styles_donnees, formules, caches_ligne)
+                )
+                yield f'<row r="{r}">{cellules}</row>'
+            row_idx = derniere + 1
+        yield fin_feuille_natif(nb_lignes)
+    
+    ecrire_par_blocs(flux, lignes())
+
+def creer_excel_natif(nouvelles_feuilles, compression="rapide", consolidation="simple", sortie=None):
+    """Création Excel par écriture directe du paquet SpreadsheetML (zipfile), sans openpyxl
+    
+    compression : "rapide" (deflate niveau 1) ou "compact" (niveau 9)
+    consolidation : "simple" (une formule par cellule, recalculée à l'ouverture) ou
+    "partagee" (formules partagées avec valeurs en cache, voir ecrire_consolidation_partagee)
+    """
+    from openpyxl.writer.theme import theme_xml
+    try:
+        output = sortie if sortie is not None else BytesIO()
+        noms = list(nouvelles_feuilles)
+        index_chaines = {}
+        partagee = consolidation == "partagee"
+        
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=NIVEAUX_COMPRESSION[compression]) as zf:
+            for num, sheet_name in enumerate(noms, 1):
+                data = nouvelles_feuilles[sheet_name]
+                with zf.open(f'xl/worksheets/sheet{num}.xml', 'w', force_zip64=True) as flux:
+                    if partagee and 'blocs' in data.attrs:
+                        ecrire_consolidation_partagee(flux, data.attrs['blocs'], nouvelles_feuilles, index_chaines)
+                    else:
+                        ecrire_feuille_natif(flux, data, index_chaines)
+            
+            # Table des chaînes partagées, connue une fois toutes les feuilles écrites
+            with zf.open('xl/sharedStrings.xml', 'w', force_zip64=True) as flux:
+                flux.write((XML_DECL + f'<sst xmlns="{NS_MAIN}" uniqueCount="{len(index_chaines)}">').encode('utf-8'))
+                tampon = []
+                for chaine in index_chaines:
+                    tampon.append(f'<si><t xml:space="preserve">{xml_texte(chaine)}</t></si>')
+                    if len(tampon) >= 1000:
+                        flux.write(''.join(tampon).encode('utf-8'))
+                        tampon = []
+                tampon.append('</sst>')
+                flux.write(''.join(tampon).encode('utf-8'))
+            
+            zf.writestr('xl/styles.xml', STYLES_XML_NATIF)
+            zf.writestr('xl/theme/theme1.xml', theme_xml)
+            zf.writestr('xl/workbook.xml', (
+                XML_DECL + f'<workbook xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">'
+                '<bookViews><workbookView activeTab="0"/></bookViews><sheets>'
+                + ''.join(
+                    f'<sheet name={quoteattr(sheet_name)} sheetId="{num}" r:id="rId{num}"/>'
+                    for num, sheet_name in enumerate(noms, 1)
+                )
+                # Valeurs en cache à jour : pas de recalcul complet à l'ouverture
+                + ('</sheets><calcPr calcId="191029"/></workbook>' if partagee
+                   else '</sheets><calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>')
+            ))
+            zf.writestr('xl/_rels/workbook.xml.rels', (
+                XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                + ''.join(
+                    f'<Relationship Id="rId{num}" Type="{NS_REL}/worksheet" Target="worksheets/sheet{num}.xml"/>'
+                    for num in range(1, len(noms) + 1)
+                )
+                + f'<Relationship Id="rId{len(noms) + 1}" Type="{NS_REL}/styles" Target="styles.xml"/>'
+                + f'<Relationship Id="rId{len(noms) + 2}" Type="{NS_REL}/sharedStrings" Target="sharedStrings.xml"/>'
+                + f'<Relationship Id="rId{len(noms) + 3}" Type="{NS_REL}/theme" Target="theme/theme1.xml"/>'
+                + '</Relationships>'
+            ))
+            zf.writestr('_rels/.rels', (
+                XML_DECL + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                f'<Relationship Id="rId1" Type="{NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+                '</Relationships>'
+            ))
+            zf.writestr('[Content_Types].xml', (
+                XML_DECL + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/xl/workbook.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                + ''.join(
+                    f'<Override PartName="/xl/worksheets/sheet{num}.xml" '
+                    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                    for num in range(1, len(noms) + 1)
+                )
+                + '<Override PartName="/xl/styles.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+                '<Override PartName="/xl/sharedStrings.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+                '<Override PartName="/xl/theme/theme1.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.theme+xml"/>'
+                '</Types>'
+            ))
+        
+        output.seek(0)
+        return output
+        
+    except Exception as e:
+        logger.error(f"Erreur lors de la création du fichier: {str(e)}")
+        return None
+
+def creer_excel_avec_formatage_optimise(nouvelles_feuilles, moteur_ecriture="standard", compression="rapide",
+                                        consolidation="simple", sortie=None):
+    """Version optimisée de la création Excel + protection (Option A) avec colonnes J et K déverrouillées
+    
+    moteur_ecriture : "standard" (classeur en mémoire), "streaming" (write-only) ou "natif" (zipfile)
+    compression : niveau deflate du moteur natif, "rapide" ou "compact"
+    consolidation : "simple" ou "partagee" (formules partagées avec valeurs en cache, moteur natif)
+    sortie : flux binaire inscriptible et repositionnable recevant le classeur (BytesIO par défaut)
+    Les valeurs sont écrites telles quelles : Date Vol doit déjà être formatée (formater_dates_french).
+    """
+    if moteur_ecriture == "streaming":
+        return creer_excel_flux(nouvelles_feuilles, sortie)
+    if moteur_ecriture == "natif":
+        return creer_excel_natif(nouvelles_feuilles, compression, consolidation, sortie)
+    
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Border, Protection, Side
+    from openpyxl.worksheet.datavalidation import DataValidation
+    
+    try:
+        output = sortie if sortie is not None else BytesIO()
+        wb = Workbook()
+        wb.remove(wb.active)
+        
+        # Préparer les styles une seule fois
+        thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+        wrap_alignment = Alignment(wrap_text=True, vertical='top')
+        center_alignment = Alignment(horizontal='center', vertical='center')
+        
+        headers = ENTETES_SORTIE
+        
+        for sheet_name, data in nouvelles_feuilles.items():
+            ws = wb.create_sheet(title=sheet_name)
+            
+            # Ajouter les en-têtes
+            for col_idx, header in enumerate(headers, 1):
+                cell = ws.cell(row=1, column=col_idx, value=header)
+                cell.font = openpyxl.styles.Font(bold=True, color="003366")
+                cell.border = thin_border
+                cell.alignment = center_alignment
+                cell.fill = openpyxl.styles.PatternFill(start_color="FFE6CC", end_color="FFE6CC", fill_type="solid")
+            
+            # Ajouter les données
+            for row_idx, valeurs_ligne in enumerate(iterer_lignes_sortie(data), 2):
+                for col_idx, value in enumerate(valeurs_ligne, 1):
+                    cell = ws.cell(row=row_idx, column=col_idx, value=value)
+
+                    cell.border = thin_border
+                    
+                    # Appliquer les alignements
+                    if col_idx in [6, 7, 8, 9, 10, 11, 12, 13, 14]:
+                        cell.alignment = wrap_alignment
+                    elif col_idx == 1:
+                        cell.alignment = Alignment(wrap_text=True, vertical='top')
+                    else:
+                        cell.alignment = Alignment(vertical='top')
+            
+            # Ajuster les largeurs de colonnes
+            for col, width in LARGEURS_COLONNES.items():
+                ws.column_dimensions[col].width = width
+            
+            # Ajouter les validations de données si nécessaire
+            if len(data) > 0:
+                last_row = len(data) + 1
+                if last_row >= 2:
+                    # Validation pour la colonne J
+                    dv_j = DataValidation(
+                        type="list",
+                        formula1='"Accepté,Refusé,N/A"',
+                        allow_blank=True
+                    )
+                    dv_j.add(f'J2:J{last_row}')
+                    ws.add_data_validation(dv_j)
+                    
+                    # Validation pour la colonne M
+                    dv_m = DataValidation(
+                        type="list",
+                        formula1='"Accepté,Refusé,N/A"',
+                        allow_blank=True
+                    )
+                    dv_m.add(f'M2:M{last_row}')
+                    ws.add_data_validation(dv_m)
+
+                    # 🔓 Déverrouiller colonnes J et K (10 et 11) pour toutes les lignes de données
+                    for col in [10, 11]:
+                        for r in range(2, last_row + 1):
+                            ws.cell(row=r, column=col).protection = Protection(locked=False)
+            
+            # 🔒 Protection de la feuille (Option A)
+            ws.protection.sheet = True
+            # facultatif selon versions : ws.protection.enable()
+            ws.protection.set_password(MOT_DE_PASSE_FEUILLES)
+        
+        wb.save(output)
+        output.seek(0)
+        return output
+        
+    except Exception as e:
+        logger.error(f"Erreur lors de la création du fichier: {str(e)}")
+        return None
+
+def cle_resultat(contenu):
+    """Clé de cache : empreinte du fichier téléversé (octets ou fichier ouvert) et de la version du pipeline
+    
+    Une liste de fichiers (fusion) a pour clé l'empreinte de la suite de leurs clés, dans l'ordre.
+    """
+    if isinstance(contenu, (list, tuple)):
+        if len(contenu) == 1:
+            return cle_resultat(contenu[0])
+        return hashlib.sha256("\0".join(cle_resultat(fichier) for fichier in contenu).encode()).hexdigest()
+    h = hashlib.sha256(VERSION_PIPELINE.encode() + b"\0")
+    if isinstance(contenu, (bytes, bytearray, memoryview)):
+        h.update(contenu)
+        return h.hexdigest()
+    # Fichier ouvert : lu par blocs, sans copie complète en mémoire
+    contenu.seek(0)
+    for bloc in iter(lambda: contenu.read(1024 * 1024), b""):
+        h.update(bloc)
+    contenu.seek(0)
+    return h.hexdigest()
+
+class CacheResultats:
+    """Cache LRU des résultats (xlsx, df_all, durées) borné en octets, avec niveau disque optionnel"""
+    
+    def __init__(self, taille_max_octets, dossier_disque=None, taille_max_disque_octets=0):
+        self.taille_max_octets = taille_max_octets
+        self.dossier_disque = dossier_disque
+        self.taille_max_disque_octets = taille_max_disque_octets
+        self._entrees = OrderedDict()
+        self._taille = 0
+        self._verrou = threading.Lock()
+        if dossier_disque:
+            os.makedirs(dossier_disque, exist_ok=True)
+    
+    @staticmethod
+    def _taille_resultat(resultat):
+        return len(resultat['excel']) + sum(
+            int(df.memory_usage(deep=True).sum())
+            for df in [resultat['df_all'], *(resultat.get('synthese') or {}).values()]
+        )
+    
+    def get(self, cle):
+        """Résultat en cache ou None ; une entrée trouvée sur disque est remontée en mémoire"""
+        with self._verrou:
+            if cle in self._entrees:
+                self._entrees.move_to_end(cle)
+                return self._entrees[cle][0]
+        
+        resultat = self._lire_disque(cle)
+        if resultat is not None:
+            self._ajouter_memoire(cle, resultat)
+        return resultat
+    
+    def put(self, cle, excel, df_all, durees, spans=None, synthese=None):
+        """Enregistre un résultat (et sa synthèse pré-calculée, construire_synthese) et le retourne"""
+        resultat = {'excel': excel, 'df_all': df_all, 'durees': dict(durees), 'spans': list(spans or []),
+                    'synthese': synthese}
+        self._ajouter_memoire(cle, resultat)
+        if self.dossier_disque:
+            self._ecrire_disque(cle, resultat)
+        return resultat
+    
+    def _ajouter_memoire(self, cle, resultat):
+        taille = self._taille_resultat(resultat)
+        with self._verrou:
+            if cle in self._entrees:
+                self._taille -= self._entrees.pop(cle)[1]
+            if taille > self.taille_max_octets:
+                return
+            self._entrees[cle] = (resultat, taille)
+            self._taille += taille
+            # Éviction des entrées les moins récemment utilisées
+            while self._taille > self.taille_max_octets:
+                _, (_, taille_evincee) = self._entrees.popitem(last=False)
+                self._taille -= taille_evincee
+    
+    def _chemins(self, cle):
+        base = os.path.join(self.dossier_disque, cle)
+        return base + ".xlsx", base + ".pkl"
+    
+    def _lire_disque(self, cle):
+        if not self.dossier_disque:
+            return None
+        chemin_excel, chemin_donnees = self._chemins(cle)
+        try:
+            with open(chemin_excel, 'rb') as f:
+                excel = f.read()
+            donnees = pd.read_pickle(chemin_donnees)
+            os.utime(chemin_excel)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return {'excel': excel, 'df_all': donnees['df_all'], 'durees': donnees['durees'],
+                'spans': donnees.get('spans', []), 'synthese': donnees.get('synthese')}
+    
+    def _ecrire_disque(self, cle, resultat):
+        chemin_excel, chemin_donnees = self._chemins(cle)
+        suffixe = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            # Écriture atomique : une autre session ne lit jamais un fichier partiel
+            donnees = {'df_all': resultat['df_all'], 'durees': resultat['durees'], 'spans': resultat['spans'],
+                       'synthese': resultat['synthese']}
+            pd.to_pickle(donnees, chemin_donnees + suffixe)
+            os.replace(chemin_donnees + suffixe, chemin_donnees)
+            with open(chemin_excel + suffixe, 'wb') as f:
+                f.write(resultat['excel'])
+            os.replace(chemin_excel + suffixe, chemin_excel)
+            self._nettoyer_disque()
+        except OSError:
+            pass
+    
+    def _nettoyer_disque(self):
+        """Supprime les résultats les plus anciens au-delà de la taille maximale sur disque"""
+        fichiers = []
+        for nom in os.listdir(self.dossier_disque):
+            if nom.endswith(".xlsx"):
+                cle = nom[:-len(".xlsx")]
+                chemins = self._chemins(cle)
+                try:
+                    taille = sum(os.path.getsize(c) for c in chemins)
+                    fichiers.append((os.path.getmtime(chemins[0]), taille, chemins))
+                except OSError:
+                    continue
+        total = sum(taille for _, taille, _ in fichiers)
+        for _, taille, chemins in sorted(fichiers):
+            if total <= self.taille_max_disque_octets:
+                break
+            for chemin in chemins:
+                try:
+                    os.remove(chemin)
+                except OSError:
+                    pass
+            total -= taille
@@ -0,0 +1,323 @@
+"""Historique des lignes CREX traitées (SQLite) pour le traitement incrémental
+
+Les exports CREX sont cumulatifs : chaque fichier reprend les lignes des semaines
+précédentes. Chaque ligne est identifiée par une clé stable calculée sur Date Vol,
+Flight Number, Aircraft Registration, Event Title et General Remarks, telles
+qu'écrites dans le classeur de sortie ; la même clé est donc retrouvée en relisant
+un classeur annoté.
+
+Les classeurs de sortie annotés par les escales sont réimportés (importer_classeurs) :
+lignes et annotations vont dans la table retours pour le reporting, et les annotations
+alimentent l'historique. Un classeur déjà importé (même contenu) est ignoré.
+
+Deux modes :
+    "nouvelles" : seules les lignes jamais traitées sont écrites
+    "complet"   : toutes les lignes sont écrites, annotations J à N reprises de l'historique
+"""
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date, datetime, time
+
+import crex_core
+
+# Base par défaut (CREX_HISTORIQUE), relative au dossier courant
+HISTORIQUE_DEFAUT = os.environ.get("CREX_HISTORIQUE", "crex_historique.sqlite")
+MODES_INCREMENTAUX = ("nouvelles", "complet")
+COLONNES_CLE = ["Date Vol", "Flight Number", "Aircraft Registration", "Event Title", "General Remarks"]
+COLONNES_ANNOTATION = crex_core.ENTETES_SORTIE[len(crex_core.COLONNES_DONNEES):]
+# Noms SQL des colonnes d'annotation (J à N)
+COLONNES_SQL = {
+    "Accepté/Refusé": "accepte_refuse",
+    "Commentaire": "commentaire",
+    "Autre": "autre",
+    "KAM / TO": "kam_to",
+    "Commentaire_2": "commentaire_2",
+}
+# Colonnes de la table des retours (classeurs annotés importés), dans l'ordre des 14 colonnes de sortie
+COLONNES_SQL_RETOURS = [
+    "date_vol", "aircraft_registration", "flight_number", "origin", "destination",
+    "catering", "non_conformite", "event_title", "general_remarks", *COLONNES_SQL.values()
+]
+# Limite de paramètres par requête SQLite
+TAILLE_LOT_SQL = 900
+
+def normaliser_valeur(value):
+    """Forme texte d'une valeur pour la clé, identique avant écriture et après relecture du classeur"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, (bool, crex_core.np.bool_)):
+        return str(bool(value))
+    if isinstance(value, (int, crex_core.np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, crex_core.np.floating)):
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+    if crex_core.pd.isna(value):
+        return ""
+    # Le XML du classeur supprime les caractères interdits et normalise les fins de ligne
+    texte = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+    return texte.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+def cles_lignes(df):
+    """Clé de chaque ligne (Date Vol déjà formatée en français), Series alignée sur df"""
+    colonnes = [
+        df[col].map(normaliser_valeur) if col in df.columns else crex_core.pd.Series("", index=df.index)
+        for col in COLONNES_CLE
+    ]
+    return crex_core.pd.Series([
+        hashlib.blake2b("\x1f".join(valeurs).encode("utf-8"), digest_size=16).hexdigest()
+        for valeurs in zip(*colonnes)
+    ], index=df.index, dtype=object)
+
+def annotation_presente(value):
+    """Vrai si la cellule d'annotation n'est pas vide"""
+    if isinstance(value, str):
+        return bool(value.strip())
+    return value is not None and not crex_core.pd.isna(value)
+
+class HistoriqueLignes:
+    """Base SQLite des lignes déjà traitées et de leurs annotations
+
+    Seul le chemin est conservé : l'objet peut être transmis aux processus du traitement en lot.
+    """
+
+    def __init__(self, chemin=HISTORIQUE_DEFAUT):
+        self.chemin = chemin
+        dossier = os.path.dirname(os.path.abspath(chemin))
+        os.makedirs(dossier, exist_ok=True)
+        with closing(self._connexion()) as connexion, connexion:
+            connexion.execute("PRAGMA journal_mode=WAL")
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS lignes ("
+                "cle TEXT PRIMARY KEY, feuille TEXT, premier_traitement TEXT, "
+                + ", ".join(COLONNES_SQL.values()) + ")"
+            )
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS retours (empreinte TEXT, cle TEXT, feuille TEXT, "
+                + ", ".join(COLONNES_SQL_RETOURS) + ", PRIMARY KEY (empreinte, cle))"
+            )
+            connexion.execute(
+                "CREATE TABLE IF NOT EXISTS fichiers_importes ("
+                "empreinte TEXT PRIMARY KEY, nom TEXT, date_import TEXT, lignes INTEGER, annotees INTEGER)"
+            )
+
+    def _connexion(self):
+        return sqlite3.connect(self.chemin, timeout=30)
+
+    def _par_lots(self, connexion, requete, cles):
+        """Exécute une requête ... IN (?) par lots de clés et concatène les lignes"""
+        lignes = []
+        cles = list(cles)
+        for debut in range(0, len(cles), TAILLE_LOT_SQL):
+            lot = cles[debut:debut + TAILLE_LOT_SQL]
+            lignes.extend(connexion.execute(requete.format(",".join("?" * len(lot))), lot).fetchall())
+        return lignes
+
+    def cles_connues(self, cles):
+        """Sous-ensemble des clés déjà présentes dans l'historique"""
+        with closing(self._connexion()) as connexion:
+            return {cle for (cle,) in self._par_lots(connexion, "SELECT cle FROM lignes WHERE cle IN ({})", set(cles))}
+
+    def annotations(self, cles):
+        """{clé: {colonne: valeur}} des annotations enregistrées pour ces clés"""
+        requete = f"SELECT cle, {', '.join(COLONNES_SQL.values())} FROM lignes WHERE cle IN ({{}})"
+        with closing(self._connexion()) as connexion:
+            return {
+                cle: dict(zip(COLONNES_ANNOTATION, valeurs))
+                for cle, *valeurs in self._par_lots(connexion, requete, set(cles))
+                if any(annotation_presente(v) for v in valeurs)
+            }
+
+    def appliquer(self, df_all, mode):
+        """Ajoute la colonne Cle_Ligne puis filtre les lignes connues ("nouvelles")
+        ou reprend leurs annotations ("complet")"""
+        df_all = df_all.copy()
+        # Clé déjà calculée lors de la fusion de plusieurs fichiers
+        if 'Cle_Ligne' not in df_all.columns:
+            dates = crex_core.formater_dates_french(df_all['Date Vol'])
+            df_all['Cle_Ligne'] = cles_lignes(df_all.assign(**{'Date Vol': dates}))
+
+        if mode == "nouvelles":
+            connues = self.cles_connues(df_all['Cle_Ligne'])
+            return df_all[~df_all['Cle_Ligne'].isin(connues)].reset_index(drop=True)
+
+        annotations = self.annotations(df_all['Cle_Ligne'])
+        if annotations:
+            for col in COLONNES_ANNOTATION:
+                valeurs = df_all['Cle_Ligne'].map(lambda cle: annotations.get(cle, {}).get(col))
+                if valeurs.notna().any():
+                    df_all[col] = valeurs.astype(object).where(valeurs.notna(), None)
+        return df_all
+
+    def enregistrer(self, df_all):
+        """Marque comme traitées les lignes d'un résultat (sans toucher aux annotations existantes)"""
+        maintenant = datetime.now().isoformat(timespec="seconds")
+        feuilles = df_all['Sheet_Name'] if 'Sheet_Name' in df_all.columns else ["Autre"] * len(df_all)
+        with closing(self._connexion()) as connexion, connexion:
+            connexion.executemany(
+                "INSERT OR IGNORE INTO lignes (cle, feuille, premier_traitement) VALUES (?, ?, ?)",
+                ((cle, feuille, maintenant) for cle, feuille in zip(df_all['Cle_Ligne'], feuilles))
+            )
+
+    def fichiers_importes(self, empreintes):
+        """Sous-ensemble des empreintes de classeurs déjà importés"""
+        with closing(self._connexion()) as connexion:
+            return {
+                empreinte for (empreinte,) in self._par_lots(
+                    connexion, "SELECT empreinte FROM fichiers_importes WHERE empreinte IN ({})", set(empreintes)
+                )
+            }
+
+    def importer_classeurs(self, sources, nb_workers=1):
+        """Importe des classeurs de sortie annotés (chemins ou fichiers téléversés)
+
+        Les classeurs déjà importés (même contenu) sont ignorés ; les autres sont lus en parallèle
+        puis écrits en une transaction. Retourne {nom: résumé} dans l'ordre des sources ; un nom déjà
+        vu dans l'appel (téléversements successifs d'un même nom) est suffixé « (2) », « (3) »...
+        """
+        resumes = {}
+        a_lire = {}
+        for source in sources:
+            nom = getattr(source, "name", None) or os.path.abspath(source)
+            # Les classeurs sont reconnus par leur contenu : deux noms identiques restent distincts
+            cle_resume, rang = nom, 2
+            while cle_resume in resumes:
+                cle_resume, rang = f"{nom} ({rang})", rang + 1
+            try:
+                empreinte = empreinte_contenu(source)
+            except OSError as e:
+                resumes[cle_resume] = {"statut": "erreur", "erreur": str(e)}
+                continue
+            resumes[cle_resume] = {"statut": "deja_importe", "empreinte": empreinte}
+            a_lire.setdefault(empreinte, (cle_resume, nom, source))
+        for empreinte in self.fichiers_importes(a_lire):
+            del a_lire[empreinte]
+
+        # Lecture par des processus ; les fichiers téléversés sont d'abord copiés sur disque
+        lus = {}
+        temporaires = []
+        try:
+            if nb_workers > 1 and len(a_lire) > 1:
+                chemins = {}
+                for empreinte, (_, _, source) in a_lire.items():
+                    if not isinstance(source, str):
+                        source = crex_core.copier_source_temporaire(source)
+                        temporaires.append(source)
+                    chemins[empreinte] = source
+                with ProcessPoolExecutor(max_workers=min(nb_workers, len(chemins)),
+                                         mp_context=crex_core.contexte_processus()) as executor:
+                    futures = {
+                        executor.submit(lire_classeur_annote, source): empreinte for empreinte, source in chemins.items()
+                    }
+                    for future in as_completed(futures):
+                        lus[futures[future]] = future
+        finally:
+            for chemin in temporaires:
+                os.unlink(chemin)
+
+        for empreinte, (cle_resume, nom, source) in a_lire.items():
+            try:
+                lignes = lus[empreinte].result() if empreinte in lus else lire_classeur_annote(source)
+            except Exception as e:
+                resumes[cle_resume] = {"statut": "erreur", "erreur": str(e)}
+                continue
+            annotees = self._enregistrer_classeur(empreinte, nom, lignes)
+            resumes[cle_resume] = {
+                "statut": "importe", "empreinte": empreinte, "lignes": len(lignes), "annotees": annotees
+            }
+        return resumes
+
+    def importer_annotations(self, source):
+        """Importe un seul classeur annoté ; retourne le nombre de lignes annotées (0 si déjà importé)"""
+        return next(iter(self.importer_classeurs([source]).values())).get("annotees", 0)
+
+    def _enregistrer_classeur(self, empreinte, nom, lignes):
+        """Écrit les lignes d'un classeur relu : retours, annotations de l'historique et fichier importé"""
+        maintenant = datetime.now().isoformat(timespec="seconds")
+        nb_donnees = len(crex_core.COLONNES_DONNEES)
+        annotees = [
+            (cle, feuille, maintenant, *valeurs[nb_donnees:])
+            for cle, feuille, *valeurs in lignes
+            if any(annotation_presente(v) for v in valeurs[nb_donnees:])
+        ]
+        colonnes = ", ".join(COLONNES_SQL.values())
+        with closing(self._connexion()) as connexion, connexion:
+            connexion.executemany(
+                f"INSERT OR IGNORE INTO retours (empreinte, cle, feuille, {', '.join(COLONNES_SQL_RETOURS)}) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(COLONNES_SQL_RETOURS))})",
+                ((empreinte, *ligne) for ligne in lignes)
+            )
+            connexion.executemany(
+                "INSERT OR IGNORE INTO lignes (cle, feuille, premier_traitement) VALUES (?, ?, ?)",
+                ((cle, feuille, maintenant) for cle, feuille, *_ in lignes)
+            )
+            connexion.executemany(
+                f"INSERT INTO lignes (cle, feuille, premier_traitement, {colonnes}) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(COLONNES_SQL))}) "
+                "ON CONFLICT(cle) DO UPDATE SET "
+                + ", ".join(f"{nom_sql} = excluded.{nom_sql}" for nom_sql in COLONNES_SQL.values()),
+                annotees
+            )
+            connexion.execute(
+                "INSERT INTO fichiers_importes (empreinte, nom, date_import, lignes, annotees) VALUES (?, ?, ?, ?, ?)",
+                (empreinte, nom, maintenant, len(lignes), len(annotees))
+            )
+        return len(annotees)
+
+def empreinte_contenu(source):
+    """SHA-256 d'un classeur (chemin ou fichier ouvert, relu depuis le début)"""
+    h = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for bloc in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(bloc)
+    else:
+        source.seek(0)
+        for bloc in iter(lambda: source.read(1024 * 1024), b""):
+            h.update(bloc)
+        source.seek(0)
+    return h.hexdigest()
+
+def valeur_sql(value):
+    """Valeur de cellule enregistrable par sqlite3"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+def lire_classeur_annote(source):
+    """Tâche d'un processus : lignes des feuilles par origine d'un classeur de sortie
+
+    Retourne [(clé, feuille, 14 valeurs)]. La feuille Consolidation et ses parties (formules seules) et les
+    feuilles sans l'en-tête de sortie ne sont pas lues ; seules les 14 premières colonnes le sont.
+    """
+    from openpyxl import load_workbook
+    nb_colonnes = len(crex_core.ENTETES_SORTIE)
+    nb_donnees = len(crex_core.COLONNES_DONNEES)
+    wb = load_workbook(source, read_only=True, data_only=True)
+    lignes = []
+    try:
+        for ws in wb.worksheets:
+            if crex_core.feuille_source(ws.title) == "Consolidation":
+                continue
+            rows = ws.iter_rows(max_col=nb_colonnes, values_only=True)
+            entete = next(rows, None)
+            if entete is None or list(entete) != crex_core.ENTETES_SORTIE:
+                continue
+            valeurs = [
+                tuple(valeur_sql(v) for v in row) + (None,) * (nb_colonnes - len(row))
+                for row in rows if any(v is not None for v in row)
+            ]
+            if not valeurs:
+                continue
+            df = crex_core.pd.DataFrame(valeurs, columns=crex_core.ENTETES_SORTIE, dtype=object)
+            for cle, row in zip(cles_lignes(df), valeurs):
+                annotations = (v if annotation_presente(v) else None for v in row[nb_donnees:])
+                lignes.append((cle, crex_core.feuille_source(ws.title), *row[:nb_donnees], *annotations))
+    finally:
+        wb.close()
+    return lignes
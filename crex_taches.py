@@ -0,0 +1,227 @@
+"""File de traitements CREX exécutés en arrière-plan
+
+Les traitements sont soumis à un pool local borné (CREX_TRAITEMENTS_SIMULTANES) ;
+au-delà, ils attendent dans une file de taille limitée (CREX_FILE_ATTENTE_MAX).
+Une même soumission (même contenu, mêmes options) en attente, en cours ou terminée
+est regroupée avec la tâche existante. Les tâches terminées sont conservées
+(CREX_TACHES_CONSERVEES) pour être retrouvées après un rechargement de la page.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import crex_core
+
+TRAITEMENTS_SIMULTANES = int(os.environ.get("CREX_TRAITEMENTS_SIMULTANES", max(1, (os.cpu_count() or 1) // 2)))
+FILE_ATTENTE_MAX = int(os.environ.get("CREX_FILE_ATTENTE_MAX", 20))
+TACHES_CONSERVEES = int(os.environ.get("CREX_TACHES_CONSERVEES", 50))
+
+EN_ATTENTE, EN_COURS, TERMINEE, ECHOUEE = "en_attente", "en_cours", "terminee", "echouee"
+
+class FileAttentePleine(Exception):
+    """Trop de traitements en attente : la soumission est refusée"""
+
+class JournalTache(logging.Handler):
+    """Conserve les messages du journal crex émis par le thread d'une tâche"""
+
+    def __init__(self, tache):
+        super().__init__(level=logging.WARNING)
+        self.tache = tache
+        self.thread = threading.get_ident()
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.tache.avertissements.append(record.getMessage())
+
+class Tache:
+    """Traitement soumis : statut, progression, messages et résultat
+
+    Expose progress(valeur, text) comme une barre de progression Streamlit pour le pipeline.
+    """
+
+    def __init__(self, identifiant, cle, cle_contenu, nom_fichier, options, tracer_memoire=False, profiler=False):
+        self.id = identifiant
+        self.cle = cle
+        self.cle_contenu = cle_contenu
+        self.nom_fichier = nom_fichier
+        self.options = options
+        self.tracer_memoire = tracer_memoire
+        self.profiler = profiler
+        self.profil = None
+        self.source = None
+        self.statut = EN_ATTENTE
+        self.progression = 0
+        self.texte = "En attente..."
+        self.avertissements = []
+        self.resultat = None
+        self.erreur = None
+        self.soumise = time.time()
+        self.debut = None
+        self.fin = None
+
+    def progress(self, valeur, text=""):
+        """Appelé par le pipeline à chaque étape"""
+        self.progression = valeur
+        self.texte = text
+
+    @property
+    def terminee(self):
+        """Vrai une fois le traitement réussi ou échoué"""
+        return self.statut in (TERMINEE, ECHOUEE)
+
+def cle_tache(cle_contenu, options):
+    """Clé de regroupement : contenu du fichier et options du traitement"""
+    options_texte = json.dumps(
+        {nom: getattr(valeur, "chemin", valeur) for nom, valeur in options.items()},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(f"{cle_contenu}\0{options_texte}".encode()).hexdigest()
+
+class FileTraitements:
+    """Pool de traitements en arrière-plan avec limite de concurrence et file bornée"""
+
+    def __init__(self, traitements_simultanes=TRAITEMENTS_SIMULTANES, file_attente_max=FILE_ATTENTE_MAX,
+                 taches_conservees=TACHES_CONSERVEES, cache=None):
+        self.file_attente_max = file_attente_max
+        self.taches_conservees = taches_conservees
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=traitements_simultanes, thread_name_prefix="crex")
+        self._taches = OrderedDict()
+        self._par_cle = {}
+        self._verrou = threading.Lock()
+        # tracemalloc est global : un seul traitement mesuré ou profilé à la fois
+        self._verrou_mesures = threading.Lock()
+
+    def obtenir(self, identifiant):
+        """Tâche connue par son identifiant, ou None si inconnue ou oubliée"""
+        with self._verrou:
+            return self._taches.get(identifiant)
+
+    def position(self, tache):
+        """Rang dans la file d'attente (1 = prochaine à démarrer), 0 si la tâche n'attend pas"""
+        with self._verrou:
+            if tache.statut != EN_ATTENTE:
+                return 0
+            en_attente = [t for t in self._taches.values() if t.statut == EN_ATTENTE]
+            return en_attente.index(tache) + 1
+
+    def soumettre(self, fichier, nom_fichier, options, reutiliser_terminee=True, tracer_memoire=False,
+                  profiler=False):
+        """Soumet un traitement ou retourne la tâche identique déjà connue
+
+        fichier : fichier ouvert (téléversé), ou liste de fichiers à fusionner, copiés sur disque
+        le temps du traitement.
+        options : arguments de traiter_exactement_comme_vba.
+        reutiliser_terminee : faux si le résultat dépend d'un état extérieur (mode incrémental).
+        profiler : capture cProfile et tracemalloc (crex_core.ProfilExecution) dans tache.profil.
+        Lève FileAttentePleine si la file d'attente est pleine.
+        """
+        cle_contenu = crex_core.cle_resultat(fichier)
+        cle = cle_tache(cle_contenu, {**options, "tracer_memoire": tracer_memoire, "profiler": profiler})
+        with self._verrou:
+            existante = self._taches.get(self._par_cle.get(cle))
+            # Une tâche en attente ou en cours est toujours partagée, une tâche échouée jamais
+            if existante and (not existante.terminee or (existante.statut == TERMINEE and reutiliser_terminee)):
+                return existante
+            if sum(t.statut == EN_ATTENTE for t in self._taches.values()) >= self.file_attente_max:
+                raise FileAttentePleine(
+                    f"{self.file_attente_max} traitements sont déjà en attente, réessayez dans quelques minutes."
+                )
+            tache = Tache(uuid.uuid4().hex, cle, cle_contenu, nom_fichier, options, tracer_memoire, profiler)
+            self._taches[tache.id] = tache
+            self._par_cle[cle] = tache.id
+            self._purger()
+        # Copie sur disque : le téléversement peut disparaître avant le démarrage
+        copies = []
+        try:
+            for chaque_fichier in fichier if isinstance(fichier, (list, tuple)) else [fichier]:
+                copies.append(crex_core.copier_source_temporaire(chaque_fichier))
+            tache.source = copies if isinstance(fichier, (list, tuple)) else copies[0]
+            self._executor.submit(self._executer, tache)
+        except Exception as e:
+            # Disque plein, fichier illisible : la tâche échoue et n'est plus partagée, une nouvelle
+            # soumission du même fichier repart de zéro
+            for copie in copies:
+                os.remove(copie)
+            with self._verrou:
+                tache.erreur = f"Erreur lors de la copie du fichier: {str(e)}"
+                tache.statut = ECHOUEE
+                tache.fin = time.time()
+                if self._par_cle.get(cle) == tache.id:
+                    del self._par_cle[cle]
+        return tache
+
+    def _purger(self):
+        """Oublie les tâches terminées les plus anciennes au-delà du nombre conservé"""
+        terminees = [t for t in self._taches.values() if t.terminee]
+        for tache in terminees[:max(0, len(terminees) - self.taches_conservees)]:
+            del self._taches[tache.id]
+            if self._par_cle.get(tache.cle) == tache.id:
+                del self._par_cle[tache.cle]
+
+    def _executer(self, tache):
+        """Exécute le pipeline dans un thread du pool et range le résultat dans la tâche"""
+        tache.statut = EN_COURS
+        tache.debut = time.time()
+        tache.progress(0, "Initialisation...")
+        durees = {}
+        mesures = crex_core.Mesures(tracer_memoire=tache.tracer_memoire)
+        journal = JournalTache(tache)
+        crex_core.logger.addHandler(journal)
+        if tache.profiler:
+            tache.profil = crex_core.ProfilExecution()
+        verrou_mesures = self._verrou_mesures if tache.tracer_memoire or tache.profiler else None
+        if verrou_mesures is not None and not verrou_mesures.acquire(blocking=False):
+            tache.progress(0, "En attente de la fin d'un autre traitement mesuré...")
+            verrou_mesures.acquire()
+        try:
+            with tache.profil.capturer() if tache.profil else nullcontext():
+                excel_output, erreur, df_all = crex_core.traiter_exactement_comme_vba(
+                    tache.source, tache, durees=durees, mesures=mesures, **tache.options
+                )
+            sans_excel = tache.options.get("sans_excel", False)
+            if erreur or (excel_output is None and not sans_excel):
+                tache.erreur = erreur or "Erreur lors de la création du fichier"
+                tache.statut = ECHOUEE
+                return
+            # Synthèse pré-calculée une fois, conservée avec le résultat
+            with mesures.span("synthese") as span:
+                synthese = crex_core.construire_synthese(df_all)
+                span["lignes_entree"] = len(df_all)
+                span["lignes_sortie"] = sum(len(agregats) for agregats in synthese.values())
+            # Classeur écrit dans un fichier temporaire (mémoire bornée ou plan sur disque)
+            en_memoire = not isinstance(excel_output, tempfile.SpooledTemporaryFile)
+            resultat = {
+                'excel': excel_output.getvalue() if en_memoire and excel_output else excel_output,
+                'df_all': df_all, 'durees': durees, 'spans': mesures.spans, 'synthese': synthese,
+            }
+            # Résultat partagé avec le cache de l'application quand il ne dépend que du fichier
+            # (durées faussées par le profilage : pas de mise en cache)
+            if (self.cache is not None and en_memoire and not sans_excel and not tache.profiler
+                    and tache.options.get("historique") is None):
+                resultat = self.cache.put(tache.cle_contenu, resultat['excel'], df_all, durees, mesures.spans,
+                                          synthese)
+            tache.resultat = resultat
+            tache.statut = TERMINEE
+        except Exception as e:
+            tache.erreur = f"Erreur lors du traitement: {str(e)}"
+            tache.statut = ECHOUEE
+        finally:
+            if verrou_mesures is not None:
+                verrou_mesures.release()
+            crex_core.logger.removeHandler(journal)
+            tache.fin = time.time()
+            for source in tache.source if isinstance(tache.source, list) else [tache.source]:
+                os.remove(source)
+            if crex_core.JOURNAL_METRIQUES:
+                contexte = {nom: valeur for nom, valeur in tache.options.items() if isinstance(valeur, (str, int))}
+                mesures.ajouter_au_journal(crex_core.JOURNAL_METRIQUES, fichier=tache.nom_fichier,
+                                           erreur=tache.erreur, **contexte)